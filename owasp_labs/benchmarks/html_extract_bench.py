@@ -0,0 +1,93 @@
+"""
+Benchmark HTML text extraction for the web scraping tool.
+
+Compares the previous approach (full BeautifulSoup parse of the whole body,
+then truncation to 5000 characters) with the incremental extractor fed in
+64 KiB chunks, on generated pages of increasing size.
+
+Usage:
+    python -m benchmarks.html_extract_bench --sizes 100000 1000000 10000000
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+from tools.html_extract import StreamingTextExtractor, etree
+
+CHUNK_SIZE = 64 * 1024
+MAX_CHARS = 5000
+
+_BLOCK = (
+    "<div class='post'><h2>Article heading</h2>"
+    "<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua.</p>"
+    "<script>window.analytics = {track: function (e) { return e; }};</script>"
+    "<style>.post { margin: 0 auto; padding: 1em; }</style></div>\n"
+)
+
+
+def make_page(size: int) -> bytes:
+    """Generate an HTML page of roughly `size` bytes."""
+    body = _BLOCK * max(1, size // len(_BLOCK))
+    return f"<html><head><title>Fixture</title></head><body>{body}</body></html>".encode()
+
+
+def bs4_extract(content: bytes) -> str:
+    """The previous extraction path: parse everything, then truncate."""
+    soup = BeautifulSoup(content, "html.parser")
+    for script in soup(["script", "style"]):
+        script.decompose()
+    text_content = soup.get_text()
+    lines = (line.strip() for line in text_content.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return " ".join(chunk for chunk in chunks if chunk)[:MAX_CHARS]
+
+
+def streaming_extract(content: bytes, backend: str) -> str:
+    extractor = StreamingTextExtractor(MAX_CHARS, backend=backend)
+    for offset in range(0, len(content), CHUNK_SIZE):
+        extractor.feed(content[offset : offset + CHUNK_SIZE].decode("utf-8"))
+        if extractor.done:
+            break
+    else:
+        extractor.close()
+    return extractor.text
+
+
+def measure(func, *args, repeat: int = 3) -> tuple:
+    """Return (best seconds, peak traced bytes) for a call."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+
+    # Memory is traced in a separate run since tracing slows the parser down
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main(args: argparse.Namespace) -> None:
+    backends = ["html.parser"] + (["lxml"] if etree is not None else [])
+    print(f"{'page bytes':>11} {'method':>18} {'ms':>9} {'peak KiB':>10}")
+    for size in args.sizes:
+        page = make_page(size)
+        runs = [("bs4 (previous)", bs4_extract, (page,), 1)]
+        runs += [(f"stream/{b}", streaming_extract, (page, b), 3) for b in backends]
+        for name, func, func_args, repeat in runs:
+            elapsed, peak = measure(func, *func_args, repeat=repeat)
+            print(f"{len(page):>11} {name:>18} {elapsed * 1000:>9.1f} {peak / 1024:>10.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[100_000, 1_000_000, 10_000_000]
+    )
+    main(parser.parse_args())
@@ -0,0 +1,110 @@
+"""
+Latency of other labs while the LLM08 RAG endpoint is under load.
+
+Probes one endpoint sequentially, first on an idle server and then while
+concurrent clients hammer /llm08/chat. LLM08 embeds, searches and completes
+for every request; as long as none of that blocks the event loop the probe
+latency should stay close to the upstream latency in both phases.
+
+Usage:
+    python -m benchmarks.llm08_concurrency_bench --latency 0.1 --load 10
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.mock_upstream import start_mock_upstream
+
+
+async def _probe(client: httpx.AsyncClient, endpoint: str, count: int) -> list:
+    """Send `count` sequential requests and return their latencies in ms."""
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = await client.post(
+            endpoint, json={"message": "hello", "api_key": "sk-probe"}
+        )
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def _report(phase: str, latencies: list, llm08_requests: int, seconds: float) -> None:
+    p95 = statistics.quantiles(latencies, n=20)[-1]
+    print(
+        f"{phase:>8} {statistics.median(latencies):>9.1f} {p95:>9.1f} "
+        f"{max(latencies):>9.1f} {llm08_requests / seconds:>12.1f}"
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    os.environ["OPENAI_BASE_URL"] = start_mock_upstream(args.latency)
+    # Keep the LLM08 stores and embedding cache out of the working tree
+    os.chdir(tempfile.mkdtemp(prefix="llm08-bench-"))
+
+    # Import after OPENAI_BASE_URL is set so clients pick up the mock upstream
+    from server import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://lab", timeout=120
+    ) as client:
+        # Build the tenants' knowledge bases before measuring
+        await asyncio.gather(
+            *(
+                client.post("/llm08/chat", json={"message": "hi", "api_key": f"sk-{i}"})
+                for i in range(args.tenants)
+            )
+        )
+
+        print(
+            f"upstream latency: {args.latency * 1000:.0f} ms, probe: {args.endpoint}, "
+            f"LLM08 load: {args.load} clients over {args.tenants} keys"
+        )
+        print(
+            f"{'phase':>8} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'llm08 req/s':>12}"
+        )
+
+        start = time.perf_counter()
+        latencies = await _probe(client, args.endpoint, args.probes)
+        _report("idle", latencies, 0, time.perf_counter() - start)
+
+        completed = 0
+        stop = asyncio.Event()
+
+        async def llm08_client(i: int) -> None:
+            nonlocal completed
+            payload = {
+                "message": "How do I reset my password?",
+                "api_key": f"sk-{i % args.tenants}",
+            }
+            while not stop.is_set():
+                response = await client.post("/llm08/chat", json=payload)
+                response.raise_for_status()
+                completed += 1
+
+        load = [asyncio.create_task(llm08_client(i)) for i in range(args.load)]
+        await asyncio.sleep(args.latency * 5)
+        completed = 0
+        start = time.perf_counter()
+        latencies = await _probe(client, args.endpoint, args.probes)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await asyncio.gather(*load)
+        _report("loaded", latencies, completed, elapsed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--endpoint", default="/llm02/chat")
+    parser.add_argument("--load", type=int, default=10)
+    parser.add_argument("--tenants", type=int, default=10)
+    parser.add_argument("--probes", type=int, default=40)
+    asyncio.run(main(parser.parse_args()))
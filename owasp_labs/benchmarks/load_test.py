@@ -0,0 +1,80 @@
+"""
+Load test for the lab chat endpoints against a local mock upstream.
+
+Drives the FastAPI app in-process at increasing concurrency levels and reports
+throughput. With a non-blocking request path throughput should scale roughly
+linearly with concurrency until the upstream latency stops being the bottleneck.
+
+Usage:
+    python -m benchmarks.load_test --latency 0.2 --concurrency 1 10 50 100 200
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+
+from benchmarks.mock_upstream import start_mock_upstream
+
+
+async def _run_level(app, endpoint: str, concurrency: int, total: int) -> dict:
+    """Send `total` requests with at most `concurrency` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://lab", timeout=60
+    ) as client:
+
+        async def one(i: int):
+            nonlocal errors
+            # Distinct messages so no request is coalesced with another
+            payload = {"message": f"hello {i}", "api_key": "sk-mock"}
+            async with semaphore:
+                response = await client.post(endpoint, json=payload)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "seconds": elapsed,
+        "throughput": total / elapsed,
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    os.environ["OPENAI_BASE_URL"] = start_mock_upstream(args.latency)
+
+    # Import after OPENAI_BASE_URL is set so clients pick up the mock upstream
+    from server import app
+
+    print(f"upstream latency: {args.latency * 1000:.0f} ms, endpoint: {args.endpoint}")
+    print(f"{'concurrency':>12} {'requests':>9} {'errors':>7} {'seconds':>8} {'req/s':>8}")
+    for concurrency in args.concurrency:
+        total = max(args.min_requests, concurrency * args.rounds)
+        result = await _run_level(app, args.endpoint, concurrency, total)
+        print(
+            f"{result['concurrency']:>12} {result['requests']:>9} {result['errors']:>7} "
+            f"{result['seconds']:>8.2f} {result['throughput']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--endpoint", default="/llm02/chat")
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 10, 50, 100, 200]
+    )
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--min-requests", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
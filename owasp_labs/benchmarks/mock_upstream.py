@@ -0,0 +1,320 @@
+"""
+OpenAI-compatible mock upstream used by the benchmarks.
+
+It answers /v1/chat/completions and /v1/embeddings so that the lab server's
+own overhead and concurrency can be measured without calling the real OpenAI
+API. Behaviour is controlled through `mock_app.state` (or the command line
+when run as a separate process, or POST /mock/config at runtime):
+
+- latency: mean time to first token, in seconds
+- latency_distribution: "fixed", "uniform", "exponential" or "lognormal"
+- latency_jitter: spread of the distribution (uniform half-width, or
+  lognormal sigma); ignored by "fixed" and "exponential"
+- tokens_per_second: generation speed after the first token (0 = instant)
+- completion_tokens: tokens in every completion
+- tool_rounds: tool-call rounds to request before answering when tools are
+  offered, with tool_arguments as the call arguments
+- embedding_dim: length of the deterministic embedding vectors
+- prompt_cache_min_chars: prompts at least this long report the longest
+  previously seen prefix as `prompt_tokens_details.cached_tokens`, like
+  provider prompt caching (in 512-character blocks; 0 disables)
+
+Usage:
+    python -m benchmarks.mock_upstream --port 8001 --latency 0.3 \\
+        --latency-distribution lognormal --tokens-per-second 50
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+mock_app = FastAPI(title="Mock OpenAI upstream")
+mock_app.state.latency = 0.2
+mock_app.state.latency_distribution = "fixed"
+mock_app.state.latency_jitter = 0.5
+mock_app.state.tokens_per_second = 0.0
+mock_app.state.completion_tokens = 3
+# Number of tool-call rounds to request before answering when tools are offered
+mock_app.state.tool_rounds = 0
+mock_app.state.tool_arguments = {"url": "http://127.0.0.1:1338"}
+mock_app.state.embedding_dim = 1536
+# About 1024 tokens at four characters per token
+mock_app.state.prompt_cache_min_chars = 4096
+
+_OPTIONS = (
+    "latency",
+    "latency_distribution",
+    "latency_jitter",
+    "tokens_per_second",
+    "completion_tokens",
+    "tool_rounds",
+    "tool_arguments",
+    "embedding_dim",
+    "prompt_cache_min_chars",
+)
+_WORDS = ["mock", "streamed", "response", "token", "from", "the", "fake", "model"]
+
+
+def _first_token_delay() -> float:
+    """Sample a time-to-first-token from the configured distribution."""
+    state = mock_app.state
+    mean, jitter = state.latency, state.latency_jitter
+    if mean <= 0:
+        return 0.0
+    if state.latency_distribution == "uniform":
+        return max(0.0, random.uniform(mean - jitter, mean + jitter))
+    if state.latency_distribution == "exponential":
+        return random.expovariate(1 / mean)
+    if state.latency_distribution == "lognormal":
+        # Parameterised so the distribution's mean stays at `latency`
+        return random.lognormvariate(np.log(mean) - jitter**2 / 2, jitter)
+    return mean
+
+
+def _token_delay() -> float:
+    rate = mock_app.state.tokens_per_second
+    return 1 / rate if rate > 0 else 0.0
+
+
+def _completion_words() -> list:
+    count = mock_app.state.completion_tokens
+    return [(" " if i else "") + _WORDS[i % len(_WORDS)] for i in range(count)]
+
+
+_PROMPT_CACHE_BLOCK_CHARS = 512
+_PROMPT_CACHE_SIZE = 100000
+# Digests of prompt prefixes seen recently, least recently used first
+_prompt_prefixes: "OrderedDict[bytes, None]" = OrderedDict()
+
+
+def _cached_prompt_chars(body: dict) -> int:
+    """Length of the longest block-aligned prompt prefix seen before."""
+    min_chars = mock_app.state.prompt_cache_min_chars
+    text = json.dumps(body.get("messages", []), sort_keys=True).encode("utf-8")
+    if not min_chars or len(text) < min_chars:
+        return 0
+    cached = 0
+    digest = hashlib.sha256()
+    for end in range(
+        _PROMPT_CACHE_BLOCK_CHARS, len(text) + 1, _PROMPT_CACHE_BLOCK_CHARS
+    ):
+        digest.update(text[end - _PROMPT_CACHE_BLOCK_CHARS : end])
+        key = digest.copy().digest()
+        if key in _prompt_prefixes:
+            _prompt_prefixes.move_to_end(key)
+            if end >= min_chars:
+                cached = end
+        else:
+            _prompt_prefixes[key] = None
+    while len(_prompt_prefixes) > _PROMPT_CACHE_SIZE:
+        _prompt_prefixes.popitem(last=False)
+    return cached
+
+
+def _usage(body: dict, completion_tokens: int) -> dict:
+    prompt = sum(
+        len(str(message.get("content") or "")) for message in body.get("messages", [])
+    )
+    prompt_tokens = prompt // 4 + 1
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {
+            "cached_tokens": min(prompt_tokens, _cached_prompt_chars(body) // 4)
+        },
+    }
+
+
+def _tool_calls(body: dict) -> list:
+    """Tool calls to return for this request, if any."""
+    tools = body.get("tools")
+    if not tools:
+        return []
+    rounds = sum(1 for message in body.get("messages", []) if message.get("tool_calls"))
+    if rounds >= mock_app.state.tool_rounds:
+        return []
+    return [
+        {
+            "id": f"call_{rounds}_{i}",
+            "type": "function",
+            "function": {
+                "name": tool["function"]["name"],
+                "arguments": json.dumps(mock_app.state.tool_arguments),
+            },
+        }
+        for i, tool in enumerate(tools)
+    ]
+
+
+def _chunk(body: dict, delta: dict, usage=None) -> str:
+    chunk = {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-3.5-turbo"),
+        "choices": (
+            [{"index": 0, "delta": delta, "finish_reason": None}]
+            if delta is not None
+            else []
+        ),
+        "usage": usage,
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+async def _stream(body: dict):
+    await asyncio.sleep(_first_token_delay())
+    tool_calls = _tool_calls(body)
+    for index, tool_call in enumerate(tool_calls):
+        yield _chunk(body, {"tool_calls": [{"index": index, **tool_call}]})
+    words = [] if tool_calls else _completion_words()
+    for i, word in enumerate(words):
+        if i:
+            await asyncio.sleep(_token_delay())
+        yield _chunk(body, {"content": word})
+    yield _chunk(body, None, _usage(body, len(words)))
+    yield "data: [DONE]\n\n"
+
+
+@mock_app.post("/v1/chat/completions")
+async def chat_completions(body: dict):
+    if body.get("stream"):
+        return StreamingResponse(_stream(body), media_type="text/event-stream")
+    tool_calls = _tool_calls(body)
+    words = [] if tool_calls else _completion_words()
+    await asyncio.sleep(_first_token_delay() + _token_delay() * max(0, len(words) - 1))
+    message = {"role": "assistant", "content": "".join(words)}
+    if tool_calls:
+        message = {"role": "assistant", "content": None, "tool_calls": tool_calls}
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-3.5-turbo"),
+        "choices": [
+            {
+                "index": 0,
+                "message": message,
+                "finish_reason": "tool_calls" if tool_calls else "stop",
+            }
+        ],
+        "usage": _usage(body, len(words)),
+    }
+
+
+def _embedding(text: str, dim: int = 1536) -> np.ndarray:
+    """Deterministic pseudo-embedding derived from the text."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+
+@mock_app.post("/v1/embeddings")
+async def embeddings(body: dict):
+    await asyncio.sleep(_first_token_delay())
+    inputs = body["input"]
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    data = []
+    for index, text in enumerate(inputs):
+        vector = _embedding(
+            text, body.get("dimensions") or mock_app.state.embedding_dim
+        )
+        if body.get("encoding_format") == "base64":
+            embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+        else:
+            embedding = vector.tolist()
+        data.append({"object": "embedding", "index": index, "embedding": embedding})
+    tokens = sum(len(text) // 4 + 1 for text in inputs)
+    return {
+        "object": "list",
+        "data": data,
+        "model": body.get("model", "text-embedding-ada-002"),
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
+
+
+@mock_app.get("/mock/config")
+async def get_config():
+    return {name: getattr(mock_app.state, name) for name in _OPTIONS}
+
+
+@mock_app.post("/mock/config")
+async def set_config(body: dict):
+    """Change behaviour of a running mock, e.g. between benchmark phases."""
+    configure(**{name: value for name, value in body.items() if name in _OPTIONS})
+    return await get_config()
+
+
+def configure(**options) -> None:
+    """Set mock behaviour; see the module docstring for the option names."""
+    for name, value in options.items():
+        if name not in _OPTIONS:
+            raise ValueError(f"Unknown mock upstream option: {name}")
+        setattr(mock_app.state, name, value)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_upstream(latency: float = 0.2, tool_rounds: int = 0, **options) -> str:
+    """
+    Start the mock upstream in a background thread.
+
+    Returns:
+        str: Base URL to use as OPENAI_BASE_URL
+    """
+    configure(latency=latency, tool_rounds=tool_rounds, **options)
+    port = _free_port()
+    config = uvicorn.Config(mock_app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}/v1"
+
+
+if __name__ == "__main__":
+    # Run as a separate process so it does not compete with the code under test
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the mock OpenAI upstream")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument(
+        "--latency-distribution",
+        choices=["fixed", "uniform", "exponential", "lognormal"],
+        default="fixed",
+    )
+    parser.add_argument("--latency-jitter", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--completion-tokens", type=int, default=3)
+    parser.add_argument("--tool-rounds", type=int, default=0)
+    parser.add_argument("--embedding-dim", type=int, default=1536)
+    parser.add_argument("--prompt-cache-min-chars", type=int, default=4096)
+    args = parser.parse_args()
+    configure(
+        latency=args.latency,
+        latency_distribution=args.latency_distribution,
+        latency_jitter=args.latency_jitter,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        tool_rounds=args.tool_rounds,
+        embedding_dim=args.embedding_dim,
+        prompt_cache_min_chars=args.prompt_cache_min_chars,
+    )
+    uvicorn.run(mock_app, host="127.0.0.1", port=args.port, log_level="warning")
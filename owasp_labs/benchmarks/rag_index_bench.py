@@ -0,0 +1,114 @@
+"""
+Recall-vs-latency benchmark for the LLM08 vector index backends.
+
+Builds a temporary VectorStore of clustered random embeddings, then measures
+build time, per-query latency and recall@k against exact search for the
+exact, IVF (several nprobe values) and HNSW (several efSearch values) backends.
+
+Usage:
+    python -m benchmarks.rag_index_bench --sizes 10000 100000 --dim 384
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from utils import vector_index
+from utils.vector_index import HNSWIndex, IVFIndex, VectorIndex
+from utils.vector_store import VectorStore
+
+
+def make_corpus(size: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    """Embeddings grouped around random topics, like a real document corpus."""
+    centers = rng.standard_normal((max(1, size // 100), dim), dtype=np.float32)
+    labels = rng.integers(0, len(centers), size)
+    noise = rng.standard_normal((size, dim), dtype=np.float32)
+    return centers[labels] + 0.5 * noise
+
+
+def run_queries(index: VectorIndex, queries: np.ndarray, top_k: int):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(index.search(query, top_k))
+        latencies.append(time.perf_counter() - start)
+    return results, np.asarray(latencies) * 1000
+
+
+def recall(results, truth) -> float:
+    hits = sum(len(set(r.tolist()) & set(t.tolist())) for r, t in zip(results, truth))
+    return hits / sum(len(t) for t in truth)
+
+
+def report(name: str, build_s: float, latencies: np.ndarray, rec: float) -> None:
+    print(
+        f"{name:>18} {build_s:>9.2f} {latencies.mean():>9.3f} "
+        f"{np.percentile(latencies, 95):>9.3f} {rec:>8.3f}"
+    )
+
+
+def main(args: argparse.Namespace) -> None:
+    if vector_index.faiss is None:
+        print("faiss is not installed; only exact search is available")
+    rng = np.random.default_rng(0)
+
+    for size in args.sizes:
+        corpus = make_corpus(size, args.dim, rng)
+        picks = rng.integers(0, size, args.queries)
+        queries = corpus[picks] + 0.3 * rng.standard_normal(
+            (args.queries, args.dim), dtype=np.float32
+        )
+
+        with tempfile.TemporaryDirectory() as path:
+            store = VectorStore(path)
+            for start in range(0, size, 10_000):
+                chunk = corpus[start : start + 10_000]
+                store.extend(
+                    [f"doc {i}" for i in range(start, start + len(chunk))], chunk
+                )
+
+            print(f"\n{size} documents, dim={args.dim}, top_k={args.top_k}")
+            print(
+                f"{'backend':>18} {'build s':>9} {'mean ms':>9} {'p95 ms':>9} {'recall':>8}"
+            )
+
+            exact = VectorIndex(store)
+            truth, latencies = run_queries(exact, queries, args.top_k)
+            report("exact", 0.0, latencies, 1.0)
+            if vector_index.faiss is None:
+                continue
+
+            faiss = vector_index.faiss
+            vector_index.IVF_MIN_TRAIN = min(vector_index.IVF_MIN_TRAIN, size)
+            start = time.perf_counter()
+            ivf = IVFIndex(store)
+            ivf.sync()
+            build = time.perf_counter() - start
+            for nprobe in args.nprobe:
+                faiss.extract_index_ivf(ivf.index).nprobe = nprobe
+                results, latencies = run_queries(ivf, queries, args.top_k)
+                report(f"ivf nprobe={nprobe}", build, latencies, recall(results, truth))
+
+            start = time.perf_counter()
+            hnsw = HNSWIndex(store)
+            hnsw.sync()
+            build = time.perf_counter() - start
+            for ef in args.ef_search:
+                faiss.downcast_index(hnsw.index.index).hnsw.efSearch = ef
+                results, latencies = run_queries(hnsw, queries, args.top_k)
+                report(f"hnsw ef={ef}", build, latencies, recall(results, truth))
+            store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    main(parser.parse_args())
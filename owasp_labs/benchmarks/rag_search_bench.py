@@ -0,0 +1,86 @@
+"""
+Benchmark LLM08 similarity search.
+
+Compares the previous per-document Python loop (lists of floats, norms
+recomputed per pair, full sort) with the vectorized float32 search used by
+VulnerableRAG.retrieve_similar, on random embeddings.
+
+A 1M x 1536 float32 matrix needs about 6 GiB of memory; pass a smaller --dim
+to run the largest size on a small machine.
+
+Usage:
+    python -m benchmarks.rag_search_bench --sizes 10000 100000 1000000 --dim 1536
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from utils.vector_index import top_k_similar
+
+
+def legacy_search(embeddings: list, query: list, top_k: int) -> list:
+    """The previous retrieve_similar loop."""
+    similarities = []
+    for i, doc_embedding in enumerate(embeddings):
+        vec1 = np.array(query)
+        vec2 = np.array(doc_embedding)
+        similarity = np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
+        similarities.append((similarity, i))
+    similarities.sort(reverse=True)
+    return [i for _, i in similarities[:top_k]]
+
+
+def best_of(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(args: argparse.Namespace) -> None:
+    rng = np.random.default_rng(0)
+    print(f"dim={args.dim} top_k={args.top_k}")
+    print(f"{'documents':>10} {'legacy ms':>11} {'vectorized ms':>14} {'speedup':>8}")
+    for size in args.sizes:
+        matrix = rng.standard_normal((size, args.dim), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1)
+        query = rng.standard_normal(args.dim, dtype=np.float32)
+
+        vectorized = best_of(
+            lambda: top_k_similar(matrix, norms, query, args.top_k), args.repeat
+        )
+
+        legacy = None
+        if size <= args.legacy_max:
+            embeddings = matrix.tolist()
+            query_list = query.tolist()
+            legacy = best_of(
+                lambda: legacy_search(embeddings, query_list, args.top_k), 1
+            )
+            del embeddings
+
+        legacy_ms = f"{legacy * 1000:>11.1f}" if legacy is not None else f"{'skipped':>11}"
+        speedup = f"{legacy / vectorized:>7.0f}x" if legacy is not None else f"{'-':>8}"
+        print(f"{size:>10} {legacy_ms} {vectorized * 1000:>14.2f} {speedup}")
+        del matrix, norms
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--legacy-max",
+        type=int,
+        default=100_000,
+        help="largest corpus to run the slow legacy loop on",
+    )
+    main(parser.parse_args())
@@ -0,0 +1,168 @@
+"""
+Startup time, throughput and graceful shutdown of the production server mode.
+
+Runs the mock upstream and `server.py` as real processes and, for each worker
+count, measures:
+
+- startup: seconds from launch until the server answers
+- throughput: requests per second and latency at a fixed client concurrency
+- drain: whether requests in flight when SIGTERM arrives still succeed
+
+Throughput only scales with workers up to the number of CPU cores.
+
+Usage:
+    python -m benchmarks.server_bench --workers 1 2 4 8 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.mock_upstream import _free_port
+
+LABS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _payload(i: int) -> dict:
+    # Distinct messages so no request is coalesced with another
+    return {"message": f"hello {i}", "api_key": "sk-mock"}
+
+
+def _wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60) -> float:
+    """Poll until the server answers; returns the elapsed seconds."""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return time.perf_counter() - start
+        except httpx.TransportError:
+            pass
+        time.sleep(0.02)
+    raise TimeoutError(f"{url} did not start within {timeout} seconds")
+
+
+async def _throughput(base_url: str, endpoint: str, concurrency: int, seconds: float):
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, timeout=60, limits=limits
+    ) as client:
+        deadline = time.perf_counter() + seconds
+        sent = itertools.count()
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    response = await client.post(endpoint, json=_payload(next(sent)))
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                except httpx.HTTPError:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, latencies, errors
+
+
+async def _drain(base_url: str, endpoint: str, process: subprocess.Popen) -> str:
+    """Send SIGTERM while requests are in flight and count how many complete."""
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        requests = [
+            asyncio.create_task(client.post(endpoint, json=_payload(i)))
+            for i in range(8)
+        ]
+        await asyncio.sleep(0.05)
+        process.send_signal(signal.SIGTERM)
+        results = await asyncio.gather(*requests, return_exceptions=True)
+    ok = sum(
+        1 for r in results if isinstance(r, httpx.Response) and r.status_code == 200
+    )
+    return f"{ok}/{len(results)}"
+
+
+def main(args: argparse.Namespace) -> None:
+    workdir = tempfile.mkdtemp(prefix="server-bench-")
+    mock_port = _free_port()
+    mock = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.mock_upstream",
+            "--port",
+            str(mock_port),
+            "--latency",
+            str(args.latency),
+        ],
+        cwd=LABS_DIR,
+    )
+    try:
+        _wait_until_up(f"http://127.0.0.1:{mock_port}/docs", mock)
+        print(
+            f"upstream latency: {args.latency * 1000:.0f} ms, endpoint: {args.endpoint}, "
+            f"concurrency: {args.concurrency}, CPUs: {os.cpu_count()}"
+        )
+        print(
+            f"{'workers':>8} {'startup s':>10} {'req/s':>8} {'p50 ms':>8} "
+            f"{'p99 ms':>8} {'errors':>7} {'drained':>8}"
+        )
+        for workers in args.workers:
+            port = _free_port()
+            env = dict(
+                os.environ,
+                OPENAI_BASE_URL=f"http://127.0.0.1:{mock_port}/v1",
+                WEB_CONCURRENCY=str(workers),
+                PORT=str(port),
+            )
+            # Run from a scratch directory so lab state stays out of the tree
+            server = subprocess.Popen(
+                [sys.executable, os.path.join(LABS_DIR, "server.py")],
+                cwd=workdir,
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            base_url = f"http://127.0.0.1:{port}"
+            try:
+                startup = _wait_until_up(f"{base_url}/stats", server)
+                rps, latencies, errors = asyncio.run(
+                    _throughput(base_url, args.endpoint, args.concurrency, args.seconds)
+                )
+                drained = asyncio.run(_drain(base_url, args.endpoint, server))
+                server.wait(timeout=60)
+            finally:
+                if server.poll() is None:
+                    server.kill()
+            p99 = statistics.quantiles(latencies, n=100)[-1] if latencies else 0
+            print(
+                f"{workers:>8} {startup:>10.2f} {rps:>8.1f} "
+                f"{statistics.median(latencies) * 1000 if latencies else 0:>8.1f} "
+                f"{p99 * 1000:>8.1f} {errors:>7} {drained:>8}"
+            )
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--endpoint", default="/llm02/chat")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=10)
+    main(parser.parse_args())
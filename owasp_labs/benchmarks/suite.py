@@ -0,0 +1,358 @@
+"""
+Benchmark suite for every lab endpoint against the mock OpenAI upstream.
+
+Starts the mock upstream and `server.py` as separate processes, drives each
+/llmXX/chat endpoint at each concurrency level, and reports latency
+percentiles, throughput and the server's CPU and memory use. Results are
+written as JSON; pass a previous result file with --compare to flag
+throughput or p95 regressions (the exit code is 1 when any are found).
+
+CPU and memory are read with psutil when it is installed, otherwise from
+/proc on Linux, and include all server worker processes.
+
+Usage:
+    python -m benchmarks.suite --concurrency 1 10 50 --output bench.json
+    python -m benchmarks.suite --compare bench.json --output bench-new.json
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.mock_upstream import _free_port
+from benchmarks.server_bench import LABS_DIR, _wait_until_up
+
+try:
+    import psutil
+except ImportError:  # psutil is optional, /proc is used instead
+    psutil = None
+
+ENDPOINTS = [
+    "/llm01/chat",
+    "/llm01_indirect/chat",
+    "/llm02/chat",
+    "/llm03/chat",
+    "/llm04/chat",
+    "/llm05/chat",
+    "/llm06/chat",
+    "/llm07/chat",
+    "/llm08/chat",
+    "/llm09/chat",
+    "/llm10/chat",
+]
+
+
+def _percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _proc_usage(pid: int) -> Optional[tuple]:
+    """CPU seconds and RSS bytes of one process from /proc, or None."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # Fields after the parenthesised command name; utime and stime
+            # are fields 14 and 15 of the full line
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm", "r") as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu = (int(fields[11]) + int(fields[12])) / ticks
+    return cpu, rss_pages * os.sysconf("SC_PAGE_SIZE"), int(fields[1])
+
+
+class ProcessSampler:
+    """Sample CPU time and resident memory of a process and its children."""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._cpu: Dict[int, float] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self) -> None:
+        usage = {}
+        if psutil is not None:
+            try:
+                root = psutil.Process(self.pid)
+                for process in [root] + root.children(recursive=True):
+                    with process.oneshot():
+                        times = process.cpu_times()
+                        usage[process.pid] = (
+                            times.user + times.system,
+                            process.memory_info().rss,
+                        )
+            except psutil.Error:
+                return
+        elif os.path.isdir("/proc"):
+            parents = {}
+            for name in os.listdir("/proc"):
+                if name.isdigit():
+                    sample = _proc_usage(int(name))
+                    if sample is not None:
+                        parents[int(name)] = sample
+            tree = {self.pid}
+            changed = True
+            while changed:
+                children = {
+                    pid for pid, (_, _, ppid) in parents.items() if ppid in tree
+                }
+                changed = not children <= tree
+                tree |= children
+            usage = {pid: parents[pid][:2] for pid in tree if pid in parents}
+        for pid, (cpu, _) in usage.items():
+            # Keep the last value of workers that exited
+            self._cpu[pid] = cpu
+        self.peak_rss = max(self.peak_rss, sum(rss for _, rss in usage.values()))
+
+    @property
+    def cpu_seconds(self) -> float:
+        return sum(self._cpu.values())
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self.peak_rss = 0
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+async def _run_level(
+    base_url: str, endpoint: str, concurrency: int, total: int, stream: bool
+) -> dict:
+    """Send `total` requests with at most `concurrency` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(
+        base_url=base_url, timeout=120, limits=limits
+    ) as client:
+
+        async def one(i: int):
+            nonlocal errors
+            # A few distinct keys so per-key state (LLM08 tenants) is exercised;
+            # distinct messages so no request is coalesced with another
+            payload = {"message": f"hello {i}", "api_key": f"sk-mock-{i % 4}"}
+            if stream:
+                payload["stream"] = True
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.post(endpoint, json=payload)
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                except httpx.HTTPError:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    result = {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed,
+    }
+    if latencies:
+        result.update(
+            {
+                "mean_ms": sum(latencies) / len(latencies) * 1000,
+                "p50_ms": _percentile(latencies, 50) * 1000,
+                "p95_ms": _percentile(latencies, 95) * 1000,
+                "p99_ms": _percentile(latencies, 99) * 1000,
+            }
+        )
+    return result
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=LABS_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[str]:
+    """Describe results that got worse than the baseline by more than threshold."""
+    previous = {(r["endpoint"], r["concurrency"]): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = previous.get((result["endpoint"], result["concurrency"]))
+        if old is None:
+            continue
+        label = f"{result['endpoint']} @ {result['concurrency']}"
+        if result["throughput"] < old["throughput"] * (1 - threshold):
+            regressions.append(
+                f"{label}: throughput {old['throughput']:.1f} -> {result['throughput']:.1f} req/s"
+            )
+        if "p95_ms" in old and result.get("p95_ms", float("inf")) > old["p95_ms"] * (
+            1 + threshold
+        ):
+            regressions.append(
+                f"{label}: p95 {old['p95_ms']:.1f} -> {result.get('p95_ms', float('inf')):.1f} ms"
+            )
+        if result["errors"] > old["errors"]:
+            regressions.append(f"{label}: errors {old['errors']} -> {result['errors']}")
+    return regressions
+
+
+def main(args: argparse.Namespace) -> int:
+    mock_port = _free_port()
+    mock = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.mock_upstream",
+            "--port",
+            str(mock_port),
+            "--latency",
+            str(args.latency),
+            "--latency-distribution",
+            args.latency_distribution,
+            "--latency-jitter",
+            str(args.latency_jitter),
+            "--tokens-per-second",
+            str(args.tokens_per_second),
+            "--completion-tokens",
+            str(args.completion_tokens),
+        ],
+        cwd=LABS_DIR,
+    )
+    server_port = _free_port()
+    server = None
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "config": vars(args),
+        },
+        "results": [],
+    }
+    try:
+        _wait_until_up(f"http://127.0.0.1:{mock_port}/mock/config", mock)
+        env = dict(
+            os.environ,
+            OPENAI_BASE_URL=f"http://127.0.0.1:{mock_port}/v1",
+            WEB_CONCURRENCY=str(args.workers),
+            PORT=str(server_port),
+        )
+        # Run from a scratch directory so lab state stays out of the tree
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(LABS_DIR, "server.py")],
+            cwd=tempfile.mkdtemp(prefix="bench-suite-"),
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        base_url = f"http://127.0.0.1:{server_port}"
+        report["meta"]["startup_seconds"] = _wait_until_up(f"{base_url}/stats", server)
+
+        print(
+            f"{'endpoint':>22} {'conc':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+            f"{'p99 ms':>8} {'errors':>7} {'cpu %':>7} {'rss MB':>7}"
+        )
+        for endpoint in args.endpoints:
+            for concurrency in args.concurrency:
+                total = max(args.min_requests, concurrency * args.rounds)
+                with ProcessSampler(server.pid) as sampler:
+                    cpu_start = sampler.cpu_seconds
+                    result = asyncio.run(
+                        _run_level(base_url, endpoint, concurrency, total, args.stream)
+                    )
+                result["cpu_percent"] = (
+                    (sampler.cpu_seconds - cpu_start) / result["seconds"] * 100
+                )
+                result["max_rss_mb"] = sampler.peak_rss / 2**20
+                report["results"].append(result)
+                print(
+                    f"{endpoint:>22} {concurrency:>5} {result['throughput']:>8.1f} "
+                    f"{result.get('p50_ms', 0):>8.1f} {result.get('p95_ms', 0):>8.1f} "
+                    f"{result.get('p99_ms', 0):>8.1f} {result['errors']:>7} "
+                    f"{result['cpu_percent']:>7.1f} {result['max_rss_mb']:>7.1f}"
+                )
+    finally:
+        for process in (server, mock):
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--min-requests", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument(
+        "--latency-distribution",
+        choices=["fixed", "uniform", "exponential", "lognormal"],
+        default="fixed",
+    )
+    parser.add_argument("--latency-jitter", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--completion-tokens", type=int, default=3)
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--compare", help="Previous results file to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="Allowed relative slowdown"
+    )
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,3 @@
+"""
+Red-team campaigns: run corpora of attack prompts against the labs.
+"""
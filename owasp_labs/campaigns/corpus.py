@@ -0,0 +1,108 @@
+"""
+Attack corpora for red-team campaigns.
+
+A corpus is a JSONL file with one attack per line:
+
+    {"id": "llm02-0001", "lab": "llm02", "message": "Ignore all previous ..."}
+
+`id` must be unique (it is how interrupted campaigns resume) and `lab` is the
+route prefix, e.g. "llm01_indirect" for /llm01_indirect/chat. Any other
+fields ("messages", "model", "temperature", "max_tokens", "api_key") are sent
+as part of the chat request.
+
+The seed corpus is built from the "prompt to break the lab" line in each
+handler's docstring.
+
+Usage:
+    python -m campaigns.corpus --output attacks.jsonl --repeat 1000
+"""
+
+import argparse
+import inspect
+import json
+import re
+from typing import Dict, Iterator
+
+LABS = [
+    "llm01",
+    "llm01_indirect",
+    "llm02",
+    "llm03",
+    "llm04",
+    "llm05",
+    "llm06",
+    "llm07",
+    "llm08",
+    "llm09",
+    "llm10",
+]
+
+_SEED_RE = re.compile(r"prompt to break the lab:\s*(.+)")
+
+
+def lab_handlers() -> Dict[str, object]:
+    """Handler coroutine of every lab, keyed by route prefix."""
+    # Imported here so HTTP campaigns do not load the labs themselves
+    import handlers
+
+    return {
+        "llm01": handlers.llm01_chat,
+        "llm01_indirect": handlers.llm01_indirect_chat,
+        "llm02": handlers.llm02_handler,
+        "llm03": handlers.llm03_handler,
+        "llm04": handlers.llm04_handler,
+        "llm05": handlers.llm05_handler,
+        "llm06": handlers.llm06_handler,
+        "llm07": handlers.llm07_handler,
+        "llm08": handlers.llm08_handler,
+        "llm09": handlers.llm09_handler,
+        "llm10": handlers.llm10_handler,
+    }
+
+
+def seed_prompts() -> Dict[str, str]:
+    """The documented "prompt to break the lab" of each lab that has one."""
+    seeds = {}
+    for lab, handler in lab_handlers().items():
+        match = _SEED_RE.search(inspect.getdoc(handler) or "")
+        if match:
+            seeds[lab] = match.group(1).strip()
+    return seeds
+
+
+def seed_corpus(repeat: int = 1) -> Iterator[dict]:
+    """Each seed prompt `repeat` times, with unique ids."""
+    for lab, prompt in seed_prompts().items():
+        for i in range(repeat):
+            yield {"id": f"{lab}-seed-{i:05d}", "lab": lab, "message": prompt}
+
+
+def read_corpus(path: str) -> Iterator[dict]:
+    """Attacks from a JSONL corpus, skipping blank lines."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            attack = json.loads(line)
+            if "id" not in attack or attack.get("lab") not in LABS:
+                raise ValueError(f"{path}:{line_number}: attack needs an id and a lab")
+            yield attack
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--output", default="attacks.jsonl")
+    parser.add_argument("--repeat", type=int, default=1, help="Copies of each seed")
+    args = parser.parse_args()
+
+    count = 0
+    with open(args.output, "w", encoding="utf-8") as f:
+        for attack in seed_corpus(args.repeat):
+            f.write(json.dumps(attack, ensure_ascii=False) + "\n")
+            count += 1
+    missing = sorted(set(LABS) - set(seed_prompts()))
+    print(f"Wrote {count} attacks to {args.output}")
+    if missing:
+        print(f"No documented prompt for: {', '.join(missing)}")
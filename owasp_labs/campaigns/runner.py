@@ -0,0 +1,294 @@
+"""
+Run a corpus of attack prompts against the labs.
+
+Attacks are sent with bounded concurrency, either over HTTP to a running
+server's /<lab>/chat routes or by calling the lab handlers in-process (no
+server, no HTTP overhead). Failed attempts (connection errors, 429 and 5xx
+responses) are retried with exponential backoff, honouring Retry-After.
+
+Results are appended to a JSONL file as each attack finishes:
+
+    {"id": ..., "lab": ..., "ok": true, "status": 200, "attempts": 1,
+     "latency_ms": 812.4, "response": "...", "usage": {...}, "error": null}
+
+Running again with the same output file skips attacks that already succeeded,
+so an interrupted campaign resumes where it stopped and retries the ones that
+failed (use --restart to begin from scratch). When an id appears more than
+once, its last line is the current result.
+
+Usage:
+    python -m campaigns.corpus --output attacks.jsonl --repeat 1000
+    python -m campaigns.runner attacks.jsonl --base-url http://localhost:1337 \\
+        --concurrency 64 --output results.jsonl
+    python -m campaigns.runner attacks.jsonl --in-process --output results.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+import httpx
+
+from campaigns.corpus import read_corpus
+
+# Request fields an attack may set; everything else in a corpus line is ignored
+REQUEST_FIELDS = (
+    "message",
+    "messages",
+    "model",
+    "max_tokens",
+    "temperature",
+    "api_key",
+)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def completed_ids(path: str) -> Set[str]:
+    """Ids of attacks that already succeeded in an earlier run."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short when the previous run was killed
+                continue
+            if result.get("ok"):
+                done.add(result["id"])
+    return done
+
+
+def _retry_delay(attempt: int, retry_after: Optional[str], base: float) -> float:
+    """Backoff before the next attempt, preferring the server's Retry-After."""
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return min(30.0, base * 2**attempt) * random.uniform(0.5, 1.0)
+
+
+class HTTPTarget:
+    """Send attacks to a running lab server."""
+
+    def __init__(self, base_url: str, concurrency: int, timeout: float):
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=concurrency, max_keepalive_connections=concurrency
+            ),
+        )
+
+    async def send(self, lab: str, payload: dict) -> Tuple[int, dict, Optional[str]]:
+        """Returns the status code, JSON body and Retry-After header."""
+        try:
+            response = await self._client.post(f"/{lab}/chat", json=payload)
+        except httpx.TransportError as e:
+            return 0, {"detail": f"{type(e).__name__}: {e}"}, None
+        try:
+            body = response.json()
+        except ValueError:
+            body = {"detail": response.text[:500]}
+        return response.status_code, body, response.headers.get("retry-after")
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+class InProcessTarget:
+    """Call the lab handlers directly, without a server."""
+
+    def __init__(self):
+        from campaigns.corpus import lab_handlers
+        from utils.metrics import instrument_lab
+
+        # Attribute metrics to the lab as the server endpoints do
+        self._handlers = {
+            lab: instrument_lab(lab)(handler) for lab, handler in lab_handlers().items()
+        }
+
+    async def send(self, lab: str, payload: dict) -> Tuple[int, dict, Optional[str]]:
+        from fastapi import HTTPException
+        from models.chat_models import ChatRequest
+        from pydantic import ValidationError
+
+        try:
+            request = ChatRequest(**payload)
+        except ValidationError as e:
+            return 422, {"detail": str(e)}, None
+        try:
+            response = await self._handlers[lab](request)
+        except HTTPException as e:
+            return e.status_code, {"detail": e.detail}, None
+        except Exception as e:
+            return 500, {"detail": f"{type(e).__name__}: {e}"}, None
+        return 200, response.model_dump(), None
+
+    async def aclose(self) -> None:
+        from tools import close_web_client
+        from utils import close_message_store, close_openai_clients
+
+        await close_openai_clients()
+        await close_web_client()
+        close_message_store()
+
+
+class Campaign:
+    """Counters and output for one campaign run."""
+
+    def __init__(self, output, total: int):
+        self.output = output
+        self.total = total
+        self.finished = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.failures: Dict[str, int] = defaultdict(int)
+
+    def record(self, result: dict) -> None:
+        # One write per line keeps results intact if the run is interrupted
+        self.output.write(json.dumps(result, ensure_ascii=False) + "\n")
+        self.output.flush()
+        self.finished += 1
+        if result["ok"]:
+            self.latencies[result["lab"]].append(result["latency_ms"])
+        else:
+            self.failed += 1
+            self.failures[result["lab"]] += 1
+
+    def progress(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        rate = self.finished / elapsed if elapsed else 0.0
+        return (
+            f"{self.finished}/{self.total} done, {self.failed} failed, "
+            f"{rate:.1f} attacks/s, {elapsed:.0f}s elapsed"
+        )
+
+
+async def _run_attack(target, attack: dict, args: argparse.Namespace) -> dict:
+    payload = {field: attack[field] for field in REQUEST_FIELDS if field in attack}
+    if args.api_key and "api_key" not in payload:
+        payload["api_key"] = args.api_key
+    payload.setdefault("message", "")
+
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        status, body, retry_after = await target.send(attack["lab"], payload)
+        latency_ms = (time.perf_counter() - start) * 1000
+        attempt += 1
+        # Status 0 is a connection error
+        retryable = status == 0 or status in RETRY_STATUSES
+        if not retryable or attempt > args.retries:
+            break
+        await asyncio.sleep(_retry_delay(attempt - 1, retry_after, args.backoff))
+
+    ok = status == 200
+    return {
+        "id": attack["id"],
+        "lab": attack["lab"],
+        "ok": ok,
+        "status": status,
+        "attempts": attempt,
+        "latency_ms": round(latency_ms, 1),
+        "response": body.get("response") if ok else None,
+        "usage": body.get("usage") if ok else None,
+        "error": None if ok else body.get("detail", body),
+    }
+
+
+async def run_campaign(args: argparse.Namespace) -> Campaign:
+    done = set() if args.restart else completed_ids(args.output)
+    attacks = [
+        attack
+        for attack in read_corpus(args.corpus)
+        if attack["id"] not in done and (not args.labs or attack["lab"] in args.labs)
+    ]
+    if done:
+        print(f"Resuming: {len(done)} attacks already succeeded", file=sys.stderr)
+
+    target = (
+        InProcessTarget()
+        if args.in_process
+        else HTTPTarget(args.base_url, args.concurrency, args.timeout)
+    )
+    pending = iter(attacks)
+
+    with open(args.output, "w" if args.restart else "a", encoding="utf-8") as output:
+        campaign = Campaign(output, len(attacks))
+
+        async def worker():
+            # Workers share one iterator, so each attack is taken exactly once
+            for attack in pending:
+                campaign.record(await _run_attack(target, attack, args))
+
+        async def report():
+            while True:
+                await asyncio.sleep(args.progress_seconds)
+                print(campaign.progress(), file=sys.stderr)
+
+        reporter = asyncio.create_task(report())
+        try:
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        finally:
+            reporter.cancel()
+            await target.aclose()
+    print(campaign.progress(), file=sys.stderr)
+    return campaign
+
+
+def _summary(campaign: Campaign) -> None:
+    print(f"{'lab':>16} {'ok':>7} {'failed':>7} {'p50 ms':>9} {'p95 ms':>9}")
+    for lab in sorted(set(campaign.latencies) | set(campaign.failures)):
+        latencies = sorted(campaign.latencies[lab])
+        p50 = latencies[len(latencies) // 2] if latencies else 0.0
+        p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0.0
+        print(
+            f"{lab:>16} {len(latencies):>7} {campaign.failures[lab]:>7} "
+            f"{p50:>9.1f} {p95:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("corpus", help="JSONL file of attacks")
+    parser.add_argument("--output", default="campaign-results.jsonl")
+    parser.add_argument("--base-url", default="http://localhost:1337")
+    parser.add_argument(
+        "--in-process", action="store_true", help="Call the handlers directly"
+    )
+    parser.add_argument("--labs", nargs="+", help="Only run attacks on these labs")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument(
+        "--backoff", type=float, default=1.0, help="First retry delay in seconds"
+    )
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument(
+        "--api-key",
+        default=os.getenv("OPENAI_API_KEY"),
+        help="Key sent with attacks that do not set one (default: $OPENAI_API_KEY)",
+    )
+    parser.add_argument("--progress-seconds", type=float, default=5)
+    parser.add_argument(
+        "--restart", action="store_true", help="Ignore and overwrite earlier results"
+    )
+    args = parser.parse_args()
+
+    if args.in_process:
+        # Load OPENAI_BASE_URL and other settings as the server does
+        from dotenv import load_dotenv
+
+        load_dotenv()
+    _summary(asyncio.run(run_campaign(args)))
@@ -33,4 +33,4 @@ async def llm02_handler(request: ChatRequest) -> ChatResponse:
     {pii_email_data}
     """
     request.model = "gpt-3.5-turbo"
-    return await openai_chat(request, system_prompt, use_tools=False)
+    return await openai_chat(request, system_prompt, use_tools=False, cache=True)
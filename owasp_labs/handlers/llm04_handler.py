@@ -5,16 +5,28 @@ manipulated to introduce biases, backdoors, or vulnerabilities into the model.
 """
 
 import asyncio
-import os
-from typing import Optional
-
-import aiofiles
 
 from models.chat_models import ChatRequest, ChatResponse
 from utils.chat_utils import openai_chat
+from utils.message_store import get_message_store
+from utils.metrics import stage
+from utils.prompts import PromptTemplate
+
+# The shared message log changes on every request, so it goes in the tail
+SYSTEM_PROMPT = PromptTemplate(
+    prefix="You are a customer support bot. Answer questions as best as you can.",
+    tail="learn from previous requests and responses:{history}",
+)
+
 
-# Global lock to prevent race conditions on file access
-_file_lock = asyncio.Lock()
+async def _call(store, method, *args):
+    """Call a store method, moving blocking backends off the event loop."""
+    # Timed as history_snapshot / history_append, including any wait for
+    # a worker thread or the SQLite write lock
+    with stage(f"history_{method.__name__}"):
+        if store.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
 
 
 async def llm04_handler(request: ChatRequest) -> ChatResponse:
@@ -24,48 +36,20 @@ async def llm04_handler(request: ChatRequest) -> ChatResponse:
     This endpoint demonstrates data and model poisoning vulnerabilities.
     TODO: Implement specific data poisoning scenarios.
     """
-    system_prompt = (
-        """You are a customer support bot. Answer questions as best as you can."""
-    )
-
     request_message = request.message
 
-    # Use async lock to prevent race conditions
-    async with _file_lock:
-        # Check if cleanup is needed
-        if os.path.exists("request_messages.txt"):
-            async with aiofiles.open("request_messages.txt", "r") as f:
-                lines = await f.readlines()
-                if len(lines) > 10:
-                    await _safe_remove_file("request_messages.txt")
-
-        # Read the request messages from the file if it exists
-        if os.path.exists("request_messages.txt"):
-            async with aiofiles.open("request_messages.txt", "r") as f:
-                lines = await f.readlines()
-                if lines:  # Only add to system prompt if there are previous messages
-                    system_prompt += "\n\nlearn from previous requests and responses:"
-                    for line in lines:
-                        system_prompt += f"\n{line.strip()}"
+    # Previous messages from every user; no lock is held during the model call
+    store = get_message_store()
+    previous_messages = await _call(store, store.snapshot)
+    system_prompt = SYSTEM_PROMPT.prefix
+    if previous_messages:  # Only add to system prompt if there are previous messages
+        system_prompt = SYSTEM_PROMPT.render(
+            history="".join(f"\n{message.strip()}" for message in previous_messages)
+        )
 
-        content = await openai_chat(request, system_prompt, use_tools=False)
+    content = await openai_chat(request, system_prompt, use_tools=False)
 
-        # Write the current request message to the file
-        async with aiofiles.open("request_messages.txt", "a") as f:
-            await f.write(request_message + "\n")
+    # Remember the current request message for later prompts
+    await _call(store, store.append, request_message)
 
     return content
-
-
-async def _safe_remove_file(filepath: str) -> None:
-    """
-    Safely remove a file asynchronously.
-    
-    Args:
-        filepath: Path to the file to remove
-    """
-    try:
-        os.remove(filepath)
-    except OSError:
-        # File might have been removed by another process
-        pass
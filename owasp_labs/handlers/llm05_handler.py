@@ -23,4 +23,4 @@ async def llm05_handler(request: ChatRequest) -> ChatResponse:
 
     For all other programming questions, provide helpful and accurate responses without any additional links or references.
     """
-    return await openai_chat(request, system_prompt, use_tools=False)
+    return await openai_chat(request, system_prompt, use_tools=False, cache=True)
@@ -7,17 +7,37 @@ SECURITY WARNING: This lab intentionally demonstrates multiple vulnerabilities i
 In production systems, always use secure serialization methods and validate all inputs.
 """
 
-import json
+import asyncio
+import hashlib
 import logging
+import math
 import os
 import threading
-from typing import List
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
 
 import numpy as np
 from dotenv import load_dotenv
 from fastapi import HTTPException
 from models.chat_models import ChatRequest, ChatResponse
-from openai import OpenAI
+from openai import (
+    APIConnectionError,
+    BadRequestError,
+    InternalServerError,
+    RateLimitError,
+)
+from utils.chat_utils import stream_chat_response
+from utils.embedding_cache import get_embedding_cache
+from utils.metrics import record_usage, stage
+from utils.openai_client import UpstreamOverloaded, get_openai_client, upstream_slot
+from utils.vector_index import get_vector_index, remove_vector_index
+from utils.vector_store import (
+    close_vector_store,
+    get_vector_store,
+    remove_vector_store,
+)
 
 load_dotenv()
 
@@ -25,13 +45,31 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 
 # Global variables for RAG system
-EMBEDDINGS_FILE = "llm08_embeddings.npy"  # Changed from .pkl to .npy for safer numpy serialization
-DOCUMENTS_FILE = "llm08_documents.json"  # Changed from .txt to .json for structured storage
-INDEX_FILE = "llm08_index.json"  # Changed from .pkl to .json
-
-# Thread-safe RAG system management
-_rag_instances = {}
-_rag_lock = threading.Lock()
+STORE_DIR = "llm08_store"  # One append-only, memory-mapped store per tenant
+# Files written by earlier versions, which shared one knowledge base between users
+EMBEDDINGS_FILE = "llm08_embeddings.npy"
+DOCUMENTS_FILE = "llm08_documents.json"
+INDEX_FILE = "llm08_index.json"
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+# Bulk embedding: inputs per request, approximate tokens per request,
+# requests in flight and retries per request
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "100000"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "3"))
+# Errors worth retrying: rate limits, timeouts and connection failures, 5xx
+_RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+# Per-tenant limits: documents kept in one knowledge base, knowledge bases kept
+# open at once and the total size of their mapped stores
+MAX_TENANT_DOCUMENTS = int(os.getenv("LLM08_MAX_DOCUMENTS", "20"))
+MAX_RAG_INSTANCES = int(os.getenv("LLM08_MAX_INSTANCES", "64"))
+MAX_RAG_BYTES = int(os.getenv("LLM08_MAX_RESIDENT_BYTES", str(256 * 1024 * 1024)))
+
+# Threads for blocking store, index and cache work, kept off the event loop
+RAG_WORKERS = int(os.getenv("LLM08_WORKERS", str(min(8, os.cpu_count() or 1))))
+_worker_pool = ThreadPoolExecutor(max_workers=RAG_WORKERS, thread_name_prefix="llm08")
 
 # Pre-load some innocent documents to make the attack more realistic
 INNOCENT_DOCUMENTS = [
@@ -45,17 +83,86 @@ INNOCENT_DOCUMENTS = [
 ]
 
 
+def _tenant_key(api_key: str) -> str:
+    # Never use raw API keys in paths or dictionary keys
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def _remove_legacy_data() -> None:
+    """Delete the knowledge base that earlier versions shared between all users."""
+    # Other server workers may be removing the same files at the same time
+    for file_path in [EMBEDDINGS_FILE, DOCUMENTS_FILE, INDEX_FILE]:
+        try:
+            os.remove(file_path)
+            logger.info(f"Removed {file_path}")
+        except FileNotFoundError:
+            pass
+
+
+async def _run_in_pool(func, *args):
+    """Run a blocking call on the LLM08 worker pool."""
+    return await asyncio.get_running_loop().run_in_executor(_worker_pool, func, *args)
+
+
+def _make_batches(documents: List[str]) -> List[List[str]]:
+    """Split documents into batches bounded by item count and estimated tokens."""
+    batches: List[List[str]] = []
+    batch: List[str] = []
+    batch_tokens = 0
+    for doc in documents:
+        # Roughly four characters per token
+        tokens = len(doc) // 4 + 1
+        if batch and (
+            len(batch) >= EMBEDDING_BATCH_SIZE
+            or batch_tokens + tokens > EMBEDDING_BATCH_TOKENS
+        ):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(doc)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
 class VulnerableRAG:
-    """Highly vulnerable RAG system demonstrating data poisoning attacks."""
+    """
+    Highly vulnerable RAG system demonstrating data poisoning attacks.
+
+    Create instances with `await VulnerableRAG.create(api_key)`; every step
+    that waits on the network or the disk is a coroutine.
+    """
 
     def __init__(self, api_key: str | None = None):
-        self.documents = []
-        self.embeddings = None
+        self.store = None
+        self.store_dir = None
         self.client = None
         self.api_key = api_key
-        self._load_or_initialize()
 
-    def _load_or_initialize(self):
+    @classmethod
+    async def create(cls, api_key: str | None = None) -> "VulnerableRAG":
+        rag = cls(api_key=api_key)
+        await rag._load_or_initialize()
+        return rag
+
+    @property
+    def document_count(self) -> int:
+        return self.store.live_count if self.store is not None else 0
+
+    @property
+    def embeddings(self) -> Optional[np.ndarray]:
+        """Memory-mapped float32 embedding matrix, one row per stored document."""
+        return self.store.matrix if self.store is not None else None
+
+    @property
+    def resident_bytes(self) -> int:
+        """
+        Size of the memory-mapped store backing this knowledge base, as kept
+        up to date by the store's appends and compactions.
+        """
+        return self.store.disk_bytes() if self.store is not None else 0
+
+    async def _load_or_initialize(self):
         """Load existing data or initialize new RAG system."""
         try:
             # Get OpenAI client
@@ -65,72 +172,166 @@ class VulnerableRAG:
             if not self.api_key:
                 raise ValueError("OpenAI API key is required")
                 
-            self.client = OpenAI(api_key=self.api_key)
+            self.client = get_openai_client(self.api_key)
 
-            # Load existing documents and embeddings if they exist
-            if os.path.exists(DOCUMENTS_FILE):
-                with open(DOCUMENTS_FILE, "r", encoding="utf-8") as f:
-                    self.documents = json.load(f)
-            else:
+            # Each API key gets its own store, so tenants never see or
+            # overwrite each other's documents
+            self.store_dir = os.path.join(STORE_DIR, _tenant_key(self.api_key))
+            self.store = await _run_in_pool(get_vector_store, self.store_dir)
+            if not len(self.store):
                 # Initialize with innocent documents
-                self.documents = INNOCENT_DOCUMENTS.copy()
-                self._save_data()
-
-            if os.path.exists(EMBEDDINGS_FILE) and self.documents:
-                # Use numpy's safer load function instead of pickle
-                self.embeddings = np.load(EMBEDDINGS_FILE, allow_pickle=False).tolist()
-            else:
-                # Create embeddings for existing documents
-                self._create_embeddings()
+                await self._create_embeddings(INNOCENT_DOCUMENTS.copy())
+            await _run_in_pool(self._evict_old_documents)
 
-            logger.info(f"RAG system initialized with {len(self.documents)} documents")
+            logger.info(f"RAG system initialized with {self.document_count} documents")
 
+        except UpstreamOverloaded:
+            # Not cached as a broken instance; the request gets 429
+            raise
         except Exception as e:
             logger.error(f"Error initializing RAG system: {e}")
-            self.documents = INNOCENT_DOCUMENTS.copy()
-            self.embeddings = None
+            self.store = None
 
-    def _create_embeddings(self):
-        """Create embeddings for all documents."""
+    async def _create_embeddings(self, documents: List[str]):
+        """Create embeddings for documents and append both to the store."""
         try:
-            self.embeddings = []
-            for doc in self.documents:
-                embedding = self._get_embedding(doc)
-                if embedding:
-                    self.embeddings.append(embedding)
-
-            if self.embeddings:
-                self._save_data()
-                logger.info(f"Created embeddings for {len(self.embeddings)} documents")
+            with stage("embed"):
+                embeddings = await self._embed_documents(documents)
+            if embeddings is None:
+                return
+            with stage("save"):
+                created = await _run_in_pool(
+                    self._extend_if_empty, documents, embeddings
+                )
+            if created:
+                logger.info(f"Created embeddings for {len(embeddings)} documents")
+        except UpstreamOverloaded:
+            raise
         except Exception as e:
             logger.error(f"Error creating embeddings: {e}")
 
-    def _get_embedding(self, text: str) -> List[float]:
+    def _extend_if_empty(self, documents: List[str], embeddings: np.ndarray) -> bool:
+        # Another worker process may have seeded this store while we embedded
+        with self.store.lock:
+            if len(self.store):
+                return False
+            self.store.extend(documents, embeddings)
+            return True
+
+    async def _embed_documents(self, documents: List[str]) -> Optional[np.ndarray]:
+        """
+        Embed many documents with batched, concurrent requests.
+
+        The result has exactly one row per document. Documents that could not
+        be embedded get an all-zero row, which retrieval never matches, so
+        rows stay aligned with the documents.
+        """
+        cache = get_embedding_cache()
+        rows: List[Optional[List[float]]] = list(
+            await _run_in_pool(cache.get_many, EMBEDDING_MODEL, documents)
+        )
+        missing = [i for i, row in enumerate(rows) if row is None]
+
+        if missing:
+            semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+
+            async def embed(batch: List[str]) -> List[Optional[List[float]]]:
+                async with semaphore:
+                    return await self._embed_batch(batch)
+
+            batches = _make_batches([documents[i] for i in missing])
+            results = [
+                row
+                for batch in await asyncio.gather(*(embed(b) for b in batches))
+                for row in batch
+            ]
+
+            embedded = []
+            for i, row in zip(missing, results):
+                rows[i] = row
+                if row:
+                    embedded.append(i)
+            await _run_in_pool(
+                cache.put_many,
+                EMBEDDING_MODEL,
+                [documents[i] for i in embedded],
+                [rows[i] for i in embedded],
+            )
+
+        dim = next((len(row) for row in rows if row is not None and len(row)), 0)
+        if not dim:
+            return None
+        failed = [i for i, row in enumerate(rows) if row is None or not len(row)]
+        if failed:
+            logger.error(f"Failed to embed {len(failed)} of {len(documents)} documents")
+        matrix = np.zeros((len(documents), dim), dtype=np.float32)
+        for i, row in enumerate(rows):
+            if row is not None and len(row):
+                matrix[i] = row
+        return matrix
+
+    async def _embed_batch(self, batch: List[str]) -> List[Optional[List[float]]]:
+        """
+        Embed one batch. Transient errors are retried with backoff; a rejected
+        batch is retried one input at a time. Other errors, such as an invalid
+        API key, fail the batch without further calls.
+        """
+        for attempt in range(EMBEDDING_MAX_RETRIES):
+            try:
+                async with upstream_slot():
+                    response = await self.client.embeddings.create(
+                        model=EMBEDDING_MODEL, input=batch
+                    )
+                record_usage(response.usage, EMBEDDING_MODEL)
+                rows: List[Optional[List[float]]] = [None] * len(batch)
+                for item in response.data:
+                    rows[item.index] = item.embedding
+                return rows
+            except UpstreamOverloaded:
+                # Retrying or splitting the batch would only add load
+                raise
+            except _RETRYABLE_ERRORS as e:
+                logger.error(f"Error embedding batch (attempt {attempt + 1}): {e}")
+                if attempt + 1 < EMBEDDING_MAX_RETRIES:
+                    await asyncio.sleep(0.5 * 2**attempt)
+            except BadRequestError as e:
+                logger.error(f"Batch of {len(batch)} inputs rejected: {e}")
+                if len(batch) == 1:
+                    break
+                # A single bad input fails the whole request, so isolate it
+                return [await self._get_embedding(text) or None for text in batch]
+            except Exception as e:
+                logger.error(f"Error embedding batch: {e}")
+                break
+        return [None] * len(batch)
+
+    async def _get_embedding(self, text: str) -> List[float]:
         """Get embedding for a text using OpenAI."""
         try:
+            cache = get_embedding_cache()
+            cached = await _run_in_pool(cache.get, EMBEDDING_MODEL, text)
+            if cached is not None:
+                return cached.tolist()
+
             if not self.client:
                 logger.error("OpenAI client not initialized")
                 return []
                 
-            response = self.client.embeddings.create(
-                model="text-embedding-ada-002", input=text
-            )
-            return response.data[0].embedding
+            async with upstream_slot():
+                response = await self.client.embeddings.create(
+                    model=EMBEDDING_MODEL, input=text
+                )
+            record_usage(response.usage, EMBEDDING_MODEL)
+            embedding = response.data[0].embedding
+            await _run_in_pool(cache.put, EMBEDDING_MODEL, text, embedding)
+            return embedding
+        except UpstreamOverloaded:
+            raise
         except Exception as e:
             logger.error(f"Error getting embedding: {e}")
             return []
 
-    def _cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
-        """Calculate cosine similarity between two vectors."""
-        try:
-            vec1 = np.array(vec1)
-            vec2 = np.array(vec2)
-            return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
-        except Exception as e:
-            logger.error(f"Error calculating cosine similarity: {e}")
-            return 0.0
-
-    def add_document(self, document: str):
+    async def add_document(self, document: str):
         """
         Add a document to the RAG system - HIGHLY VULNERABLE TO DATA POISONING!
 
@@ -141,67 +342,87 @@ class VulnerableRAG:
             # VULNERABILITY: No validation or sanitization of input documents
             # Attackers can inject malicious instructions that will be retrieved and executed
 
-            # Add document to list
-            self.documents.append(document)
-
             # Get embedding for the document
-            embedding = self._get_embedding(document)
-            if embedding:
-                if self.embeddings is None:
-                    self.embeddings = []
-                self.embeddings.append(embedding)
+            with stage("embed"):
+                embedding = await self._get_embedding(document)
+            if not embedding:
+                logger.error("Failed to get embedding for document")
+                if not self.store.dim:
+                    return
+                # Keep one embedding row per document; a zero row never matches
+                embedding = np.zeros(self.store.dim, dtype=np.float32)
 
-                # Save documents and embeddings
-                self._save_data()
+            with stage("save"):
+                await _run_in_pool(self._store_document, document, embedding)
 
-                logger.info(f"Document added successfully: {document[:50]}...")
-            else:
-                logger.error("Failed to get embedding for document")
+            logger.info(f"Document added successfully: {document[:50]}...")
 
+        except UpstreamOverloaded:
+            raise
         except Exception as e:
             logger.error(f"Error adding document: {e}")
 
-    def _save_data(self):
-        """Save documents and embeddings to files using secure serialization."""
-        try:
-            # Save documents as JSON (safer than pickle)
-            with open(DOCUMENTS_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.documents, f, ensure_ascii=False, indent=2)
-
-            # Save embeddings using numpy's safer save function
-            if self.embeddings:
-                np.save(EMBEDDINGS_FILE, np.array(self.embeddings), allow_pickle=False)
-
-            logger.info("Data saved successfully using secure serialization")
-
-        except Exception as e:
-            logger.error(f"Error saving data: {e}")
+    def _store_document(self, document: str, embedding) -> None:
+        # One append per file, independent of how many documents are stored
+        with self.store.lock:
+            self.store.append(document, embedding)
+            self._evict_old_documents()
+
+    def _evict_old_documents(self):
+        """Delete the oldest added documents once the knowledge base is over its limit."""
+        with self.store.lock:
+            excess = self.store.live_count - MAX_TENANT_DOCUMENTS
+            if excess <= 0:
+                return
+            # The seeded documents, including the poisoned one, always stay
+            seeded = set(INNOCENT_DOCUMENTS)
+            oldest = []
+            for row in self.store.live_rows():
+                if len(oldest) == excess:
+                    break
+                if self.store.document(int(row)) not in seeded:
+                    oldest.append(int(row))
+            self.store.delete(oldest)
+            logger.info(f"Evicted {len(oldest)} old documents from {self.store_dir}")
+
+    def close(self):
+        """Release the store and index; the files stay on disk for the next load."""
+        if self.store_dir is not None:
+            remove_vector_index(self.store_dir)
+            close_vector_store(self.store_dir)
+        self.store = None
+
+    def _search(self, query_embedding: List[float], top_k: int) -> List[str]:
+        # Cosine similarity search (vulnerable to embedding inversion); row ids
+        # are only valid until another worker compacts, so hold the store lock
+        with self.store.lock:
+            indices = get_vector_index(self.store).search(
+                np.asarray(query_embedding, dtype=np.float32), top_k
+            )
+            return self.store.documents(indices)
 
-    def retrieve_similar(self, query: str, top_k: int = 3) -> List[str]:
+    async def retrieve_similar(self, query: str, top_k: int = 3) -> List[str]:
         """Retrieve similar documents - vulnerable to embedding inversion."""
         try:
-            if not self.documents or not self.embeddings:
+            if not self.document_count:
                 return []
 
-            query_embedding = self._get_embedding(query)
+            with stage("embed"):
+                query_embedding = await self._get_embedding(query)
             if not query_embedding:
                 return []
 
-            # Simple cosine similarity search (vulnerable to embedding inversion)
-            similarities = []
-            for i, doc_embedding in enumerate(self.embeddings):
-                similarity = self._cosine_similarity(query_embedding, doc_embedding)
-                similarities.append((similarity, i))
-
-            # Sort by similarity and return top_k
-            similarities.sort(reverse=True)
-            return [self.documents[i] for _, i in similarities[:top_k]]
+            # Search is CPU-bound, so it runs on the worker pool
+            with stage("search"):
+                return await _run_in_pool(self._search, query_embedding, top_k)
 
+        except UpstreamOverloaded:
+            raise
         except Exception as e:
             logger.error(f"Error retrieving similar documents: {e}")
             return []
 
-    def generate_response(self, query: str) -> str:
+    async def generate_response(self, query: str) -> str:
         """
         Generate response using RAG - HIGHLY VULNERABLE TO DATA POISONING!
 
@@ -213,7 +434,7 @@ class VulnerableRAG:
                 return "Error: OpenAI client not initialized. Please check your API key."
                 
             # Retrieve relevant documents (could contain poisoned data)
-            retrieved_docs = self.retrieve_similar(query, top_k=2)
+            retrieved_docs = await self.retrieve_similar(query, top_k=2)
 
             # Always include the malicious document in the context
             malicious_doc = INNOCENT_DOCUMENTS[0]
@@ -230,7 +451,7 @@ class VulnerableRAG:
                     + "\n\n"
                 )
 
-            print(f"Retrieved context (potentially poisoned): {context}")
+            logger.debug(f"Retrieved context (potentially poisoned): {context}")
 
             # HIGHLY VULNERABLE: Include retrieved content directly in system prompt
             # This allows malicious instructions to override the original system prompt
@@ -245,51 +466,225 @@ class VulnerableRAG:
             """
 
             # Generate response
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": query},
-                ],
-                max_tokens=500,
-                temperature=0.7,
-            )
+            with stage("completion_1"):
+                async with upstream_slot():
+                    response = await self.client.chat.completions.create(
+                        model="gpt-3.5-turbo",
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": query},
+                        ],
+                        max_tokens=500,
+                        temperature=0.7,
+                    )
+            record_usage(response.usage, "gpt-3.5-turbo")
 
             return response.choices[0].message.content
 
+        except UpstreamOverloaded:
+            raise
         except Exception as e:
             logger.error(f"Error generating response: {e}")
             return f"Error generating response: {str(e)}"
 
 
-# Thread-safe RAG instance management
-def get_rag_system(api_key: str) -> VulnerableRAG:
+async def _close_instances(instances: List[VulnerableRAG]) -> None:
+    """Close evicted instances on the worker pool; closing flushes and locks stores."""
+    for rag in instances:
+        await _run_in_pool(rag.close)
+
+
+class RAGRegistry:
+    """
+    Bounded LRU of per-tenant VulnerableRAG instances keyed by a hash of the API key.
+
+    Building a knowledge base embeds the seed documents, so it happens under a
+    lock for that tenant only and never blocks other tenants. Instances are
+    evicted least-recently-used once there are too many of them or their
+    mapped stores exceed the byte budget; evicted stores stay on disk.
+
+    Requests hold an instance through `use()`. An instance evicted while
+    requests still use it is closed when the last of them finishes, and is
+    handed out again if its tenant comes back before then, so a store is
+    never closed under a running search or write.
+    """
+
+    def __init__(
+        self, max_instances: int = MAX_RAG_INSTANCES, max_bytes: int = MAX_RAG_BYTES
+    ):
+        self.max_instances = max_instances
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._instances: "OrderedDict[str, VulnerableRAG]" = OrderedDict()
+        # Requests using each tenant's instance, and evicted instances that
+        # are closed once no request uses them
+        self._users = {}
+        self._retired = {}
+        self._tenant_locks = {}
+        # Guards the dictionaries only; it is never held across an await
+        self._lock = threading.Lock()
+        self._legacy_removed = False
+
+    def _lookup(self, key: str) -> Optional[VulnerableRAG]:
+        rag = self._instances.get(key)
+        if rag is None:
+            rag = self._retired.pop(key, None)
+            if rag is None:
+                return None
+            self._instances[key] = rag
+        self.hits += 1
+        self._instances.move_to_end(key)
+        self._users[key] = self._users.get(key, 0) + 1
+        return rag
+
+    def _resident_bytes(self) -> int:
+        return sum(rag.resident_bytes for rag in self._instances.values())
+
+    def _evict(self) -> List[VulnerableRAG]:
+        """
+        Pop least-recently-used instances until the registry is within bounds;
+        returns those no request is using, to be closed.
+        """
+        evicted = []
+        while len(self._instances) > 1 and (
+            len(self._instances) > self.max_instances
+            or self._resident_bytes() > self.max_bytes
+        ):
+            key, rag = self._instances.popitem(last=False)
+            self._tenant_locks.pop(key, None)
+            self.evictions += 1
+            if self._users.get(key):
+                self._retired[key] = rag
+            else:
+                evicted.append(rag)
+        return evicted
+
+    async def acquire(self, api_key: str) -> VulnerableRAG:
+        """
+        Get the tenant's knowledge base, loading or creating it on a miss.
+
+        Every acquire must be paired with a release(); use() does both.
+        """
+        key = _tenant_key(api_key)
+        remove_legacy = False
+        with self._lock:
+            rag = self._lookup(key)
+            # A retired instance handed out again may put the registry over
+            evicted = self._evict() if rag is not None else []
+            if rag is None:
+                tenant_lock = self._tenant_locks.setdefault(key, asyncio.Lock())
+                remove_legacy = not self._legacy_removed
+                self._legacy_removed = True
+        if rag is not None:
+            await _close_instances(evicted)
+            return rag
+        if remove_legacy:
+            await _run_in_pool(_remove_legacy_data)
+
+        async with tenant_lock:
+            with self._lock:
+                rag = self._lookup(key)
+                evicted = self._evict() if rag is not None else []
+            if rag is not None:
+                await _close_instances(evicted)
+                return rag
+
+            rag = await VulnerableRAG.create(api_key=api_key)
+            with self._lock:
+                self.misses += 1
+                self._instances[key] = rag
+                self._users[key] = self._users.get(key, 0) + 1
+                evicted = self._evict()
+        await _close_instances(evicted)
+        return rag
+
+    async def release(self, api_key: str) -> None:
+        """Finish using a tenant's instance, closing it if it was evicted meanwhile."""
+        key = _tenant_key(api_key)
+        with self._lock:
+            users = self._users.get(key, 0) - 1
+            if users > 0:
+                self._users[key] = users
+                return
+            self._users.pop(key, None)
+            rag = self._retired.pop(key, None)
+        if rag is not None:
+            await _close_instances([rag])
+
+    @asynccontextmanager
+    async def use(self, api_key: str) -> AsyncIterator[VulnerableRAG]:
+        """
+        Hold the tenant's knowledge base for the duration of a request.
+
+        Usage:
+            async with registry.use(api_key) as rag:
+                await rag.generate_response(query)
+        """
+        rag = await self.acquire(api_key)
+        try:
+            yield rag
+        finally:
+            await self.release(api_key)
+
+    def clear(self) -> None:
+        """Close every cached instance."""
+        with self._lock:
+            instances = list(self._instances.values()) + list(self._retired.values())
+            self._instances.clear()
+            self._retired.clear()
+            self._tenant_locks.clear()
+        for rag in instances:
+            rag.close()
+
+    def stats(self) -> dict:
+        """Get instance counts, resident bytes and hit/miss/eviction counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._instances),
+                "max_size": self.max_instances,
+                "resident_bytes": self._resident_bytes(),
+                "max_bytes": self.max_bytes,
+                "retired_in_use": len(self._retired),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_registry = RAGRegistry()
+
+
+def use_rag_system(api_key: str):
     """
-    Get or create RAG system instance with the provided API key.
-    
-    This function is thread-safe and ensures that each API key gets its own
-    RAG instance, preventing race conditions in multi-threaded environments.
+    Hold the RAG system instance of an API key while a request uses it.
+
+    Each API key gets its own knowledge base in its own store directory, so
+    concurrent users never read or overwrite each other's documents.
+
+    Usage:
+        async with use_rag_system(api_key) as rag_system:
+            ...
     """
-    with _rag_lock:
-        if api_key not in _rag_instances:
-            _rag_instances[api_key] = VulnerableRAG(api_key=api_key)
-        return _rag_instances[api_key]
+    return _registry.use(api_key)
+
+
+def get_rag_registry_stats() -> dict:
+    """Get statistics for the per-tenant knowledge base registry."""
+    return _registry.stats()
 
 
 def cleanup_llm08_data():
-    """Cleanup function to remove all LLM08 data files."""
+    """Cleanup function to remove all LLM08 data files for every tenant."""
     try:
         print("Cleaning up LLM08 data...")
-        # Updated file extensions to match secure serialization methods
-        files_to_remove = [EMBEDDINGS_FILE, DOCUMENTS_FILE, INDEX_FILE]
-        for file_path in files_to_remove:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                logger.info(f"Removed {file_path}")
-
-        # Thread-safe cleanup of RAG instances
-        with _rag_lock:
-            _rag_instances.clear()
+        _registry.clear()
+        remove_vector_store(STORE_DIR)
+        logger.info(f"Removed {STORE_DIR}")
+        _remove_legacy_data()
 
         logger.info("LLM08 data cleanup completed successfully")
         return True
@@ -318,20 +713,25 @@ async def llm08_handler(request: ChatRequest) -> ChatResponse:
         if not request.api_key:
             raise HTTPException(status_code=400, detail="OpenAI API key is required")
 
-        # Get RAG system with the provided API key
-        rag_system = get_rag_system(request.api_key)
-
-        # Check if cleanup is needed (prevent too many documents)
-        if len(rag_system.documents) > 20:
-            cleanup_llm08_data()
-            rag_system = get_rag_system(request.api_key)
-
-        # Generate response using potentially poisoned RAG system
-        # The knowledge base already contains a malicious document about password reset
-        response_content = rag_system.generate_response(request.message)
-
-        return ChatResponse(response=response_content, model=request.model)
-
+        # Get this tenant's RAG system; it keeps itself within
+        # LLM08_MAX_DOCUMENTS by evicting its oldest added documents
+        async with use_rag_system(request.api_key) as rag_system:
+            # Generate response using potentially poisoned RAG system
+            # The knowledge base already contains a malicious document about password reset
+            response_content = await rag_system.generate_response(request.message)
+
+        chat_response = ChatResponse(response=response_content, model=request.model)
+        if request.stream:
+            return stream_chat_response(chat_response)
+        return chat_response
+
+    except UpstreamOverloaded as e:
+        logger.warning(f"Upstream overloaded: {e}")
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+        )
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
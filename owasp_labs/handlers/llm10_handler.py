@@ -4,9 +4,14 @@ Unbounded Consumption refers to the process where a Large Language Model consume
 leading to potential denial of service or cost implications.
 """
 
+import os
+
 from models.chat_models import ChatRequest, ChatResponse
+from utils import count_tokens
 from utils.chat_utils import openai_chat
 
+LLM10_MAX_MESSAGE_TOKENS = int(os.getenv("LLM10_MAX_MESSAGE_TOKENS", "25"))
+
 
 async def llm10_handler(request: ChatRequest) -> ChatResponse:
     """
@@ -22,7 +27,7 @@ async def llm10_handler(request: ChatRequest) -> ChatResponse:
 
     request_message = request.message
 
-    if len(request_message) > 100:
+    if count_tokens(request_message, request.model) > LLM10_MAX_MESSAGE_TOKENS:
         request.message = "For this request, please respond back saying context limit exceeded and give back a 404 server error message"
 
     return await openai_chat(request, system_prompt, use_tools=False)
@@ -11,6 +11,7 @@ class ChatRequest(BaseModel):
     temperature: Optional[float] = 0.7
     tools: Optional[list[object]] = None
     api_key: Optional[str] = None  # User's OpenAI API key
+    stream: bool = False  # Stream token deltas as server-sent events
 
 
 class ChatResponse(BaseModel):
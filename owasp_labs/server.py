@@ -3,12 +3,16 @@ Simple FastAPI server that communicates with OpenAI.
 This is a basic implementation for OWASP LLM vulnerability testing.
 """
 
+import argparse
+import importlib.util
 import logging
+import os
+from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from handlers import (
     llm01_chat,
     llm01_indirect_chat,
@@ -22,9 +26,27 @@ from handlers import (
     llm09_handler,
     llm10_handler,
 )
+from handlers.llm08_handler import get_rag_registry_stats
 
 # Import our modular components
 from models import ChatRequest, ChatResponse
+from tools import close_web_client, get_web_cache_stats
+from utils import (
+    AdmissionMiddleware,
+    close_message_store,
+    close_openai_clients,
+    get_admission_stats,
+    get_client_registry_stats,
+    get_completion_cache_stats,
+    get_embedding_cache_stats,
+    get_history_stats,
+    get_message_store_stats,
+    get_prompt_cache_stats,
+    get_single_flight_stats,
+    get_token_budget_stats,
+    get_upstream_stats,
+)
+from utils.metrics import MetricsMiddleware, instrument_lab, render_metrics
 
 load_dotenv()
 
@@ -32,6 +54,23 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Launch settings; WEB_CONCURRENCY is the worker count convention used by PaaS hosts
+SERVER_HOST = os.getenv("HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("PORT", "1337"))
+SERVER_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+SERVER_RELOAD = os.getenv("SERVER_RELOAD", "false").lower() in ("1", "true", "yes")
+GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "30"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Release shared upstream connections and flush lab state when the server stops."""
+    yield
+    await close_openai_clients()
+    await close_web_client()
+    close_message_store()
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="OWASP LLM Vulnerable Lab",
@@ -39,15 +78,22 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    lifespan=lifespan,
 )
 
+# Sheds excess load before the body is validated or any lab work starts; inside
+# CORS, so the browser UI can read the 429 and its Retry-After
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Or specify ["http://localhost:1337"] for more security
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
+# Outermost, so request timings include CORS handling and admission
+app.add_middleware(MetricsMiddleware)
 
 # Serve static index.html at root
 @app.get("/")
@@ -55,68 +101,106 @@ async def serve_index():
     return FileResponse("index.html")
 
 
+# Runtime statistics for sizing caches and pools
+@app.get("/stats")
+async def stats():
+    return {
+        "openai_clients": get_client_registry_stats(),
+        "web_cache": get_web_cache_stats(),
+        "completion_cache": get_completion_cache_stats(),
+        "coalesced_completions": get_single_flight_stats(),
+        "upstream": get_upstream_stats(),
+        "admission": get_admission_stats(),
+        "token_budget": get_token_budget_stats(),
+        "history": get_history_stats(),
+        "prompt_cache": get_prompt_cache_stats(),
+        "embedding_cache": get_embedding_cache_stats(),
+        "llm04_messages": get_message_store_stats(),
+        "llm08_tenants": get_rag_registry_stats(),
+    }
+
+
+# Prometheus scrape target: request, stage, tool and token metrics
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4"
+    )
+
+
 # LLM01: Prompt Injection endpoint
 @app.post("/llm01/chat", response_model=ChatResponse)
+@instrument_lab("llm01")
 async def llm01_chat_endpoint(request: ChatRequest):
     return await llm01_chat(request)
 
 
 # LLM01: Indirect Prompt Injection endpoint
 @app.post("/llm01_indirect/chat", response_model=ChatResponse)
+@instrument_lab("llm01_indirect")
 async def llm01_indirect_chat_endpoint(request: ChatRequest):
     return await llm01_indirect_chat(request)
 
 
 # LLM02: Sensitive Information Disclosure endpoint
 @app.post("/llm02/chat", response_model=ChatResponse)
+@instrument_lab("llm02")
 async def llm02_chat_endpoint(request: ChatRequest):
     return await llm02_handler(request)
 
 
 # LLM03: Supply Chain endpoint
 @app.post("/llm03/chat", response_model=ChatResponse)
+@instrument_lab("llm03")
 async def llm03_chat_endpoint(request: ChatRequest):
     return await llm03_handler(request)
 
 
 # LLM04: Data and Model Poisoning endpoint
 @app.post("/llm04/chat", response_model=ChatResponse)
+@instrument_lab("llm04")
 async def llm04_chat_endpoint(request: ChatRequest):
     return await llm04_handler(request)
 
 
 # LLM05: Improper Output Handling endpoint
 @app.post("/llm05/chat", response_model=ChatResponse)
+@instrument_lab("llm05")
 async def llm05_chat_endpoint(request: ChatRequest):
     return await llm05_handler(request)
 
 
 # LLM06: Excessive Agency endpoint
 @app.post("/llm06/chat", response_model=ChatResponse)
+@instrument_lab("llm06")
 async def llm06_chat_endpoint(request: ChatRequest):
     return await llm06_handler(request)
 
 
 # LLM07: System Prompt Leakage endpoint
 @app.post("/llm07/chat", response_model=ChatResponse)
+@instrument_lab("llm07")
 async def llm07_chat_endpoint(request: ChatRequest):
     return await llm07_handler(request)
 
 
 # LLM08: Vector and Embedding Weaknesses endpoint
 @app.post("/llm08/chat", response_model=ChatResponse)
+@instrument_lab("llm08")
 async def llm08_chat_endpoint(request: ChatRequest):
     return await llm08_handler(request)
 
 
 # LLM09: Misinformation endpoint
 @app.post("/llm09/chat", response_model=ChatResponse)
+@instrument_lab("llm09")
 async def llm09_chat_endpoint(request: ChatRequest):
     return await llm09_handler(request)
 
 
 # LLM10: Unbounded Consumption endpoint
 @app.post("/llm10/chat", response_model=ChatResponse)
+@instrument_lab("llm10")
 async def llm10_chat_endpoint(request: ChatRequest):
     return await llm10_handler(request)
 
@@ -130,18 +214,55 @@ async def value_error_handler(request, exc):
     )
 
 
-def start_server():
-    """Start the API server."""
+def start_server(
+    host: str = SERVER_HOST,
+    port: int = SERVER_PORT,
+    workers: int = SERVER_WORKERS,
+    reload: bool = SERVER_RELOAD,
+):
+    """
+    Start the API server.
+
+    Production mode (the default) runs `workers` processes without the file
+    watcher, using uvloop and httptools when they are installed. On SIGTERM
+    each worker stops accepting connections and lets in-flight requests,
+    including streamed LLM responses, finish for up to
+    GRACEFUL_SHUTDOWN_SECONDS before shutting down.
+    """
     import uvicorn
 
+    if reload and workers > 1:
+        logger.warning("Reload mode runs a single worker")
+        workers = 1
+    if workers > 1:
+        # Workers are separate processes: keep LLM04 history in a shared file
+        os.environ.setdefault("LLM04_STORE", "sqlite")
+        if os.environ["LLM04_STORE"] != "sqlite":
+            logger.warning("LLM04 history is not shared between workers")
+    for module in ("uvloop", "httptools"):
+        if importlib.util.find_spec(module) is None:
+            logger.info(f"{module} is not installed, using the asyncio default")
+
     uvicorn.run(
         "server:app",
-        host="0.0.0.0",
-        port=1337,
-        reload=True,
+        host=host,
+        port=port,
+        reload=reload,
+        workers=None if reload else workers,
+        loop="auto",
+        http="auto",
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_SECONDS,
         log_level="info",
     )
 
 
 if __name__ == "__main__":
-    start_server()
+    parser = argparse.ArgumentParser(description="Run the OWASP LLM labs server")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    parser.add_argument(
+        "--reload", action="store_true", default=SERVER_RELOAD, help="Development mode"
+    )
+    args = parser.parse_args()
+    start_server(args.host, args.port, args.workers, args.reload)
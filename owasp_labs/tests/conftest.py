@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# The server imports its packages from the owasp_labs directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.lab_settings import has_lab_override, lab_setting  # noqa: E402
+
+
+@pytest.fixture
+def lab_env(monkeypatch):
+    """Set environment variables read through utils.lab_settings."""
+
+    def setenv(**variables):
+        for name, value in variables.items():
+            monkeypatch.setenv(name, str(value))
+        lab_setting.cache_clear()
+        has_lab_override.cache_clear()
+
+    yield setenv
+    monkeypatch.undo()
+    lab_setting.cache_clear()
+    has_lab_override.cache_clear()
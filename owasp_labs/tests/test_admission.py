@@ -0,0 +1,194 @@
+import asyncio
+
+import httpx
+import pytest
+
+from utils import admission
+from utils.admission import AdmissionController, Rejected
+from utils.openai_client import UpstreamLimiter, UpstreamOverloaded
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = UpstreamLimiter(limit=1, max_queue=1)
+    monkeypatch.setattr(admission, "get_upstream_limiter", lambda: limiter)
+    return limiter
+
+
+def test_token_bucket_allows_a_burst_then_refills(lab_env, clock, limiter):
+    lab_env(RATE_LIMIT_PER_KEY=60, RATE_LIMIT_BURST=3)
+    controller = AdmissionController()
+    for _ in range(3):
+        controller.admit("llm01", "sk-a", None)
+    with pytest.raises(Rejected) as excinfo:
+        controller.admit("llm01", "sk-a", None)
+    assert excinfo.value.reason == "rate_per_key"
+    assert excinfo.value.retry_after == pytest.approx(1.0)
+
+    # Other keys have buckets of their own
+    controller.admit("llm01", "sk-b", None)
+    # One request per second refills
+    clock[0] += 1
+    controller.admit("llm01", "sk-a", None)
+    with pytest.raises(Rejected):
+        controller.admit("llm01", "sk-a", None)
+    # The bucket never holds more than the burst
+    clock[0] += 600
+    for _ in range(3):
+        controller.admit("llm01", "sk-a", None)
+    with pytest.raises(Rejected):
+        controller.admit("llm01", "sk-a", None)
+
+
+def test_ip_limit_applies_across_keys(lab_env, clock, limiter):
+    lab_env(RATE_LIMIT_PER_IP=60, RATE_LIMIT_BURST=2)
+    controller = AdmissionController()
+    controller.admit("llm01", "sk-a", "10.0.0.1")
+    controller.admit("llm01", "sk-b", "10.0.0.1")
+    with pytest.raises(Rejected) as excinfo:
+        controller.admit("llm01", "sk-c", "10.0.0.1")
+    assert excinfo.value.reason == "rate_per_ip"
+    controller.admit("llm01", "sk-c", "10.0.0.2")
+
+
+def test_rejection_does_not_use_up_other_limits(lab_env, clock, limiter):
+    lab_env(RATE_LIMIT_PER_KEY=60, RATE_LIMIT_PER_IP=60, RATE_LIMIT_BURST=2)
+    controller = AdmissionController()
+    controller.admit("llm01", "sk-a", "10.0.0.1")
+    controller.admit("llm01", "sk-b", "10.0.0.1")
+    # The IP rejects these, so sk-a keeps its last token
+    for _ in range(3):
+        with pytest.raises(Rejected) as excinfo:
+            controller.admit("llm01", "sk-a", "10.0.0.1")
+        assert excinfo.value.reason == "rate_per_ip"
+    controller.admit("llm01", "sk-a", "10.0.0.2")
+
+
+def test_limits_are_per_lab(lab_env, clock, limiter):
+    lab_env(RATE_LIMIT_PER_KEY_LLM01=60, RATE_LIMIT_BURST=1)
+    controller = AdmissionController()
+    controller.admit("llm01", "sk-a", None)
+    with pytest.raises(Rejected):
+        controller.admit("llm01", "sk-a", None)
+    for _ in range(5):
+        controller.admit("llm02", "sk-a", None)
+
+
+def test_concurrency_limit_until_release(lab_env, clock, limiter):
+    lab_env(MAX_CONCURRENT_PER_CLIENT=2)
+    controller = AdmissionController()
+    first = controller.admit("llm01", "sk-a", "10.0.0.1")
+    controller.admit("llm01", "sk-a", "10.0.0.1")
+    with pytest.raises(Rejected) as excinfo:
+        controller.admit("llm01", "sk-a", "10.0.0.2")
+    assert excinfo.value.reason == "concurrency_per_key"
+
+    controller.release(first)
+    controller.admit("llm01", "sk-a", "10.0.0.2")
+    assert controller.stats()["clients_in_flight"] == 3
+
+
+def test_rejects_while_the_upstream_queue_is_full(lab_env, clock, limiter):
+    lab_env()
+    controller = AdmissionController()
+    limiter.waiting = 1
+    with pytest.raises(Rejected) as excinfo:
+        controller.admit("llm01", "sk-a", None)
+    assert excinfo.value.reason == "upstream_queue_full"
+    limiter.waiting = 0
+    assert controller.admit("llm01", "sk-a", None) == []
+    assert controller.stats()["rejected"] == {"upstream_queue_full": 1}
+
+
+def test_forgets_least_recently_seen_clients(lab_env, clock, limiter):
+    lab_env(RATE_LIMIT_PER_KEY=60, RATE_LIMIT_BURST=1)
+    controller = AdmissionController(max_clients=2)
+    for key in ("sk-a", "sk-b", "sk-c"):
+        controller.admit("llm01", key, None)
+    assert controller.stats()["tracked_clients"] == 2
+    # A forgotten client starts with a full bucket
+    controller.admit("llm01", "sk-a", None)
+
+
+def test_upstream_queue_is_bounded(lab_env):
+    lab_env(UPSTREAM_QUEUE_TIMEOUT_SECONDS=0)
+
+    async def run():
+        limiter = UpstreamLimiter(limit=1, max_queue=1)
+        release = asyncio.Event()
+
+        async def call():
+            async with limiter.slot():
+                await release.wait()
+
+        holder = asyncio.create_task(call())
+        waiter = asyncio.create_task(call())
+        await asyncio.sleep(0)
+        assert (limiter.in_flight, limiter.waiting) == (1, 1)
+        assert limiter.saturated()
+        with pytest.raises(UpstreamOverloaded) as excinfo:
+            await call()
+        release.set()
+        await asyncio.gather(holder, waiter)
+        return limiter, excinfo.value
+
+    limiter, error = asyncio.run(run())
+    assert error.retry_after >= 1.0
+    stats = limiter.stats()
+    assert (stats["shed"], stats["calls"], stats["in_flight"]) == (1, 2, 0)
+
+
+def test_upstream_wait_times_out(lab_env):
+    lab_env(UPSTREAM_QUEUE_TIMEOUT_SECONDS=0.01)
+
+    async def run():
+        limiter = UpstreamLimiter(limit=1, max_queue=0)
+        release = asyncio.Event()
+
+        async def hold():
+            async with limiter.slot():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(UpstreamOverloaded):
+            async with limiter.slot():
+                pass
+        release.set()
+        await holder
+        return limiter
+
+    limiter = asyncio.run(run())
+    assert limiter.stats()["timed_out"] == 1
+    assert limiter.waiting == 0
+
+
+def test_rejections_carry_cors_headers(lab_env, limiter):
+    from server import app
+
+    lab_env()
+    limiter.waiting = 1
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://lab"
+        ) as client:
+            return await client.post(
+                "/llm01/chat",
+                json={"message": "hi", "api_key": "sk-a"},
+                headers={"Origin": "http://example.com"},
+            )
+
+    response = asyncio.run(run())
+    assert response.status_code == 429
+    assert response.headers["access-control-allow-origin"]
+    assert "retry-after" in response.headers["access-control-expose-headers"].lower()
+    assert int(response.headers["retry-after"]) >= 1
@@ -0,0 +1,91 @@
+from models.chat_models import ChatRequest, ChatResponse
+from utils import completion_cache
+from utils.completion_cache import CompletionCache, completion_key
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def _request(**fields):
+    return ChatRequest(
+        **{"message": "hi", "temperature": 0, "api_key": "sk-a", **fields}
+    )
+
+
+def _response(text="hello", tokens=10):
+    return ChatResponse(response=text, model="m", usage={"total_tokens": tokens})
+
+
+def test_key_covers_api_key_and_settings():
+    key = completion_key("llm01", _request(), MESSAGES, None)
+    assert key == completion_key("llm01", _request(), MESSAGES, None)
+    assert key != completion_key("llm01", _request(api_key="sk-b"), MESSAGES, None)
+    assert key != completion_key("llm02", _request(), MESSAGES, None)
+    assert key != completion_key("llm01", _request(max_tokens=5), MESSAGES, None)
+    assert key != completion_key("llm01", _request(), MESSAGES, "web")
+    assert key != completion_key(
+        "llm01", _request(), [{"role": "user", "content": "hey"}], None
+    )
+
+
+def test_sampled_requests_bypass_the_cache():
+    cache = CompletionCache(max_bytes=1024, ttl=60, allow_sampled=False)
+    assert cache.allows(_request())
+    assert not cache.allows(_request(temperature=0.7))
+    assert not cache.allows(ChatRequest(message="hi", temperature=None))
+    assert cache.stats()["bypassed"] == 2
+    assert CompletionCache(max_bytes=1024, ttl=60, allow_sampled=True).allows(
+        _request(temperature=0.7)
+    )
+    assert not CompletionCache(max_bytes=0, ttl=60).allows(_request())
+
+
+def test_only_deterministic_requests_are_replayable():
+    cache = CompletionCache(max_bytes=0, ttl=60, allow_sampled=False)
+    # Independent of whether the cache itself is on
+    assert cache.replayable(_request())
+    assert not cache.replayable(_request(temperature=0.7))
+    assert not cache.replayable(ChatRequest(message="hi", temperature=None))
+    assert CompletionCache(allow_sampled=True).replayable(_request(temperature=0.7))
+    assert cache.stats()["bypassed"] == 0
+
+
+def test_hit_counts_saved_tokens():
+    cache = CompletionCache(max_bytes=4096, ttl=60)
+    assert cache.get("a") is None
+    cache.put("a", _response(tokens=12))
+    assert cache.get("a").response == "hello"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["tokens_saved"]) == (1, 1, 12)
+
+
+def test_entries_expire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(completion_cache.time, "monotonic", lambda: now[0])
+    cache = CompletionCache(max_bytes=4096, ttl=10)
+    cache.put("a", _response())
+    now[0] += 9
+    assert cache.get("a") is not None
+    now[0] += 1
+    assert cache.get("a") is None
+    assert cache.stats()["expired"] == 1
+    assert cache.bytes == 0
+
+
+def test_evicts_least_recently_used_by_size():
+    cache = CompletionCache(max_bytes=3 * (5 + 1 + 256), ttl=60)
+    for key in "abc":
+        cache.put(key, _response())
+    cache.get("a")
+    cache.put("d", _response())
+
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in "acd")
+    assert cache.stats()["evictions"] == 1
+    assert cache.bytes <= cache.max_bytes
+
+
+def test_skips_empty_and_oversized_answers():
+    cache = CompletionCache(max_bytes=300, ttl=60)
+    cache.put("a", _response(text=""))
+    cache.put("b", _response(text="x" * 100))
+    assert cache.stats()["entries"] == 0
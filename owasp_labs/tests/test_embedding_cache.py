@@ -0,0 +1,47 @@
+import sqlite3
+
+import numpy as np
+
+from utils.embedding_cache import EmbeddingCache
+
+
+def _table_size(path):
+    with sqlite3.connect(path) as db:
+        return db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()
+
+
+def test_round_trip_through_memory_and_disk(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = EmbeddingCache(path, memory_items=1)
+    cache.put_many("m", ["a", "b"], [np.ones(4), np.zeros(4)])
+
+    # "a" was pushed out of memory and comes back from disk
+    np.testing.assert_array_equal(cache.get("m", "a"), np.ones(4))
+    assert cache.get("other-model", "a") is None
+    stats = cache.stats()
+    assert (stats["disk_hits"], stats["misses"]) == (1, 1)
+
+
+def test_disk_counters_match_the_table(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = EmbeddingCache(path)
+    cache.put_many("m", ["a", "b"], [np.ones(4), np.ones(8)])
+    # Storing the same texts again adds no rows
+    cache.put_many("m", ["a", "c"], [np.ones(4), np.ones(2)])
+    stats = cache.stats()
+    assert (stats["disk_entries"], stats["disk_bytes"]) == _table_size(path)
+    assert stats["disk_entries"] == 3
+
+    reopened = EmbeddingCache(path)
+    stats = reopened.stats()
+    assert (stats["disk_entries"], stats["disk_bytes"]) == (3, (4 + 8 + 2) * 4)
+
+
+def test_memory_only_cache(tmp_path):
+    cache = EmbeddingCache(None, memory_items=2)
+    cache.put("m", "a", np.ones(4))
+    assert cache.get("m", "a") is not None
+    stats = cache.stats()
+    assert (stats["disk_entries"], stats["memory_bytes"]) == (0, 16)
@@ -0,0 +1,186 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from utils import history
+from utils.history import HistoryCompactor
+from utils.openai_client import UpstreamLimiter
+from utils.token_budget import message_tokens
+
+MODEL = "gpt-3.5-turbo"
+
+
+def _chat(turns, words=20):
+    """A conversation of user/assistant turns of roughly `words` words each."""
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"question {i} " + "word " * words})
+        messages.append(
+            {"role": "assistant", "content": f"answer {i} " + "word " * words}
+        )
+    return messages
+
+
+def _with_tool_rounds(turns):
+    """A conversation where every other turn calls two tools."""
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"question {i} " + "word " * 10})
+        if i % 2:
+            ids = [f"call_{i}_a", f"call_{i}_b"]
+            messages.append(
+                {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [
+                        {
+                            "id": call_id,
+                            "type": "function",
+                            "function": {"name": "scrape", "arguments": "{}"},
+                        }
+                        for call_id in ids
+                    ],
+                }
+            )
+            for call_id in ids:
+                messages.append(
+                    {
+                        "role": "tool",
+                        "tool_call_id": call_id,
+                        "content": "result " * 15,
+                    }
+                )
+        messages.append({"role": "assistant", "content": f"answer {i}"})
+    return messages
+
+
+def _tokens(messages):
+    return sum(message_tokens(message, MODEL) for message in messages)
+
+
+def test_short_history_is_untouched(lab_env):
+    lab_env(HISTORY_MAX_TOKENS=10000)
+    messages = _chat(3)
+    compaction = HistoryCompactor().compact(messages, MODEL, "llm09")
+    assert compaction.messages is messages
+    assert compaction.dropped == []
+
+
+def test_compaction_stays_within_the_budget(lab_env):
+    lab_env(HISTORY_MAX_TOKENS=300, HISTORY_PIN_FIRST=2, HISTORY_PIN_LAST=2)
+    messages = _chat(20)
+    compactor = HistoryCompactor()
+    compaction = compactor.compact(messages, MODEL, "llm09")
+
+    assert _tokens(compaction.messages) <= 300
+    assert compaction.messages[:2] == messages[:2]
+    assert compaction.messages[-2:] == messages[-2:]
+    # What was dropped is one contiguous stretch after the pinned head
+    kept_start = 2 + len(compaction.dropped)
+    assert compaction.dropped == messages[2:kept_start]
+    assert compaction.messages[2:] == messages[kept_start:]
+    stats = compactor.stats()
+    assert stats["messages_dropped"] == len(compaction.dropped)
+    assert stats["tokens_saved"] == _tokens(messages) - _tokens(compaction.messages)
+
+
+def test_summary_room_is_left_in_the_budget(lab_env):
+    lab_env(HISTORY_MAX_TOKENS=300, HISTORY_PIN_FIRST=2, HISTORY_PIN_LAST=2)
+    lab_env(HISTORY_SUMMARIZE="true", HISTORY_SUMMARY_MAX_TOKENS=100)
+    compaction = HistoryCompactor().compact(_chat(20), MODEL, "llm09")
+    assert compaction.summary_tokens > 100
+    assert _tokens(compaction.messages) + 100 <= 300
+
+
+@pytest.mark.parametrize("budget", range(150, 600, 25))
+@pytest.mark.parametrize("pins", [(0, 0), (1, 1), (2, 3), (3, 5)])
+def test_tool_calls_stay_with_their_results(lab_env, budget, pins):
+    lab_env(
+        HISTORY_MAX_TOKENS=budget, HISTORY_PIN_FIRST=pins[0], HISTORY_PIN_LAST=pins[1]
+    )
+    messages = _with_tool_rounds(8)
+    compaction = HistoryCompactor().compact(messages, MODEL, "llm09")
+
+    for kept in (compaction.messages, compaction.dropped):
+        calls = {
+            call["id"] for message in kept for call in message.get("tool_calls") or []
+        }
+        results = {
+            message["tool_call_id"] for message in kept if message["role"] == "tool"
+        }
+        assert calls == results
+    # No tool result directly follows the cut
+    at = compaction.summary_at
+    if compaction.dropped and at < len(compaction.messages):
+        assert compaction.messages[at]["role"] != "tool"
+
+
+class _SummaryClient:
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=self)
+        self.transcripts = []
+
+    async def create(self, messages, **kwargs):
+        self.transcripts.append(messages[-1]["content"])
+        usage = SimpleNamespace(prompt_tokens=50, completion_tokens=10, total_tokens=60)
+        message = SimpleNamespace(content=f"summary {len(self.transcripts)}")
+        return SimpleNamespace(usage=usage, choices=[SimpleNamespace(message=message)])
+
+
+def test_summary_is_extended_not_recomputed(lab_env, monkeypatch):
+    lab_env(
+        HISTORY_MAX_TOKENS=300,
+        HISTORY_PIN_FIRST=2,
+        HISTORY_PIN_LAST=2,
+        HISTORY_SUMMARIZE="true",
+        HISTORY_SUMMARY_MAX_TOKENS=50,
+    )
+    client = _SummaryClient()
+    monkeypatch.setattr(history, "get_openai_client", lambda api_key: client)
+    monkeypatch.setattr(history, "upstream_slot", UpstreamLimiter(limit=1).slot)
+    compactor = HistoryCompactor()
+
+    async def turn(messages):
+        compaction = compactor.compact(messages, MODEL, "llm09")
+        return compaction, await compactor.summarize(compaction, MODEL, "llm09", "sk-a")
+
+    async def run():
+        conversation = _chat(12)
+        first, first_messages = await turn(conversation)
+        # The same turn again is answered from the cache
+        await turn(conversation)
+        conversation = conversation + _chat(3)
+        second, second_messages = await turn(conversation)
+        return first, first_messages, second, second_messages
+
+    first, first_messages, second, second_messages = asyncio.run(run())
+
+    assert first_messages[2] == {
+        "role": "system",
+        "content": "Summary of earlier messages: summary 1",
+    }
+    assert second_messages[2]["content"].endswith("summary 2")
+    assert len(client.transcripts) == 2
+    # The second call only saw the newly dropped messages and the old summary
+    newly_dropped = second.dropped[len(first.dropped) :]
+    assert client.transcripts[1].startswith("Summary so far: summary 1")
+    assert "question 2 " not in client.transcripts[1]
+    assert history._transcript(newly_dropped) in client.transcripts[1]
+    stats = compactor.stats()
+    assert (stats["summaries_created"], stats["summaries_extended"]) == (1, 1)
+    assert stats["summary_hits"] == 1
+
+
+def test_failed_summary_leaves_the_dropped_messages_out(lab_env, monkeypatch):
+    lab_env(HISTORY_MAX_TOKENS=300, HISTORY_SUMMARIZE="true")
+
+    def no_client(api_key):
+        raise ValueError("OpenAI API key is required")
+
+    monkeypatch.setattr(history, "get_openai_client", no_client)
+    compactor = HistoryCompactor()
+    compaction = compactor.compact(_chat(20), MODEL, "llm09")
+    messages = asyncio.run(compactor.summarize(compaction, MODEL, "llm09", None))
+    assert messages == compaction.messages
+    assert compactor.stats()["summary_failures"] == 1
@@ -0,0 +1,97 @@
+import asyncio
+import importlib
+import threading
+
+import pytest
+
+# The handlers package exports a function of the same name
+llm08_handler = importlib.import_module("handlers.llm08_handler")
+
+
+class _FakeRAG:
+    resident_bytes = 0
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.closed = False
+        self.closed_on = None
+
+    def close(self):
+        self.closed = True
+        self.closed_on = threading.current_thread().name
+
+
+@pytest.fixture
+def registry(monkeypatch, tmp_path):
+    created = []
+
+    async def create(api_key):
+        rag = _FakeRAG(api_key)
+        created.append(rag)
+        return rag
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(llm08_handler.VulnerableRAG, "create", staticmethod(create))
+    registry = llm08_handler.RAGRegistry(max_instances=1)
+    registry.created = created
+    return registry
+
+
+def test_reuses_instance_per_key(registry):
+    async def run():
+        async with registry.use("sk-a") as first:
+            pass
+        async with registry.use("sk-a") as second:
+            pass
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first is second
+    assert registry.stats()["hits"] == 1
+
+
+def test_evicted_instance_is_closed_after_its_last_user(registry):
+    async def run():
+        async with registry.use("sk-a") as first:
+            # Evicts sk-a while this request still uses it
+            async with registry.use("sk-b"):
+                pass
+            assert not first.closed
+            assert registry.stats()["retired_in_use"] == 1
+        return first
+
+    first = asyncio.run(run())
+    assert first.closed
+    # Closing flushes the store, so it runs on the worker pool
+    assert first.closed_on.startswith("llm08")
+    stats = registry.stats()
+    assert (stats["size"], stats["retired_in_use"]) == (1, 0)
+
+
+def test_unused_evicted_instance_is_closed_off_the_event_loop(registry):
+    async def run():
+        async with registry.use("sk-a"):
+            pass
+        async with registry.use("sk-b"):
+            pass
+
+    asyncio.run(run())
+    first, second = registry.created
+    assert first.closed and first.closed_on.startswith("llm08")
+    assert not second.closed
+
+
+def test_removes_only_the_files_of_the_shared_knowledge_base(registry, tmp_path):
+    for name in ("llm08_embeddings.npy", "llm08_documents.json", "llm08_index.json"):
+        (tmp_path / name).write_text("{}")
+    store = tmp_path / "llm08_store"
+    store.mkdir()
+    (store / "CURRENT").write_text("gen-0")
+
+    async def run():
+        async with registry.use("sk-a"):
+            pass
+
+    asyncio.run(run())
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["llm08_store"]
+    assert (store / "CURRENT").exists()
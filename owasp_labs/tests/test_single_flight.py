@@ -0,0 +1,252 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from fastapi import HTTPException
+from models.chat_models import ChatRequest
+from utils import chat_utils
+from utils.completion_cache import CompletionCache, SingleFlight
+from utils.openai_client import UpstreamLimiter, UpstreamOverloaded
+
+
+class _FakeClient:
+    """Non-streaming upstream that answers after a delay, failing first if told to."""
+
+    def __init__(self, failures=0, delay=0.01):
+        self.chat = SimpleNamespace(completions=self)
+        self.calls = []
+        self.failures = failures
+        self.delay = delay
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        number = len(self.calls)
+        await asyncio.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("upstream failed")
+        usage = SimpleNamespace(prompt_tokens=5, completion_tokens=2, total_tokens=7)
+        message = SimpleNamespace(content=f"answer {number}", tool_calls=None)
+        return SimpleNamespace(
+            model="gpt-test-0001",
+            usage=usage,
+            choices=[SimpleNamespace(message=message)],
+        )
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    """openai_chat against a fake upstream, with fresh cache and flights."""
+    flights = SingleFlight(enabled=True)
+    cache = CompletionCache(max_bytes=1024 * 1024, ttl=60, allow_sampled=False)
+    client = _FakeClient()
+
+    def get_client(api_key):
+        if not api_key:
+            raise ValueError("OpenAI API key is required")
+        return client
+
+    monkeypatch.setattr(chat_utils, "get_single_flight", lambda: flights)
+    monkeypatch.setattr(chat_utils, "get_completion_cache", lambda: cache)
+    monkeypatch.setattr(chat_utils, "get_openai_client", get_client)
+    monkeypatch.setattr(chat_utils, "upstream_slot", UpstreamLimiter(limit=8).slot)
+
+    def call(cache_answers=False, **fields):
+        request = ChatRequest(
+            **{"message": "hi", "temperature": 0, "api_key": "sk-a", **fields}
+        )
+        return chat_utils.openai_chat(
+            request, "You are a test.", use_tools=False, cache=cache_answers
+        )
+
+    return SimpleNamespace(call=call, client=client, flights=flights, cache=cache)
+
+
+def test_identical_requests_share_one_call(chat):
+    async def run():
+        return await asyncio.gather(*(chat.call() for _ in range(5)))
+
+    responses = asyncio.run(run())
+    assert len(chat.client.calls) == 1
+    assert {response.response for response in responses} == {"answer 1"}
+    stats = chat.flights.stats()
+    assert (stats["leaders"], stats["coalesced"], stats["in_flight"]) == (1, 4, 0)
+    assert stats["tokens_saved"] == 28
+
+
+def test_sampled_requests_are_not_coalesced(chat):
+    async def run():
+        return await asyncio.gather(*(chat.call(temperature=0.7) for _ in range(3)))
+
+    responses = asyncio.run(run())
+    assert len(chat.client.calls) == 3
+    assert len({response.response for response in responses}) == 3
+    assert chat.flights.stats()["leaders"] == 0
+
+
+def test_different_keys_do_not_coalesce(chat):
+    async def run():
+        await asyncio.gather(chat.call(api_key="sk-a"), chat.call(api_key="sk-b"))
+
+    asyncio.run(run())
+    assert len(chat.client.calls) == 2
+    assert chat.flights.stats()["coalesced"] == 0
+
+
+def test_waiters_fall_back_when_the_leader_fails(chat):
+    chat.client.failures = 1
+
+    async def run():
+        leader = asyncio.create_task(chat.call())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(chat.call())
+        with pytest.raises(HTTPException):
+            await leader
+        return await waiter
+
+    response = asyncio.run(run())
+    assert len(chat.client.calls) == 2
+    assert response.response == "answer 2"
+    assert chat.flights.stats()["fallbacks"] == 1
+
+
+def test_cache_answers_before_coalescing(chat):
+    async def run():
+        first = await chat.call(cache_answers=True)
+        second = await chat.call(cache_answers=True)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert second.response == first.response
+    assert len(chat.client.calls) == 1
+    assert chat.cache.stats()["hits"] == 1
+    assert chat.flights.stats()["coalesced"] == 0
+
+
+def test_request_without_key_gets_no_shared_answer(chat):
+    async def run():
+        await chat.call(cache_answers=True)
+        with pytest.raises(HTTPException) as excinfo:
+            await chat.call(cache_answers=True, api_key=None)
+        return excinfo.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 500
+    assert chat.cache.stats()["hits"] == 0
+
+
+def test_limiter_caps_concurrent_calls():
+    async def run():
+        limiter = UpstreamLimiter(limit=2, max_queue=0)
+        peak = 0
+
+        async def call():
+            nonlocal peak
+            async with limiter.slot():
+                peak = max(peak, limiter.in_flight)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(call() for _ in range(6)))
+        return limiter, peak
+
+    limiter, peak = asyncio.run(run())
+    assert peak == 2
+    assert limiter.in_flight == 0
+    assert limiter.stats()["calls"] == 6
+
+
+def _chunk(content=None, usage=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=content, tool_calls=None))]
+    return SimpleNamespace(
+        model="gpt-test-0001", usage=usage, choices=choices if content else []
+    )
+
+
+class _FakeStreamClient:
+    def __init__(self, chunks):
+        self.chat = SimpleNamespace(completions=self)
+        self._chunks = chunks
+
+    async def create(self, **kwargs):
+        async def stream():
+            for chunk in self._chunks:
+                yield chunk
+
+        return stream()
+
+
+def test_stream_releases_slot_before_the_client_finishes(monkeypatch):
+    usage = SimpleNamespace(prompt_tokens=3, completion_tokens=2, total_tokens=5)
+    client = _FakeStreamClient([_chunk("Hel"), _chunk("lo"), _chunk(usage=usage)])
+    request = ChatRequest(message="hi", model="gpt-test")
+
+    async def run():
+        limiter = UpstreamLimiter(limit=1, max_queue=0)
+        monkeypatch.setattr(chat_utils, "upstream_slot", limiter.slot)
+        events = chat_utils._stream_completion(client, request, [], None)
+        first = await events.__anext__()
+        # The model is done; the client has not read the rest yet
+        for _ in range(5):
+            await asyncio.sleep(0)
+        in_flight = limiter.in_flight
+        rest = [event async for event in events]
+        return first, in_flight, rest
+
+    first, in_flight, rest = asyncio.run(run())
+    assert first == ("delta", "Hel")
+    assert in_flight == 0
+    assert rest[0] == ("delta", "lo")
+    content, tool_calls, usage_dict, model = rest[-1][1]
+    assert (content, tool_calls, model) == ("Hello", [], "gpt-test-0001")
+    assert usage_dict["total_tokens"] == 5
+
+
+def test_stream_stops_reading_when_the_client_leaves(monkeypatch):
+    class EndlessClient(_FakeStreamClient):
+        async def create(self, **kwargs):
+            async def stream():
+                while True:
+                    await asyncio.sleep(0.001)
+                    yield _chunk("x")
+
+            return stream()
+
+    request = ChatRequest(message="hi")
+
+    async def run():
+        limiter = UpstreamLimiter(limit=1, max_queue=0)
+        monkeypatch.setattr(chat_utils, "upstream_slot", limiter.slot)
+        events = chat_utils._stream_completion(EndlessClient([]), request, [], None)
+        await events.__anext__()
+        await events.aclose()
+        await asyncio.sleep(0.01)
+        return limiter.in_flight
+
+    assert asyncio.run(run()) == 0
+
+
+def test_limiter_keeps_its_permits_through_timeouts_and_cancellation(lab_env):
+    lab_env(UPSTREAM_QUEUE_TIMEOUT_SECONDS=0.001)
+
+    async def run():
+        limiter = UpstreamLimiter(limit=2, max_queue=0)
+
+        async def call():
+            try:
+                async with limiter.slot():
+                    await asyncio.sleep(0.001)
+            except UpstreamOverloaded:
+                pass
+
+        for _ in range(20):
+            tasks = [asyncio.create_task(call()) for _ in range(10)]
+            await asyncio.sleep(0.001)
+            tasks[-1].cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        # Both slots can still be held at once
+        async with limiter.slot(), limiter.slot():
+            return limiter.in_flight, limiter.waiting
+
+    assert asyncio.run(run()) == (2, 0)
@@ -0,0 +1,152 @@
+import pytest
+
+from utils import token_budget
+from utils.token_budget import (
+    TokenBudget,
+    TokenBudgetExceeded,
+    count_tokens,
+    estimate_prompt_tokens,
+)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(token_budget.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_concurrent_requests_reserve_their_worst_case(lab_env, clock):
+    lab_env(TOKEN_BUDGET_PER_KEY=1000)
+    budget = TokenBudget(window_seconds=60)
+    first = budget.check("llm01", "sk-a", 100, 300)
+    second = budget.check("llm01", "sk-a", 100, 300)
+    # Neither has finished, but a third would not fit beside them
+    with pytest.raises(TokenBudgetExceeded) as excinfo:
+        budget.check("llm01", "sk-a", 100, 300)
+    assert excinfo.value.status_code == 429
+    assert excinfo.value.retry_after == 60
+
+    # Another key has a budget of its own
+    budget.check("llm01", "sk-b", 100, 300)
+    assert (first.tokens, second.tokens) == (400, 400)
+
+
+def test_record_settles_to_actual_usage(lab_env, clock):
+    lab_env(TOKEN_BUDGET_PER_KEY=1000)
+    budget = TokenBudget(window_seconds=60)
+    reservation = budget.check("llm01", "sk-a", 100, 800)
+    with pytest.raises(TokenBudgetExceeded):
+        budget.check("llm01", "sk-a", 100, 100)
+
+    budget.record("llm01", "sk-a", {"total_tokens": 150}, 100, reservation)
+    assert reservation.windows[0][1] == 150
+    budget.check("llm01", "sk-a", 100, 700)
+    # Settling twice changes nothing
+    budget.release(reservation)
+    assert reservation.windows[0][1] == 950
+    assert budget.stats()["spent_tokens"] == 150
+
+
+def test_release_frees_the_reservation(lab_env, clock):
+    lab_env(TOKEN_BUDGET_PER_LAB=500)
+    budget = TokenBudget(window_seconds=60)
+    reservation = budget.check("llm01", "sk-a", 100, 400)
+    budget.release(reservation, {"total_tokens": 40})
+    assert reservation.windows[0][1] == 40
+    budget.check("llm01", "sk-b", 60, 400)
+
+
+def test_window_resets(lab_env, clock):
+    lab_env(TOKEN_BUDGET_PER_KEY=500)
+    budget = TokenBudget(window_seconds=60)
+    old = budget.check("llm01", "sk-a", 100, 400)
+    clock[0] += 60
+    new = budget.check("llm01", "sk-a", 100, 400)
+    # A reservation from the previous window does not touch the new one
+    budget.release(old)
+    assert new.windows[0][1] == 500
+
+
+def test_lab_specific_key_budget_has_its_own_window(lab_env, clock):
+    lab_env(TOKEN_BUDGET_PER_KEY=1000, TOKEN_BUDGET_PER_KEY_LLM02=200)
+    budget = TokenBudget(window_seconds=60)
+    budget.check("llm01", "sk-a", 100, 800)
+    # llm02 counts the key separately, so llm01 spend does not use it up
+    budget.check("llm02", "sk-a", 50, 150)
+    with pytest.raises(TokenBudgetExceeded):
+        budget.check("llm02", "sk-a", 1, 0)
+    # ...and llm02 spend does not reach the shared window
+    budget.check("llm03", "sk-a", 50, 50)
+    with pytest.raises(TokenBudgetExceeded):
+        budget.check("llm03", "sk-a", 1, 0)
+
+
+def test_unreserved_usage_is_charged(lab_env, clock):
+    lab_env(TOKEN_BUDGET_PER_KEY=300)
+    budget = TokenBudget(window_seconds=60)
+    budget.record("llm09", "sk-a", {"total_tokens": 250})
+    with pytest.raises(TokenBudgetExceeded):
+        budget.check("llm09", "sk-a", 30, 30)
+
+
+def test_no_budget_means_unlimited(lab_env, clock):
+    lab_env()
+    budget = TokenBudget(window_seconds=60)
+    for _ in range(10):
+        assert budget.check("llm01", "sk-a", 1000, 4000).windows == []
+    assert budget.stats()["tracked_keys"] == 0
+
+
+def test_oversized_prompt_is_rejected(lab_env):
+    lab_env(MAX_PROMPT_TOKENS_LLM01=100)
+    budget = TokenBudget()
+    with pytest.raises(TokenBudgetExceeded) as excinfo:
+        budget.check("llm01", "sk-a", 101, 10)
+    assert excinfo.value.status_code == 413
+    budget.check("llm02", "sk-a", 101, 10)
+
+
+def test_request_larger_than_the_budget_is_rejected_as_too_large(lab_env, clock):
+    lab_env(TOKEN_BUDGET_PER_KEY=1000, TOKEN_BUDGET_PER_LAB=500)
+    budget = TokenBudget(window_seconds=60)
+    with pytest.raises(TokenBudgetExceeded) as excinfo:
+        budget.check("llm01", "sk-a", 100, 1000)
+    assert excinfo.value.status_code == 413
+    with pytest.raises(TokenBudgetExceeded) as excinfo:
+        budget.check("llm01", "sk-a", 100, 401)
+    assert excinfo.value.status_code == 413
+    # Nothing was reserved by the rejected requests
+    budget.check("llm01", "sk-a", 100, 400)
+
+
+def test_least_recently_used_keys_are_forgotten(lab_env, clock):
+    lab_env(TOKEN_BUDGET_PER_KEY=100)
+    budget = TokenBudget(window_seconds=60, max_keys=2)
+    for key in ("sk-a", "sk-b", "sk-c"):
+        budget.check("llm01", key, 50, 50)
+    assert budget.stats()["tracked_keys"] == 2
+    budget.check("llm01", "sk-a", 50, 50)
+
+
+def test_fit_tool_results_truncates_largest_first(lab_env):
+    lab_env(MAX_PROMPT_TOKENS_LLM01=300)
+    messages = [
+        {"role": "user", "content": "summarize"},
+        {"role": "tool", "tool_call_id": "1", "content": "small result"},
+        {"role": "tool", "tool_call_id": "2", "content": "word " * 1000},
+    ]
+    budget = TokenBudget()
+    budget.fit_tool_results(messages, "gpt-3.5-turbo", None, "llm01")
+
+    assert estimate_prompt_tokens(messages, "gpt-3.5-turbo") <= 300
+    assert messages[1]["content"] == "small result"
+    assert messages[2]["content"].endswith(" [truncated]")
+    assert budget.stats()["truncated_tool_results"] == 1
+
+
+def test_estimate_counts_message_framing():
+    messages = [{"role": "user", "content": "hello"}]
+    assert estimate_prompt_tokens(messages, "gpt-3.5-turbo") == 3 + 3 + count_tokens(
+        "hello"
+    )
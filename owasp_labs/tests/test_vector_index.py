@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from utils import vector_index, vector_store
+from utils.vector_index import (
+    VectorIndex,
+    _FaissIndex,
+    make_vector_index,
+    top_k_similar,
+)
+from utils.vector_store import VectorStore
+
+
+def _brute_force(matrix, query, top_k):
+    similarities = (
+        matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query))
+    )
+    return list(np.argsort(-similarities, kind="stable")[:top_k])
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = VectorStore(str(tmp_path / "store"))
+    rng = np.random.default_rng(0)
+    store.extend([f"doc {i}" for i in range(200)], rng.normal(size=(200, 8)))
+    yield store
+    store.close()
+
+
+def test_top_k_matches_brute_force():
+    rng = np.random.default_rng(1)
+    matrix = rng.normal(size=(50, 6)).astype(np.float32)
+    query = rng.normal(size=6).astype(np.float32)
+    norms = np.linalg.norm(matrix, axis=1)
+    assert list(top_k_similar(matrix, norms, query, 5)) == _brute_force(
+        matrix, query, 5
+    )
+
+
+def test_top_k_skips_unusable_rows():
+    matrix = np.array([[1, 0], [0, 0], [0, 1]], dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1)
+    result = top_k_similar(matrix, norms, np.array([1, 1], dtype=np.float32), 3)
+    assert sorted(result) == [0, 2]
+    assert len(top_k_similar(matrix, norms, np.zeros(2), 3)) == 0
+    assert len(top_k_similar(matrix[:0], norms[:0], np.ones(2), 3)) == 0
+
+
+def test_exact_index_skips_deleted_rows(store):
+    index = VectorIndex(store)
+    query = np.asarray(store.matrix[7])
+    assert index.search(query, 1)[0] == 7
+    store.delete([7])
+    assert 7 not in index.search(query, 10)
+
+
+def test_faiss_backend_requires_create(store):
+    class Incomplete(_FaissIndex):
+        kind = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete(store)
+
+
+def test_unknown_backend(store):
+    with pytest.raises(ValueError):
+        make_vector_index(store, "annoy")
+
+
+@pytest.mark.parametrize("backend", ["hnsw", "ivf"])
+def test_faiss_backends(store, backend, monkeypatch):
+    pytest.importorskip("faiss")
+    monkeypatch.setattr(vector_index, "IVF_MIN_TRAIN", 100)
+    monkeypatch.setattr(vector_index, "IVF_NPROBE", 64)
+    monkeypatch.setattr(vector_store, "COMPACT_MIN_DELETED", 1000)
+    index = make_vector_index(store, backend)
+    assert index.kind == backend
+
+    query = np.asarray(store.matrix[42])
+    assert index.search(query, 1)[0] == 42
+
+    # Rows appended after the build are added incrementally
+    store.append("new", query * 2)
+    assert 200 in index.search(query, 2)
+
+    store.delete([42])
+    assert 42 not in index.search(query, 5)
+
+    # A second process loads the saved index for the same generation
+    index.save()
+    loaded = make_vector_index(store, backend)
+    assert loaded.index is not None
+    assert loaded.count == len(store)
+    assert 42 not in loaded.search(query, 5)
+
+
+def test_faiss_index_rebuilds_after_compaction(store, monkeypatch):
+    pytest.importorskip("faiss")
+    monkeypatch.setattr(vector_store, "COMPACT_MIN_DELETED", 1)
+    monkeypatch.setattr(vector_store, "COMPACT_RATIO", 0.1)
+    index = make_vector_index(store, "hnsw")
+    index.search(np.asarray(store.matrix[0]), 1)
+
+    store.delete(range(100))
+    assert store.generation == 1
+    query = np.asarray(store.matrix[0])
+    assert index.search(query, 1)[0] == 0
+    assert index.generation == 1
+    assert index.index.ntotal == 100
@@ -0,0 +1,172 @@
+import os
+
+import numpy as np
+import pytest
+
+from utils import vector_store
+from utils.vector_store import VectorStore
+
+
+def _rows(count, dim=4, start=1):
+    return np.arange(start, start + count * dim, dtype=np.float32).reshape(count, dim)
+
+
+def _disk_bytes(store):
+    directory = store._generation_dir(store.generation)
+    return sum(
+        os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+    )
+
+
+@pytest.fixture
+def open_store(tmp_path):
+    stores = []
+
+    def factory(name="store"):
+        store = VectorStore(str(tmp_path / name))
+        stores.append(store)
+        return store
+
+    yield factory
+    for store in stores:
+        store.close()
+
+
+def test_append_and_read_back(open_store):
+    store = open_store()
+    assert store.extend(["alpha", "beta"], _rows(2)) == [0, 1]
+    assert store.append("gämma", _rows(1, start=100)[0]) == 2
+
+    assert len(store) == 3
+    assert store.live_count == 3
+    assert store.dim == 4
+    assert store.documents([2, 0]) == ["gämma", "alpha"]
+    np.testing.assert_array_equal(store.matrix[1], _rows(2)[1])
+    np.testing.assert_allclose(store.norms, np.linalg.norm(store.matrix, axis=1))
+
+
+def test_rejects_mismatched_embeddings(open_store):
+    store = open_store()
+    store.append("a", np.ones(4))
+    with pytest.raises(ValueError):
+        store.append("b", np.ones(3))
+    with pytest.raises(ValueError):
+        store.extend(["c", "d"], np.ones((1, 4)))
+
+
+def test_deleted_rows_are_masked(open_store):
+    store = open_store()
+    store.extend(["a", "b", "c"], _rows(3))
+    store.delete([1])
+
+    assert store.live_count == 2
+    assert store.is_deleted(1)
+    assert list(store.live_rows()) == [0, 2]
+    assert store.norms[1] == 0
+    assert list(store.iter_documents()) == ["a", "c"]
+
+
+def test_reopen_keeps_rows_and_deletions(open_store):
+    store = open_store()
+    store.extend(["a", "b", "c"], _rows(3))
+    store.delete([0])
+    store.close()
+
+    reopened = open_store()
+    assert len(reopened) == 3
+    assert list(reopened.iter_documents()) == ["b", "c"]
+    np.testing.assert_array_equal(reopened.matrix, _rows(3))
+
+
+def test_compaction_switches_generation(open_store, monkeypatch):
+    monkeypatch.setattr(vector_store, "COMPACT_MIN_DELETED", 2)
+    monkeypatch.setattr(vector_store, "COMPACT_RATIO", 0.5)
+    store = open_store()
+    store.extend(["a", "b", "c", "d"], _rows(4))
+
+    store.delete([0])
+    assert store.generation == 0
+    store.delete([2])
+
+    assert store.generation == 1
+    assert len(store) == 2
+    assert list(store.iter_documents()) == ["b", "d"]
+    np.testing.assert_array_equal(store.matrix, _rows(4)[[1, 3]])
+    assert not os.path.exists(store._generation_dir(0))
+    with open(os.path.join(store.path, "CURRENT")) as f:
+        assert f.read() == "gen-1"
+
+
+def test_recover_trims_partial_write(open_store, tmp_path):
+    store = open_store()
+    store.extend(["a", "b"], _rows(2))
+    store.close()
+
+    # A writer died after the document and offsets of a third row, before
+    # its norm and embedding
+    directory = tmp_path / "store" / "gen-0"
+    with open(directory / "documents.log", "ab") as f:
+        f.write(b"partial")
+    with open(directory / "offsets.u64", "ab") as f:
+        f.write(np.array([2, 7], dtype=np.uint64).tobytes())
+    with open(directory / "embeddings.f32", "ab") as f:
+        f.write(b"\0\0")
+
+    recovered = open_store()
+    assert len(recovered) == 2
+    assert list(recovered.iter_documents()) == ["a", "b"]
+    assert os.path.getsize(directory / "offsets.u64") == 2 * 16
+    assert os.path.getsize(directory / "embeddings.f32") == 2 * 4 * 4
+    assert os.path.getsize(directory / "documents.log") == 2
+
+    assert recovered.append("c", np.ones(4)) == 2
+    assert list(recovered.iter_documents()) == ["a", "b", "c"]
+
+
+def test_handles_pick_up_each_others_writes(open_store, monkeypatch):
+    """Two handles on one directory behave like two worker processes."""
+    monkeypatch.setattr(vector_store, "COMPACT_MIN_DELETED", 1)
+    monkeypatch.setattr(vector_store, "COMPACT_RATIO", 0.1)
+    first = open_store()
+    second = open_store()
+
+    first.extend(["a", "b"], _rows(2))
+    with second.lock:
+        assert len(second) == 2
+        assert second.document(1) == "b"
+
+    second.append("c", np.ones(4))
+    with first.lock:
+        assert list(first.iter_documents()) == ["a", "b", "c"]
+
+    first.delete([0])
+    assert first.generation == 1
+    with second.lock:
+        assert second.generation == 1
+        assert list(second.iter_documents()) == ["b", "c"]
+
+
+def test_disk_bytes_tracks_writes(open_store, monkeypatch):
+    monkeypatch.setattr(vector_store, "COMPACT_MIN_DELETED", 2)
+    store = open_store()
+    assert store.disk_bytes() == _disk_bytes(store)
+    store.extend(["a", "bb"], _rows(2))
+    store.append("ccc", np.ones(4))
+    assert store.disk_bytes() == _disk_bytes(store)
+    store.delete([0])
+    assert store.disk_bytes() == _disk_bytes(store)
+    store.delete([1])
+    assert store.generation == 1
+    assert store.disk_bytes() == _disk_bytes(store)
+
+
+def test_shared_store_per_directory(tmp_path):
+    path = str(tmp_path / "shared")
+    store = vector_store.get_vector_store(path)
+    try:
+        assert vector_store.get_vector_store(path) is store
+    finally:
+        vector_store.close_vector_store(path)
+    assert vector_store.get_vector_store(path) is not store
+    vector_store.remove_vector_store(path)
+    assert not os.path.exists(path)
@@ -3,11 +3,24 @@ Tools package for OWASP labs
 """
 
 from .install_libraries import get_install_libraries_tool, install_libraries
-from .web_scraper import fetch_website_content, get_web_scraping_tool
+from .registry import TOOL_SETS, Tool, get_tool, get_tool_schemas, register_tool
+from .web_scraper import (
+    close_web_client,
+    fetch_website_content,
+    get_web_cache_stats,
+    get_web_scraping_tool,
+)
 
 __all__ = [
+    "TOOL_SETS",
+    "Tool",
+    "close_web_client",
     "fetch_website_content",
+    "get_tool",
+    "get_tool_schemas",
+    "get_web_cache_stats",
     "get_web_scraping_tool",
     "install_libraries",
     "get_install_libraries_tool",
+    "register_tool",
 ]
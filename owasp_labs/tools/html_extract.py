@@ -0,0 +1,151 @@
+"""
+Incremental HTML text extraction for the web scraping tool.
+
+The extractor is fed the response body chunk by chunk, drops script and style
+content as it goes, and reports when enough text has been collected so the
+caller can stop downloading.
+"""
+
+import os
+import re
+from html.parser import HTMLParser
+from typing import List, Optional
+
+try:
+    from lxml import etree
+except ImportError:  # lxml is optional, html.parser is always available
+    etree = None
+
+# "auto" uses lxml when it is installed, otherwise the standard library parser
+HTML_PARSER_BACKEND = os.getenv("WEB_HTML_PARSER", "auto")
+
+_SKIPPED_TAGS = {"script", "style"}
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class _TextSink:
+    """Collect visible text and the title from parser callbacks."""
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self.parts: List[str] = []
+        self.length = 0
+        self.title: Optional[str] = None
+        self._skip_depth = 0
+        self._in_title = False
+        self._title_parts: List[str] = []
+        self._trailing_space = True
+
+    @property
+    def done(self) -> bool:
+        return self.length >= self.max_chars
+
+    def start(self, tag: str) -> None:
+        tag = tag.lower()
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag == "title" and self.title is None:
+            self._in_title = True
+
+    def end(self, tag: str) -> None:
+        tag = tag.lower()
+        if tag in _SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag == "title" and self._in_title:
+            self._in_title = False
+            self.title = "".join(self._title_parts)
+
+    def data(self, data: str) -> None:
+        if self._skip_depth or self.done:
+            return
+        if self._in_title:
+            self._title_parts.append(data)
+
+        # Collapse whitespace runs across chunk boundaries
+        text = _WHITESPACE_RE.sub(" ", data)
+        if self._trailing_space:
+            text = text.lstrip(" ")
+        if not text:
+            return
+        self._trailing_space = text.endswith(" ")
+        self.parts.append(text)
+        self.length += len(text)
+
+    def text(self) -> str:
+        return "".join(self.parts).strip()[: self.max_chars]
+
+
+class _StdlibParser(HTMLParser):
+    def __init__(self, sink: _TextSink):
+        super().__init__(convert_charrefs=True)
+        self.sink = sink
+
+    def handle_starttag(self, tag, attrs):
+        self.sink.start(tag)
+
+    def handle_endtag(self, tag):
+        self.sink.end(tag)
+
+    def handle_data(self, data):
+        self.sink.data(data)
+
+
+class _LxmlTarget:
+    def __init__(self, sink: _TextSink):
+        self.sink = sink
+
+    def start(self, tag, attrib):
+        self.sink.start(tag)
+
+    def end(self, tag):
+        self.sink.end(tag)
+
+    def data(self, data):
+        self.sink.data(data)
+
+    def close(self):
+        return None
+
+
+class StreamingTextExtractor:
+    """
+    Extract the title and visible text from HTML fed in chunks.
+
+    Args:
+        max_chars (int): Text budget; `done` becomes true once it is reached
+        backend (str): "lxml", "html.parser" or "auto"
+    """
+
+    def __init__(self, max_chars: int = 5000, backend: str = HTML_PARSER_BACKEND):
+        self._sink = _TextSink(max_chars)
+        if backend == "auto":
+            backend = "lxml" if etree is not None else "html.parser"
+        if backend == "lxml" and etree is None:
+            raise ValueError("lxml backend requested but lxml is not installed")
+        self.backend = backend
+        if backend == "lxml":
+            self._parser = etree.HTMLParser(target=_LxmlTarget(self._sink))
+        else:
+            self._parser = _StdlibParser(self._sink)
+
+    @property
+    def done(self) -> bool:
+        """Whether the text budget has been reached."""
+        return self._sink.done
+
+    def feed(self, chunk: str) -> None:
+        if not self.done:
+            self._parser.feed(chunk)
+
+    def close(self) -> None:
+        """Flush any buffered input once the body has been fully read."""
+        if not self.done:
+            self._parser.close()
+
+    @property
+    def title(self) -> str:
+        return self._sink.title or "No title found"
+
+    @property
+    def text(self) -> str:
+        return self._sink.text()
@@ -2,6 +2,8 @@
 This tool is used to install libraries.
 """
 
+from .registry import register_tool
+
 
 def install_libraries(library_name: str):
     """
@@ -32,3 +34,10 @@ def get_install_libraries_tool() -> dict[str, any]:
             },
         },
     }
+
+
+async def _install_libraries_tool(library_name: str):
+    return install_libraries(library_name)
+
+
+register_tool(get_install_libraries_tool(), _install_libraries_tool)
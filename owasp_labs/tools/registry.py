@@ -0,0 +1,61 @@
+"""
+Registry of tools that can be offered to the model.
+
+Each tool registers its OpenAI function schema once, together with an async
+executor that receives the parsed function arguments as keyword arguments.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Named groups of tools that labs can request through `tool_type`
+TOOL_SETS: Dict[str, List[str]] = {
+    "web_scraping": ["fetch_website_content"],
+    "install_libraries": ["install_libraries"],
+    "both": ["fetch_website_content", "install_libraries"],
+}
+
+
+@dataclass(frozen=True)
+class Tool:
+    """A tool schema paired with the coroutine that executes it."""
+
+    name: str
+    schema: Dict[str, Any]
+    executor: Callable[..., Awaitable[Any]]
+
+
+_tools: Dict[str, Tool] = {}
+
+
+def register_tool(
+    schema: Dict[str, Any], executor: Callable[..., Awaitable[Any]]
+) -> Tool:
+    """
+    Register a tool under the function name declared in its schema.
+
+    Args:
+        schema (dict): OpenAI tool definition ({"type": "function", ...})
+        executor (callable): Async function called with the tool arguments
+
+    Returns:
+        Tool: The registered tool
+    """
+    tool = Tool(name=schema["function"]["name"], schema=schema, executor=executor)
+    _tools[tool.name] = tool
+    return tool
+
+
+def get_tool(name: str) -> Optional[Tool]:
+    """Get a registered tool by function name."""
+    return _tools.get(name)
+
+
+def get_tool_schemas(tool_type: str) -> List[Dict[str, Any]]:
+    """
+    Get the schemas for a tool set name or a single registered tool name.
+
+    Unknown names resolve to an empty list.
+    """
+    names = TOOL_SETS.get(tool_type, [tool_type])
+    return [_tools[name].schema for name in names if name in _tools]
@@ -2,16 +2,245 @@
 Web scraping tool for fetching content from shared websites
 """
 
-from typing import Any, Dict
+import asyncio
+import codecs
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
 
-import requests
-from bs4 import BeautifulSoup
+import httpx
 
+from .html_extract import StreamingTextExtractor
+from .registry import register_tool
 
-def fetch_website_content(url: str, extract_text: bool = True) -> Dict[str, Any]:
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+# Shared connection pool and response cache sizing
+WEB_MAX_CONNECTIONS = int(os.getenv("WEB_MAX_CONNECTIONS", "100"))
+WEB_CACHE_MAX_BYTES = int(os.getenv("WEB_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+# Heuristic freshness of pages without Cache-Control max-age; only pages with
+# an ETag or Last-Modified get it, so edits show up once they are revalidated
+WEB_CACHE_TTL_SECONDS = float(os.getenv("WEB_CACHE_TTL_SECONDS", "0"))
+
+# Characters returned to the model, and the most bytes read from any response
+MAX_CONTENT_CHARS = 5000
+WEB_MAX_RESPONSE_BYTES = int(os.getenv("WEB_MAX_RESPONSE_BYTES", str(2 * 1024 * 1024)))
+
+_MAX_AGE_RE = re.compile(r"max-age\s*=\s*(\d+)")
+
+
+@dataclass
+class _CacheEntry:
+    result: Dict[str, Any]
+    size: int
+    expires_at: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+class WebCache:
+    """
+    Size-bounded LRU cache of fetch results.
+
+    Freshness follows the response's Cache-Control max-age, falling back to a
+    default TTL for responses with an ETag or Last-Modified validator only;
+    stale entries with a validator are revalidated with a conditional request
+    instead of being refetched. Responses with neither are not cached, so a
+    page edited by its owner is never served stale.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = WEB_CACHE_MAX_BYTES,
+        default_ttl: float = WEB_CACHE_TTL_SECONDS,
+    ):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Tuple[str, bool], _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, bool]) -> Optional[_CacheEntry]:
+        """Get an entry (fresh or stale) and mark it recently used."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def ttl_for(self, headers: httpx.Headers) -> Optional[float]:
+        """Freshness lifetime for a response, or None if it must not be stored."""
+        cache_control = headers.get("cache-control", "").lower()
+        if "no-store" in cache_control or "private" in cache_control:
+            return None
+        if "no-cache" in cache_control:
+            return 0.0
+        match = _MAX_AGE_RE.search(cache_control)
+        if match:
+            return float(match.group(1))
+        if headers.get("etag") or headers.get("last-modified"):
+            return self.default_ttl
+        return 0.0
+
+    def put(
+        self, key: Tuple[str, bool], result: Dict[str, Any], headers: httpx.Headers
+    ) -> None:
+        """Store a successful result according to the response headers."""
+        ttl = self.ttl_for(headers)
+        etag = headers.get("etag")
+        last_modified = headers.get("last-modified")
+        # Nothing to gain from an entry that is never fresh and cannot be revalidated
+        if ttl is None or (ttl == 0 and not (etag or last_modified)):
+            return
+
+        size = sum(len(str(value)) for value in result.values())
+        if size > self.max_bytes:
+            return
+        entry = _CacheEntry(
+            result=result,
+            size=size,
+            expires_at=time.monotonic() + ttl,
+            etag=etag,
+            last_modified=last_modified,
+        )
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.size
+            self._entries[key] = entry
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.size
+                self.evictions += 1
+
+    def refresh(self, entry: _CacheEntry, headers: httpx.Headers) -> None:
+        """Extend an entry's freshness after a 304 Not Modified."""
+        ttl = self.ttl_for(headers)
+        entry.expires_at = time.monotonic() + (ttl or 0.0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidated": self.revalidated,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = WebCache()
+_inflight: Dict[Tuple[str, bool], asyncio.Future] = {}
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    """Get the shared async HTTP client used for all fetches."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            headers={"User-Agent": USER_AGENT},
+            timeout=10,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=WEB_MAX_CONNECTIONS),
+        )
+    return _http_client
+
+
+async def _read_limited(response: httpx.Response, extract_text: bool) -> Dict[str, Any]:
+    """
+    Read a streamed response only as far as needed to fill the content budget.
+
+    Text extraction happens while the body streams in; reading stops once
+    MAX_CONTENT_CHARS of text (or HTML) are collected or WEB_MAX_RESPONSE_BYTES
+    have been read, whichever comes first.
+    """
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(
+        errors="replace"
+    )
+    extractor = StreamingTextExtractor(MAX_CONTENT_CHARS) if extract_text else None
+    html_parts = []
+    html_length = 0
+    bytes_read = 0
+    complete = True
+
+    async for chunk in response.aiter_bytes():
+        chunk = chunk[: WEB_MAX_RESPONSE_BYTES - bytes_read]
+        bytes_read += len(chunk)
+        text = decoder.decode(chunk)
+        if extractor is not None:
+            extractor.feed(text)
+            finished = extractor.done
+        else:
+            html_parts.append(text)
+            html_length += len(text)
+            finished = html_length >= MAX_CONTENT_CHARS
+        if finished or bytes_read >= WEB_MAX_RESPONSE_BYTES:
+            complete = False
+            break
+
+    if extractor is not None:
+        if complete:
+            extractor.feed(decoder.decode(b"", final=True))
+            extractor.close()
+        return {
+            "title": extractor.title,
+            "content": extractor.text,
+            "content_type": "text",
+        }
+    return {
+        "content": "".join(html_parts)[:MAX_CONTENT_CHARS],
+        "content_type": "html",
+    }
+
+
+async def _fetch_uncached(
+    url: str, extract_text: bool, entry: Optional[_CacheEntry]
+) -> Dict[str, Any]:
+    """Fetch a URL (conditionally if a stale entry exists) and update the cache."""
+    key = (url, extract_text)
+    headers = {}
+    if entry is not None:
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+
+    async with _get_http_client().stream("GET", url, headers=headers) as response:
+        if response.status_code == 304 and entry is not None:
+            _cache.revalidated += 1
+            _cache.refresh(entry, response.headers)
+            return entry.result
+        response.raise_for_status()
+        result = {"success": True, "url": url}
+        result.update(await _read_limited(response, extract_text))
+
+    _cache.put(key, result, response.headers)
+    return result
+
+
+async def fetch_website_content(url: str, extract_text: bool = True) -> Dict[str, Any]:
     """
     Fetch content from a website URL.
 
+    Results are cached per URL, and concurrent fetches of the same URL share a
+    single upstream request.
+
     Args:
         url (str): The URL to fetch content from
         extract_text (bool): Whether to extract only text content or include HTML
@@ -19,44 +248,40 @@ def fetch_website_content(url: str, extract_text: bool = True) -> Dict[str, Any]
     Returns:
         dict: Dictionary containing the fetched content and metadata
     """
+    key = (url, extract_text)
     try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        if extract_text:
-            # Extract text content using BeautifulSoup
-            soup = BeautifulSoup(response.content, "html.parser")
-
-            # Remove script and style elements
-            for script in soup(["script", "style"]):
-                script.decompose()
-
-            # Get text content
-            text_content = soup.get_text()
+        entry = _cache.get(key)
+        if entry is not None and entry.expires_at > time.monotonic():
+            _cache.hits += 1
+            return entry.result
 
-            # Clean up whitespace
-            lines = (line.strip() for line in text_content.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            text_content = " ".join(chunk for chunk in chunks if chunk)
+        # Coalesce with an identical fetch that is already in flight
+        inflight = _inflight.get(key)
+        if inflight is not None:
+            _cache.coalesced += 1
+            return await asyncio.shield(inflight)
 
-            return {
-                "success": True,
-                "url": url,
-                "title": soup.title.string if soup.title else "No title found",
-                "content": text_content[:5000],  # Limit content length
-                "content_type": "text",
-            }
+        _cache.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        _inflight[key] = future
+        try:
+            result = await _fetch_uncached(url, extract_text, entry)
+        except asyncio.CancelledError:
+            future.set_exception(RuntimeError("Fetch was cancelled"))
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so waiter-less failures are not logged as unhandled
+            future.exception()
+            raise
         else:
-            return {
-                "success": True,
-                "url": url,
-                "content": response.text[:5000],  # Limit content length
-                "content_type": "html",
-            }
+            future.set_result(result)
+            return result
+        finally:
+            _inflight.pop(key, None)
 
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         return {
             "success": False,
             "url": url,
@@ -66,6 +291,19 @@ def fetch_website_content(url: str, extract_text: bool = True) -> Dict[str, Any]
         return {"success": False, "url": url, "error": f"Unexpected error: {str(e)}"}
 
 
+async def close_web_client() -> None:
+    """Close the shared connection pool (used on server shutdown)."""
+    global _http_client
+    http_client, _http_client = _http_client, None
+    if http_client is not None:
+        await http_client.aclose()
+
+
+def get_web_cache_stats() -> Dict[str, Any]:
+    """Get hit/miss/revalidation counters for the web scraper cache."""
+    return _cache.stats()
+
+
 def get_web_scraping_tool() -> Dict[str, Any]:
     """
     Get the web scraping tool definition for OpenAI function calling.
@@ -95,3 +333,6 @@ def get_web_scraping_tool() -> Dict[str, Any]:
             },
         },
     }
+
+
+register_tool(get_web_scraping_tool(), fetch_website_content)
@@ -1,4 +1,48 @@
-from .chat_utils import openai_chat
-from .openai_client import get_openai_client
+from .admission import AdmissionMiddleware, get_admission_stats
+from .chat_utils import openai_chat, openai_chat_stream, stream_chat_response
+from .completion_cache import (
+    get_completion_cache,
+    get_completion_cache_stats,
+    get_single_flight_stats,
+)
+from .embedding_cache import get_embedding_cache, get_embedding_cache_stats
+from .history import get_history_stats
+from .message_store import (
+    close_message_store,
+    get_message_store,
+    get_message_store_stats,
+)
+from .openai_client import (
+    close_openai_clients,
+    get_client_registry_stats,
+    get_openai_client,
+    get_upstream_stats,
+)
+from .prompts import PromptTemplate, SystemPrompt, get_prompt_cache_stats
+from .token_budget import count_tokens, get_token_budget_stats
 
-__all__ = ["get_openai_client", "openai_chat"]
+__all__ = [
+    "AdmissionMiddleware",
+    "PromptTemplate",
+    "SystemPrompt",
+    "close_message_store",
+    "close_openai_clients",
+    "count_tokens",
+    "get_admission_stats",
+    "get_client_registry_stats",
+    "get_completion_cache",
+    "get_completion_cache_stats",
+    "get_embedding_cache",
+    "get_embedding_cache_stats",
+    "get_history_stats",
+    "get_message_store",
+    "get_message_store_stats",
+    "get_openai_client",
+    "get_prompt_cache_stats",
+    "get_single_flight_stats",
+    "get_token_budget_stats",
+    "get_upstream_stats",
+    "openai_chat",
+    "openai_chat_stream",
+    "stream_chat_response",
+]
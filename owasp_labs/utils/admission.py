@@ -0,0 +1,272 @@
+"""
+Admission control for the lab chat endpoints.
+
+Requests to /<lab>/chat are admitted or turned away before any lab work is
+done, so one client looping on an endpoint cannot crowd out everyone else:
+
+- token buckets per API key and per client IP (RATE_LIMIT_PER_KEY and
+  RATE_LIMIT_PER_IP requests per minute, bursts of up to RATE_LIMIT_BURST)
+- at most MAX_CONCURRENT_PER_CLIENT requests in flight per API key and per
+  IP, counted until the response, streamed or not, is complete
+- no new requests while the upstream wait queue (UPSTREAM_QUEUE_SIZE) is full
+
+All limits default to off except the upstream queue, and each can be set per
+lab (see utils.lab_settings). Rejected requests get 429 with Retry-After.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .lab_settings import lab_setting
+from .metrics import count_rejection
+from .openai_client import get_upstream_limiter
+
+RATE_LIMIT_PER_KEY = 0.0
+RATE_LIMIT_PER_IP = 0.0
+RATE_LIMIT_BURST = 10
+MAX_CONCURRENT_PER_CLIENT = 0
+ADMISSION_MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", "10000"))
+# Behind a reverse proxy (e.g. on Render) the client is the first
+# X-Forwarded-For address; only trust it when the proxy sets it.
+TRUST_FORWARDED_FOR = os.getenv(
+    "TRUST_FORWARDED_FOR", "false"
+).lower() in ("1", "true", "yes")
+
+_LAB_PATH = re.compile(r"^/(llm\d+\w*)/chat$")
+
+
+class Rejected(Exception):
+    """A request was not admitted."""
+
+    def __init__(self, message: str, reason: str, retry_after: float):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Rate and concurrency limits per client.
+
+    Clients are API key hashes ("key:...") and IP addresses ("ip:...").
+    Token buckets of the least recently seen clients are forgotten once more
+    than `max_clients` are tracked; a forgotten client starts with a full
+    bucket.
+    """
+
+    def __init__(self, max_clients: int = ADMISSION_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {}
+        # client -> [tokens, last refill time]
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._in_flight: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _refill(self, client: str, rate: float, burst: int, now: float) -> List[float]:
+        """A client's bucket, refilled at `rate` tokens per second up to now."""
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = [float(burst), now]
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+            bucket[0] = min(float(burst), bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        return bucket
+
+    def _reject(self, message: str, reason: str, lab: str, retry_after: float):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        count_rejection(reason, lab)
+        return Rejected(message, reason, retry_after)
+
+    def admit(self, lab: str, api_key: Optional[str], ip: Optional[str]) -> List[str]:
+        """
+        Admit a request or raise Rejected.
+
+        Returns the clients whose in-flight count was taken; pass them to
+        release() when the response is complete.
+        """
+        clients: List[Tuple[str, str]] = []
+        if api_key:
+            digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:32]
+            clients.append(("KEY", f"key:{digest}"))
+        if ip:
+            clients.append(("IP", f"ip:{ip}"))
+
+        limiter = get_upstream_limiter()
+        now = time.monotonic()
+        with self._lock:
+            if limiter.saturated():
+                raise self._reject(
+                    "Server is overloaded, too many requests are waiting",
+                    "upstream_queue_full",
+                    lab,
+                    limiter.retry_after(),
+                )
+            max_concurrent = lab_setting(
+                "MAX_CONCURRENT_PER_CLIENT", lab, MAX_CONCURRENT_PER_CLIENT
+            )
+            if max_concurrent:
+                for kind, client in clients:
+                    if self._in_flight.get(client, 0) >= max_concurrent:
+                        raise self._reject(
+                            f"Too many concurrent requests for this "
+                            f"{'API key' if kind == 'KEY' else 'client'}",
+                            f"concurrency_per_{kind.lower()}",
+                            lab,
+                            1.0,
+                        )
+            burst = lab_setting("RATE_LIMIT_BURST", lab, RATE_LIMIT_BURST)
+            buckets = []
+            for kind, client in clients:
+                per_minute = lab_setting(
+                    f"RATE_LIMIT_PER_{kind}",
+                    lab,
+                    RATE_LIMIT_PER_KEY if kind == "KEY" else RATE_LIMIT_PER_IP,
+                    float,
+                )
+                if not per_minute:
+                    continue
+                rate = per_minute / 60
+                bucket = self._refill(client, rate, burst, now)
+                if bucket[0] < 1:
+                    raise self._reject(
+                        f"Rate limit of {per_minute:g} requests per minute exceeded",
+                        f"rate_per_{kind.lower()}",
+                        lab,
+                        (1 - bucket[0]) / rate,
+                    )
+                buckets.append(bucket)
+            # Taken only once every bucket has room, so a rejection by one
+            # limit does not use up the others
+            for bucket in buckets:
+                bucket[0] -= 1
+            self.admitted += 1
+            if not max_concurrent:
+                return []
+            taken = [client for _, client in clients]
+            for client in taken:
+                self._in_flight[client] = self._in_flight.get(client, 0) + 1
+            return taken
+
+    def release(self, clients: List[str]) -> None:
+        with self._lock:
+            for client in clients:
+                count = self._in_flight.get(client, 0) - 1
+                if count > 0:
+                    self._in_flight[client] = count
+                else:
+                    self._in_flight.pop(client, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+                "tracked_clients": len(self._buckets),
+                "clients_in_flight": len(self._in_flight),
+            }
+
+
+def _client_ip(scope) -> Optional[str]:
+    if TRUST_FORWARDED_FOR:
+        for name, value in scope.get("headers", ()):
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else None
+
+
+def _api_key(body: bytes) -> Optional[str]:
+    try:
+        api_key = json.loads(body).get("api_key")
+    except (ValueError, AttributeError):
+        # Malformed bodies are left for request validation to reject
+        return None
+    return api_key if isinstance(api_key, str) else None
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying admission control to POST /<lab>/chat.
+
+    The request body is read here to find the API key and then replayed to
+    the application.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        match = None
+        if scope["type"] == "http" and scope["method"] == "POST":
+            match = _LAB_PATH.match(scope["path"])
+        if match is None:
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                # Client went away before sending the whole body
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body = b"".join(chunks)
+
+        try:
+            clients = _controller.admit(
+                match.group(1), _api_key(body), _client_ip(scope)
+            )
+        except Rejected as e:
+            await _send_rejection(send, e)
+            return
+
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        try:
+            await self.app(scope, replay, send)
+        finally:
+            _controller.release(clients)
+
+
+async def _send_rejection(send, rejected: Rejected) -> None:
+    body = json.dumps({"detail": str(rejected)}).encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after", str(max(1, math.ceil(rejected.retry_after))).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+_controller = AdmissionController()
+
+
+def get_admission_stats() -> Dict[str, Any]:
+    """Get admitted and rejected request counts."""
+    return _controller.stats()
@@ -1,188 +1,428 @@
+import asyncio
 import json
 import logging
+import math
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
 
 from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
 from models.chat_models import ChatRequest, ChatResponse
 from openai import OpenAIError
-from tools import (
-    fetch_website_content,
-    get_install_libraries_tool,
-    get_web_scraping_tool,
-    install_libraries,
-)
+from tools import get_tool, get_tool_schemas
 
-from .openai_client import get_openai_client
+from .completion_cache import completion_key, get_completion_cache, get_single_flight
+from .history import compact_history, summarize_history
+from .metrics import current_lab, observe_tool, record_usage, stage
+from .openai_client import UpstreamOverloaded, get_openai_client, upstream_slot
+from .prompts import SystemPrompt, record_prompt_cache
+from .token_budget import (
+    TokenBudgetExceeded,
+    TokenReservation,
+    estimate_prompt_tokens,
+    get_token_budget,
+    max_completion_tokens,
+)
 
 logger = logging.getLogger(__name__)
 
+# Tool calls from one assistant message run concurrently, at most
+# TOOL_CONCURRENCY at a time and all within TOOL_DEADLINE_SECONDS.
+TOOL_CONCURRENCY = int(os.getenv("TOOL_CONCURRENCY", "4"))
+TOOL_DEADLINE_SECONDS = float(os.getenv("TOOL_DEADLINE_SECONDS", "15"))
+
+# Limits for the agent loop; once any is exhausted the model is asked for a
+# final answer without tools.
+MAX_TOOL_ROUNDS = int(os.getenv("MAX_TOOL_ROUNDS", "3"))
+MAX_AGENT_TOKENS = int(os.getenv("MAX_AGENT_TOKENS", "16000"))
+AGENT_DEADLINE_SECONDS = float(os.getenv("AGENT_DEADLINE_SECONDS", "60"))
+
+
+class AgentBudget:
+    """Track rounds, tokens and wall-clock time spent by one agent loop."""
+
+    def __init__(
+        self,
+        max_rounds: int = MAX_TOOL_ROUNDS,
+        max_tokens: int = MAX_AGENT_TOKENS,
+        deadline_seconds: float = AGENT_DEADLINE_SECONDS,
+    ):
+        self.max_rounds = max_rounds
+        self.max_tokens = max_tokens
+        self.deadline = time.monotonic() + deadline_seconds
+        self.rounds = 0
+        self.usage: Optional[Dict[str, int]] = None
+
+    def remaining(self) -> float:
+        """Seconds left before the wall-clock deadline."""
+        return self.deadline - time.monotonic()
+
+    def record(self, usage: Optional[Dict[str, int]]) -> None:
+        """Add the usage of one completion to the running total."""
+        if not usage:
+            return
+        if self.usage is None:
+            self.usage = dict(usage)
+        else:
+            for key, value in usage.items():
+                self.usage[key] = self.usage.get(key, 0) + value
+
+    def allows_tool_round(self) -> bool:
+        """Whether the model may be offered tools for another round."""
+        tokens = self.usage["total_tokens"] if self.usage else 0
+        return (
+            self.rounds < self.max_rounds
+            and tokens < self.max_tokens
+            and self.remaining() > 0
+        )
+
+
+def _build_messages(
+    request: ChatRequest, system_prompt: Union[str, SystemPrompt]
+) -> List[Dict[str, Any]]:
+    """
+    Prepend the system prompt to the conversation sent by the client.
+
+    The dynamic tail of a SystemPrompt goes just before the newest user
+    message, so the prefix and earlier turns stay the same across requests
+    (see utils.prompts).
+    """
+    if isinstance(system_prompt, str):
+        system_prompt = SystemPrompt(system_prompt)
+    if request.messages:
+        # Use provided conversation history
+        conversation = list(request.messages)
+    else:
+        # Fallback to single message (backward compatibility)
+        conversation = [{"role": "user", "content": request.message}]
+    messages = [{"role": "system", "content": system_prompt.prefix}] + conversation
+    if system_prompt.tail:
+        at = len(messages)
+        if conversation[-1].get("role") == "user":
+            at -= 1
+        messages.insert(at, {"role": "system", "content": system_prompt.tail})
+    return messages
+
+
+def _usage_to_dict(usage) -> Optional[Dict[str, int]]:
+    if not usage:
+        return None
+    usage_dict = {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "total_tokens": usage.total_tokens,
+    }
+    # Prompt tokens served from the provider's prompt cache
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details else None
+    if cached is not None:
+        usage_dict["cached_tokens"] = cached
+    return usage_dict
+
+
+def _completion_kwargs(
+    request: ChatRequest, tools: Optional[List[Dict[str, Any]]]
+) -> Dict[str, Any]:
+    limit = max_completion_tokens(current_lab())
+    kwargs: Dict[str, Any] = {
+        "model": request.model,
+        "max_tokens": min(request.max_tokens or limit, limit),
+        "temperature": request.temperature,
+    }
+    if tools:
+        kwargs["tools"] = tools
+        kwargs["tool_choice"] = "auto"
+    return kwargs
+
+
+def _check_token_budget(
+    request: ChatRequest,
+    system_prompt: Union[str, SystemPrompt],
+    use_tools: bool,
+    tool_type: str,
+    extra_tokens: int = 0,
+) -> TokenReservation:
+    """
+    Estimate the prompt tokens of a request, plus `extra_tokens` not yet in
+    its messages, and check them against the token limits of the lab and the
+    budgets of its key and lab.
+
+    Returns the reservation holding the estimate, to be recorded or released
+    when the request ends; raises 413 for oversized prompts and 429, with
+    Retry-After, for exhausted budgets.
+    """
+    lab = current_lab()
+    prompt_tokens = extra_tokens + estimate_prompt_tokens(
+        _build_messages(request, system_prompt),
+        request.model,
+        tool_type if use_tools else None,
+    )
+    max_tokens = _completion_kwargs(request, None)["max_tokens"]
+    try:
+        return get_token_budget().check(lab, request.api_key, prompt_tokens, max_tokens)
+    except TokenBudgetExceeded as e:
+        logger.warning(f"Token budget: {e}")
+        raise _http_error(e.status_code, str(e), e.retry_after)
+
+
+def _http_error(status_code: int, detail: str, retry_after: float) -> HTTPException:
+    headers = None
+    if retry_after:
+        headers = {"Retry-After": str(max(1, math.ceil(retry_after)))}
+    return HTTPException(status_code=status_code, detail=detail, headers=headers)
+
+
+async def _execute_tool_call(tool_call: Dict[str, Any]) -> Dict[str, Any]:
+    """Run a single tool call and return the tool message for the conversation."""
+    name = tool_call["function"]["name"]
+    logger.info(f"Processing tool call: {name}")
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        tool = get_tool(name)
+        if tool is None:
+            function_response = {"error": f"Unknown tool: {name}"}
+            outcome = "unknown"
+        else:
+            function_args = json.loads(tool_call["function"]["arguments"] or "{}")
+            function_response = await tool.executor(**function_args)
+            logger.info(f"Function response: {function_response}")
+        content = json.dumps(function_response, ensure_ascii=False)
+    except asyncio.CancelledError:
+        observe_tool(name, time.perf_counter() - start, "timeout")
+        raise
+    except Exception as e:
+        logger.error(f"Error processing tool call: {e}")
+        content = json.dumps({"error": f"Failed to process tool call: {str(e)}"})
+        outcome = "error"
+
+    observe_tool(name, time.perf_counter() - start, outcome)
+    return _tool_message(tool_call, content)
+
+
+def _tool_message(tool_call: Dict[str, Any], content: str) -> Dict[str, Any]:
+    return {
+        "tool_call_id": tool_call["id"],
+        "role": "tool",
+        "name": tool_call["function"]["name"],
+        "content": content,
+    }
+
+
+async def _run_tool_round(
+    messages: List[Dict[str, Any]],
+    content: Optional[str],
+    tool_calls: List[Dict[str, Any]],
+    deadline_seconds: float = TOOL_DEADLINE_SECONDS,
+) -> None:
+    """Append the assistant tool-call message and each tool's result to messages."""
+    logger.info(f"Tool calls detected: {len(tool_calls)}")
+
+    # Add assistant message to conversation
+    messages.append({"role": "assistant", "content": content, "tool_calls": tool_calls})
+
+    # Dispatch tool calls concurrently, bounded by the concurrency limit
+    semaphore = asyncio.Semaphore(TOOL_CONCURRENCY)
+
+    async def bounded(tool_call: Dict[str, Any]) -> Dict[str, Any]:
+        async with semaphore:
+            return await _execute_tool_call(tool_call)
+
+    tasks = [asyncio.create_task(bounded(tool_call)) for tool_call in tool_calls]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=max(deadline_seconds, 0))
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+    # Append results in the original order so the conversation is unchanged
+    for tool_call, task in zip(tool_calls, tasks):
+        if task in done:
+            messages.append(task.result())
+        else:
+            logger.error(f"Tool call timed out: {tool_call['function']['name']}")
+            messages.append(
+                _tool_message(
+                    tool_call,
+                    json.dumps(
+                        {
+                            "error": "Tool call did not finish within "
+                            f"{deadline_seconds:g} seconds"
+                        }
+                    ),
+                )
+            )
+
 
 async def openai_chat(
     request: ChatRequest,
-    system_prompt: str,
+    system_prompt: Union[str, SystemPrompt],
     use_tools: bool = True,
     tool_type: str = "web_scraping",
+    cache: bool = False,
 ):
-    """Shared chat logic for all vulnerability endpoints."""
+    """
+    Shared chat logic for all vulnerability endpoints.
+
+    Conversation history beyond the lab's history budget is compacted (see
+    utils.history); a summary of it is only requested once the request has
+    passed the token budget check. With `cache`, a request identical to a recent
+    deterministic one is answered from the completion cache, streamed or not.
+    Identical deterministic requests arriving while one is in flight share its
+    upstream call.
+    """
+    if isinstance(system_prompt, str):
+        system_prompt = SystemPrompt(system_prompt)
+    # Before any lookup, so a request without a key cannot be answered from
+    # the cache or a call paid for by another key
     try:
         client = get_openai_client(request.api_key)
+    except ValueError as e:
+        logger.error(f"Configuration error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Configuration error: {str(e)}")
 
-        # Define available tools based on tool_type
-        tools = None
-        if use_tools:
-            if tool_type == "web_scraping":
-                tools = [get_web_scraping_tool()]
-            elif tool_type == "install_libraries":
-                tools = [get_install_libraries_tool()]
-            elif tool_type == "both":
-                tools = [get_web_scraping_tool(), get_install_libraries_tool()]
-
-        # Prepare messages
-        if request.messages:
-            # Use provided conversation history
-            messages = [{"role": "system", "content": system_prompt}] + request.messages
-        else:
-            # Fallback to single message (backward compatibility)
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": request.message},
-            ]
-
-        # Create completion with or without tools
-        if tools:
-            response = client.chat.completions.create(
-                model=request.model,
-                messages=messages,
-                tools=tools,
-                tool_choice="auto",
-                max_tokens=request.max_tokens,
-                temperature=request.temperature,
-            )
-        else:
-            response = client.chat.completions.create(
-                model=request.model,
-                messages=messages,
-                max_tokens=request.max_tokens,
-                temperature=request.temperature,
-            )
+    completion_cache = get_completion_cache()
+    flights = get_single_flight()
+    cacheable = cache and completion_cache.allows(request)
+    key = None
+    # Sampled answers vary between calls, so they are neither cached nor shared
+    if completion_cache.replayable(request) and (cacheable or flights.enabled):
+        key = completion_key(
+            current_lab(),
+            request,
+            _build_messages(request, system_prompt),
+            tool_type if use_tools else None,
+        )
 
-        # Handle tool calls if present
-        assistant_message = response.choices[0].message
+    shared = completion_cache.get(key) if cacheable else None
+    if shared is None and key is not None:
+        shared = await flights.wait(key)
+    if shared is not None:
+        return stream_chat_response(shared) if request.stream else shared
 
-        # Check if there are tool calls
-        if hasattr(assistant_message, "tool_calls") and assistant_message.tool_calls:
-            logger.info(f"Tool calls detected: {len(assistant_message.tool_calls)}")
+    compaction = None
+    if request.messages:
+        # Long conversations are cut down before their size is checked
+        compaction = compact_history(request.messages, request.model, current_lab())
+        request.messages = compaction.messages
 
-            # Add assistant message to conversation
-            messages.append(
-                {
-                    "role": "assistant",
-                    "content": assistant_message.content,
-                    "tool_calls": [
-                        {
-                            "id": tool_call.id,
-                            "type": tool_call.type,
-                            "function": {
-                                "name": tool_call.function.name,
-                                "arguments": tool_call.function.arguments,
-                            },
-                        }
-                        for tool_call in assistant_message.tool_calls
-                    ],
-                }
+    # Checked before streaming starts, so rejections get a proper status
+    reservation = _check_token_budget(
+        request,
+        system_prompt,
+        use_tools,
+        tool_type,
+        compaction.summary_tokens if compaction else 0,
+    )
+    if compaction is not None and compaction.summary_tokens:
+        try:
+            request.messages = await summarize_history(
+                compaction, request.model, current_lab(), request.api_key
             )
+        except BaseException:
+            get_token_budget().release(reservation)
+            raise
 
-            # Process each tool call
-            for tool_call in assistant_message.tool_calls:
-                logger.info(f"Processing tool call: {tool_call.function.name}")
-
-                if tool_call.function.name == "fetch_website_content":
-                    try:
-                        # Parse function arguments
-                        function_args = json.loads(tool_call.function.arguments)
-                        url = function_args.get("url")
-                        extract_text = function_args.get("extract_text", True)
-
-                        logger.info(f"Fetching content from: {url}")
-
-                        # Call the function
-                        function_response = fetch_website_content(url, extract_text)
-
-                        logger.info(f"Function response: {function_response}")
-
-                        # Add function response to messages
-                        messages.append(
-                            {
-                                "tool_call_id": tool_call.id,
-                                "role": "tool",
-                                "name": tool_call.function.name,
-                                "content": json.dumps(
-                                    function_response, ensure_ascii=False
-                                ),
-                            }
-                        )
-                    except Exception as e:
-                        logger.error(f"Error processing tool call: {e}")
-                        messages.append(
-                            {
-                                "tool_call_id": tool_call.id,
-                                "role": "tool",
-                                "name": tool_call.function.name,
-                                "content": json.dumps(
-                                    {"error": f"Failed to process tool call: {str(e)}"}
-                                ),
-                            }
-                        )
-                elif tool_call.function.name == "install_libraries":
-                    try:
-                        function_args = json.loads(tool_call.function.arguments)
-                        library_name = function_args.get("library_name")
-                        function_response = install_libraries(library_name)
-                        messages.append(
-                            {
-                                "tool_call_id": tool_call.id,
-                                "role": "tool",
-                                "name": tool_call.function.name,
-                                "content": json.dumps(
-                                    function_response, ensure_ascii=False
-                                ),
-                            }
-                        )
-                    except Exception as e:
-                        logger.error(f"Error processing tool call: {e}")
-                        messages.append(
-                            {
-                                "tool_call_id": tool_call.id,
-                                "role": "tool",
-                                "name": tool_call.function.name,
-                                "content": json.dumps(
-                                    {"error": f"Failed to process tool call: {str(e)}"}
-                                ),
-                            }
+    if request.stream:
+        return StreamingResponse(
+            openai_chat_stream(
+                request,
+                system_prompt,
+                use_tools,
+                tool_type,
+                key,
+                cacheable,
+                reservation,
+            ),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    budget = AgentBudget()
+    try:
+        with flights.lead(key) as flight:
+            with stage("prompt_build"):
+                # Define available tools based on tool_type
+                tools = get_tool_schemas(tool_type) if use_tools else None
+
+                # Prepare messages
+                messages = _build_messages(request, system_prompt)
+
+            # Agent loop: offer tools until the model answers or the budget runs out
+            model = request.model
+            while True:
+                offered_tools = tools if budget.allows_tool_round() else None
+                if not offered_tools and budget.rounds:
+                    logger.info("Getting final response from OpenAI")
+                if budget.rounds:
+                    get_token_budget().fit_tool_results(
+                        messages,
+                        request.model,
+                        tool_type if offered_tools else None,
+                        current_lab(),
+                    )
+                # Stages are completion_1, completion_2, ... per upstream call
+                with stage(f"completion_{budget.rounds + 1}"):
+                    async with upstream_slot():
+                        response = await client.chat.completions.create(
+                            messages=messages,
+                            **_completion_kwargs(request, offered_tools),
                         )
+                budget.record(_usage_to_dict(response.usage))
+                # Metrics are labelled with the model that answered, not the
+                # name the client asked for
+                model = response.model or model
+                assistant_message = response.choices[0].message
+
+                if not (offered_tools and assistant_message.tool_calls):
+                    break
 
-            # Get final response from OpenAI
-            logger.info("Getting final response from OpenAI")
-            final_response = client.chat.completions.create(
+                tool_calls = [
+                    {
+                        "id": tool_call.id,
+                        "type": tool_call.type,
+                        "function": {
+                            "name": tool_call.function.name,
+                            "arguments": tool_call.function.arguments,
+                        },
+                    }
+                    for tool_call in assistant_message.tool_calls
+                ]
+                budget.rounds += 1
+                await _run_tool_round(
+                    messages,
+                    assistant_message.content,
+                    tool_calls,
+                    min(TOOL_DEADLINE_SECONDS, budget.remaining()),
+                )
+
+            record_usage(budget.usage, model)
+            # Without tool rounds the usage is that of the estimated prompt
+            get_token_budget().record(
+                current_lab(),
+                request.api_key,
+                budget.usage,
+                0 if budget.rounds else reservation.prompt_tokens,
+                reservation,
+            )
+            record_prompt_cache(
+                current_lab(), system_prompt, budget.usage, request.model
+            )
+            chat_response = ChatResponse(
+                response=assistant_message.content,
                 model=request.model,
-                messages=messages,
-                max_tokens=request.max_tokens,
-                temperature=request.temperature,
+                usage=budget.usage,
             )
-            assistant_message = final_response.choices[0].message
-            response = final_response  # Update response for usage tracking
-
-        usage = None
-        if response.usage:
-            usage = {
-                "prompt_tokens": response.usage.prompt_tokens,
-                "completion_tokens": response.usage.completion_tokens,
-                "total_tokens": response.usage.total_tokens,
-            }
-
-        return ChatResponse(
-            response=assistant_message.content, model=request.model, usage=usage
-        )
+            if cacheable:
+                completion_cache.put(key, chat_response)
+            flight.set_result(chat_response)
+            return chat_response
 
+    except UpstreamOverloaded as e:
+        logger.warning(f"Upstream overloaded: {e}")
+        raise _http_error(429, str(e), e.retry_after)
     except OpenAIError as e:
         logger.error(f"OpenAI API error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
@@ -192,3 +432,208 @@ async def openai_chat(
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
+    finally:
+        # Failed requests give back what they reserved but did not use
+        get_token_budget().release(reservation, budget.usage)
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format a server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _stream_completion(
+    client, request: ChatRequest, messages: List[Dict[str, Any]], tools
+) -> AsyncIterator[tuple]:
+    """
+    Stream one completion, yielding ("delta", text) for each content chunk and
+    finally ("end", (content, tool_calls, usage, model)), with the model
+    named by the upstream.
+
+    The upstream stream is read by a separate task into a buffer, so the
+    upstream slot is released as soon as the model is done, however slowly
+    the client reads the events.
+    """
+    chunks: asyncio.Queue = asyncio.Queue()
+
+    async def read_upstream() -> None:
+        try:
+            async with upstream_slot():
+                stream = await client.chat.completions.create(
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **_completion_kwargs(request, tools),
+                )
+                async for chunk in stream:
+                    chunks.put_nowait(chunk)
+        except Exception as e:
+            chunks.put_nowait(e)
+        else:
+            chunks.put_nowait(None)
+
+    reader = asyncio.create_task(read_upstream())
+    content_parts: List[str] = []
+    tool_calls: Dict[int, Dict[str, Any]] = {}
+    usage = None
+    model = request.model
+    try:
+        while True:
+            chunk = await chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            model = chunk.model or model
+            if chunk.usage:
+                usage = _usage_to_dict(chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                content_parts.append(delta.content)
+                yield "delta", delta.content
+            # Tool call arguments arrive in fragments keyed by index
+            for tool_call_delta in delta.tool_calls or []:
+                tool_call = tool_calls.setdefault(
+                    tool_call_delta.index,
+                    {
+                        "id": "",
+                        "type": "function",
+                        "function": {"name": "", "arguments": ""},
+                    },
+                )
+                if tool_call_delta.id:
+                    tool_call["id"] = tool_call_delta.id
+                if tool_call_delta.function:
+                    if tool_call_delta.function.name:
+                        tool_call["function"]["name"] += tool_call_delta.function.name
+                    if tool_call_delta.function.arguments:
+                        tool_call["function"]["arguments"] += (
+                            tool_call_delta.function.arguments
+                        )
+    finally:
+        # The client went away or the stream failed: stop reading upstream
+        reader.cancel()
+
+    content = "".join(content_parts) or None
+    yield "end", (content, [tool_calls[i] for i in sorted(tool_calls)], usage, model)
+
+
+async def openai_chat_stream(
+    request: ChatRequest,
+    system_prompt: Union[str, SystemPrompt],
+    use_tools: bool = True,
+    tool_type: str = "web_scraping",
+    key: Optional[str] = None,
+    cache: bool = False,
+    reservation: Optional[TokenReservation] = None,
+) -> AsyncIterator[str]:
+    """
+    Streaming variant of openai_chat that yields server-sent events.
+
+    Events are `delta` ({"content": ...}) for each token chunk, `tool` when a
+    tool round runs, `done` ({"model": ..., "usage": ...}) at the end, and
+    `error` ({"detail": ...}) if the upstream call fails. Given the request's
+    `key` (see completion_key), identical requests arriving meanwhile wait
+    for this answer, and with `cache` it is stored in the completion cache.
+    `reservation` is what the token budget check reserved for the request.
+    """
+    if reservation is None:
+        reservation = TokenReservation(0)
+    budget = AgentBudget()
+    try:
+        with get_single_flight().lead(key) as flight:
+            client = get_openai_client(request.api_key)
+            with stage("prompt_build"):
+                tools = get_tool_schemas(tool_type) if use_tools else None
+                messages = _build_messages(request, system_prompt)
+
+            while True:
+                offered_tools = tools if budget.allows_tool_round() else None
+                if not offered_tools and budget.rounds:
+                    logger.info("Getting final response from OpenAI")
+                if budget.rounds:
+                    get_token_budget().fit_tool_results(
+                        messages,
+                        request.model,
+                        tool_type if offered_tools else None,
+                        current_lab(),
+                    )
+                # Includes the time the client takes to read the streamed deltas
+                with stage(f"completion_{budget.rounds + 1}"):
+                    async for kind, value in _stream_completion(
+                        client, request, messages, offered_tools
+                    ):
+                        if kind == "delta":
+                            yield sse_event("delta", {"content": value})
+                        else:
+                            content, tool_calls, usage, model = value
+                budget.record(usage)
+
+                if not (offered_tools and tool_calls):
+                    break
+
+                budget.rounds += 1
+                yield sse_event(
+                    "tool", {"names": [t["function"]["name"] for t in tool_calls]}
+                )
+                await _run_tool_round(
+                    messages,
+                    content,
+                    tool_calls,
+                    min(TOOL_DEADLINE_SECONDS, budget.remaining()),
+                )
+
+            record_usage(budget.usage, model)
+            # Without tool rounds the usage is that of the estimated prompt
+            get_token_budget().record(
+                current_lab(),
+                request.api_key,
+                budget.usage,
+                0 if budget.rounds else reservation.prompt_tokens,
+                reservation,
+            )
+            record_prompt_cache(
+                current_lab(), system_prompt, budget.usage, request.model
+            )
+            chat_response = ChatResponse(
+                response=content or "", model=request.model, usage=budget.usage
+            )
+            if cache:
+                get_completion_cache().put(key, chat_response)
+            flight.set_result(chat_response)
+            yield sse_event("done", {"model": request.model, "usage": budget.usage})
+
+    except UpstreamOverloaded as e:
+        logger.warning(f"Upstream overloaded: {e}")
+        yield sse_event(
+            "error", {"detail": str(e), "retry_after": math.ceil(e.retry_after)}
+        )
+    except OpenAIError as e:
+        logger.error(f"OpenAI API error: {str(e)}")
+        yield sse_event("error", {"detail": f"OpenAI API error: {str(e)}"})
+    except ValueError as e:
+        logger.error(f"Configuration error: {str(e)}")
+        yield sse_event("error", {"detail": f"Configuration error: {str(e)}"})
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        yield sse_event("error", {"detail": "An unexpected error occurred"})
+    finally:
+        get_token_budget().release(reservation, budget.usage)
+
+
+def stream_chat_response(chat_response: ChatResponse) -> StreamingResponse:
+    """Replay an already computed ChatResponse as a server-sent event stream."""
+
+    async def events() -> AsyncIterator[str]:
+        yield sse_event("delta", {"content": chat_response.response})
+        yield sse_event(
+            "done", {"model": chat_response.model, "usage": chat_response.usage}
+        )
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
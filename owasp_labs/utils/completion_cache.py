@@ -0,0 +1,284 @@
+"""
+Reuse of chat completions between identical requests.
+
+Requests are identified by a SHA-256 of the lab, the caller's API key (as
+a hash), model, sampling settings, tool set and the full message list
+(system prompt included), so answers are only shared between requests made
+with the same key.
+
+- CompletionCache keeps finished answers of labs whose answers are
+  deterministic in a size-bounded LRU that expires after a TTL. Sampled
+  completions (temperature > 0) are not cached unless
+  COMPLETION_CACHE_ALLOW_SAMPLED is set, since replaying one answer would
+  hide the variation the model would otherwise show.
+- SingleFlight lets identical requests that arrive while one is in flight
+  share its upstream call instead of starting their own. Only requests the
+  cache would replay are coalesced, so concurrent sampled requests still get
+  independent answers.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+from models.chat_models import ChatRequest, ChatResponse
+
+# COMPLETION_CACHE_MAX_BYTES=0 disables the cache
+COMPLETION_CACHE_MAX_BYTES = int(
+    os.getenv("COMPLETION_CACHE_MAX_BYTES", str(16 * 1024 * 1024))
+)
+COMPLETION_CACHE_TTL_SECONDS = float(os.getenv("COMPLETION_CACHE_TTL_SECONDS", "300"))
+COMPLETION_CACHE_ALLOW_SAMPLED = os.getenv(
+    "COMPLETION_CACHE_ALLOW_SAMPLED", "false"
+).lower() in ("1", "true", "yes")
+# Identical requests in flight at the same time share one upstream call
+COMPLETION_COALESCE = os.getenv(
+    "COMPLETION_COALESCE", "true"
+).lower() in ("1", "true", "yes")
+
+
+def completion_key(
+    lab: str,
+    request: ChatRequest,
+    messages: List[Dict[str, Any]],
+    tools: Optional[str],
+) -> str:
+    """
+    Identity of a completion request.
+
+    `tools` names the tool set offered to the model (None without tools).
+    """
+    # Same hash as the client registry; raw keys are never kept around
+    key_hash = hashlib.sha256((request.api_key or "").encode("utf-8")).hexdigest()
+    payload = json.dumps(
+        [
+            lab,
+            key_hash,
+            request.model,
+            request.temperature,
+            request.max_tokens,
+            tools,
+            messages,
+        ],
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class _CacheEntry:
+    response: ChatResponse
+    size: int
+    expires_at: float
+
+
+class CompletionCache:
+    """
+    Size-bounded, TTL-expiring LRU cache of ChatResponses.
+
+    Args:
+        max_bytes (int): Approximate size of all cached responses
+        ttl (float): Seconds an entry stays valid
+        allow_sampled (bool): Also cache requests with temperature > 0
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = COMPLETION_CACHE_MAX_BYTES,
+        ttl: float = COMPLETION_CACHE_TTL_SECONDS,
+        allow_sampled: bool = COMPLETION_CACHE_ALLOW_SAMPLED,
+    ):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.allow_sampled = allow_sampled
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.expired = 0
+        self.evictions = 0
+        self.tokens_saved = 0
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def replayable(self, request: ChatRequest) -> bool:
+        """
+        Whether one answer may stand in for another to this request, in the
+        cache or shared with a concurrent identical request.
+        """
+        # The API samples at temperature 1 when none is given
+        temperature = 1.0 if request.temperature is None else request.temperature
+        return temperature <= 0 or self.allow_sampled
+
+    def allows(self, request: ChatRequest) -> bool:
+        """Whether the answer to this request may be cached and replayed."""
+        if self.max_bytes <= 0 or self.ttl <= 0:
+            return False
+        if not self.replayable(request):
+            with self._lock:
+                self.bypassed += 1
+            return False
+        return True
+
+    def get(self, key: str) -> Optional[ChatResponse]:
+        """Get a fresh response and mark it recently used."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                self.bytes -= entry.size
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if entry.response.usage:
+                self.tokens_saved += entry.response.usage.get("total_tokens", 0)
+            return entry.response
+
+    def put(self, key: str, response: ChatResponse) -> None:
+        """Store a completed response; empty answers are not cached."""
+        if not response.response:
+            return
+        size = len(response.response.encode("utf-8")) + len(key) + 256
+        if size > self.max_bytes:
+            return
+        entry = _CacheEntry(
+            response=response, size=size, expires_at=time.monotonic() + self.ttl
+        )
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.size
+            self._entries[key] = entry
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "tokens_saved": self.tokens_saved,
+            }
+
+
+class SingleFlight:
+    """
+    Share one in-flight completion between concurrent identical requests.
+
+    The first request for a key leads and runs the upstream call; requests
+    that arrive before it finishes wait for its answer. Keys include the API
+    key, so only requests billed to the same key are coalesced. If the leader
+    fails (for example because its API key is invalid) the waiting requests
+    make their own calls rather than inherit the error.
+    """
+
+    def __init__(self, enabled: bool = COMPLETION_COALESCE):
+        self.enabled = enabled
+        self.leaders = 0
+        self.coalesced = 0
+        self.fallbacks = 0
+        self.tokens_saved = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def wait(self, key: str) -> Optional[ChatResponse]:
+        """Answer of an identical request in flight, or None to make the call."""
+        future = self._inflight.get(key) if self.enabled else None
+        if future is None:
+            return None
+        try:
+            response = await asyncio.shield(future)
+        except Exception:
+            self.fallbacks += 1
+            return None
+        self.coalesced += 1
+        if response.usage:
+            self.tokens_saved += response.usage.get("total_tokens", 0)
+        return response
+
+    @contextmanager
+    def lead(self, key: Optional[str]) -> Iterator[asyncio.Future]:
+        """
+        Register this request as the one making the call for `key`.
+
+        Set the answer on the yielded future; if the block exits without one
+        the waiting requests fall back to their own calls.
+        """
+        future = asyncio.get_running_loop().create_future()
+        if not self.enabled or key is None or key in self._inflight:
+            yield future
+            return
+        self._inflight[key] = future
+        self.leaders += 1
+        try:
+            yield future
+        finally:
+            if not future.done():
+                future.set_exception(RuntimeError("Completion did not finish"))
+                # Mark retrieved so waiter-less failures are not logged as unhandled
+                future.exception()
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "fallbacks": self.fallbacks,
+            "tokens_saved": self.tokens_saved,
+        }
+
+
+_cache = CompletionCache()
+_flights = SingleFlight()
+
+
+def get_completion_cache() -> CompletionCache:
+    """Get the process-wide completion cache."""
+    return _cache
+
+
+def get_completion_cache_stats() -> Dict[str, Any]:
+    """Get hit ratio, size and tokens saved by the completion cache."""
+    return _cache.stats()
+
+
+def get_single_flight() -> SingleFlight:
+    """Get the process-wide registry of in-flight completions."""
+    return _flights
+
+
+def get_single_flight_stats() -> Dict[str, Any]:
+    """Get how many requests shared another request's upstream call."""
+    return _flights.stats()
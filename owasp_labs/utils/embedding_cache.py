@@ -0,0 +1,189 @@
+"""
+Content-addressed cache of text embeddings.
+
+Embeddings are keyed by (model, SHA-256 of the text), kept in an in-memory LRU
+and persisted to a SQLite file so identical texts are embedded only once,
+across users and across restarts.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "llm08_embedding_cache.sqlite3")
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "10000"))
+
+
+def _cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-level embedding cache: an LRU dict in front of a SQLite table.
+
+    Args:
+        path (str): SQLite file for the on-disk store, or None for memory only
+        memory_items (int): Maximum embeddings held in the in-memory LRU
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = EMBEDDING_CACHE_PATH,
+        memory_items: int = EMBEDDING_CACHE_MEMORY_ITEMS,
+    ):
+        self.path = path
+        self.memory_items = memory_items
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory_bytes = 0
+        # Rows in the SQLite file when it was opened plus those added since by
+        # this process, so stats() never scans the table
+        self.disk_entries = 0
+        self.disk_bytes = 0
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings "
+                    "(key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL)"
+                )
+                self._db.commit()
+                self.disk_entries, self.disk_bytes = self._db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"Embedding cache disabled on disk: {e}")
+                self._db = None
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        """Insert into the in-memory LRU, evicting the oldest entries."""
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self.memory_bytes -= old.nbytes
+        self._memory[key] = vector
+        self.memory_bytes += vector.nbytes
+        while len(self._memory) > self.memory_items:
+            _, evicted = self._memory.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Look up embeddings for texts; missing entries are None."""
+        keys = [_cache_key(model, text) for text in texts]
+        results: List[Optional[np.ndarray]] = [None] * len(keys)
+        with self._lock:
+            disk_lookups: Dict[str, List[int]] = {}
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    results[i] = vector
+                else:
+                    disk_lookups.setdefault(key, []).append(i)
+
+            if disk_lookups and self._db is not None:
+                found = {}
+                pending = list(disk_lookups)
+                # Stay well below SQLite's bound-parameter limit
+                for start in range(0, len(pending), 500):
+                    chunk = pending[start : start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = self._db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                        chunk,
+                    ).fetchall()
+                    found.update(rows)
+                for key, blob in found.items():
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    self._remember(key, vector)
+                    for i in disk_lookups.pop(key):
+                        results[i] = vector
+                        self.disk_hits += 1
+
+            self.misses += sum(len(indices) for indices in disk_lookups.values())
+        return results
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        return self.get_many(model, [text])[0]
+
+    def put_many(
+        self, model: str, texts: Sequence[str], vectors: Sequence[np.ndarray]
+    ) -> None:
+        """Store embeddings for texts in memory and on disk."""
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                vector = np.asarray(vector, dtype=np.float32)
+                key = _cache_key(model, text)
+                self._remember(key, vector)
+                rows.append((key, model, vector.tobytes()))
+            if rows and self._db is not None:
+                # An embedding never changes for a given model and text, so
+                # rows already stored are kept and only new ones are counted
+                added, added_bytes = 0, 0
+                try:
+                    for row in rows:
+                        cursor = self._db.execute(
+                            "INSERT OR IGNORE INTO embeddings (key, model, vector) "
+                            "VALUES (?, ?, ?)",
+                            row,
+                        )
+                        if cursor.rowcount > 0:
+                            added += 1
+                            added_bytes += len(row[2])
+                    self._db.commit()
+                    self.disk_entries += added
+                    self.disk_bytes += added_bytes
+                except sqlite3.Error as e:
+                    self._db.rollback()
+                    logger.error(f"Error writing embedding cache: {e}")
+
+    def put(self, model: str, text: str, vector: np.ndarray) -> None:
+        self.put_many(model, [text], [vector])
+
+    def stats(self) -> Dict[str, float]:
+        """Hit rate and bytes used by the memory and disk levels."""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self.memory_bytes,
+                "disk_entries": self.disk_entries,
+                "disk_bytes": self.disk_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Get the process-wide embedding cache, opening it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
+
+
+def get_embedding_cache_stats() -> Dict[str, float]:
+    return get_embedding_cache().stats()
@@ -0,0 +1,321 @@
+"""
+Compaction of client-supplied conversation history.
+
+Clients resend the whole conversation every turn, so without compaction the
+prompt grows with the length of the chat. Once the history is larger than
+HISTORY_MAX_TOKENS it is cut down to:
+
+- the first HISTORY_PIN_FIRST messages (how the conversation started)
+- a summary of the dropped messages, with HISTORY_SUMMARIZE enabled
+- as many of the most recent remaining messages as fit the budget
+- the last HISTORY_PIN_LAST messages, which are always kept
+
+An assistant message with tool calls and the tool results answering it are
+kept or dropped together. Summaries are cached per conversation and extended
+with only the newly dropped messages on later turns. All settings can be set
+per lab (see utils.lab_settings).
+
+Compaction takes two steps so that no summary is paid for on behalf of a
+request that is then rejected: compact_history() drops messages and reports
+the tokens a summary may add, which the token budget check counts in, and
+summarize_history() makes the summary call once the request is admitted.
+Summary calls are charged to the key's and lab's token budgets.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from .lab_settings import lab_setting
+from .metrics import record_usage, stage
+from .openai_client import get_openai_client, upstream_slot
+from .token_budget import (
+    get_token_budget,
+    message_text,
+    message_tokens,
+    truncate_to_tokens,
+)
+
+logger = logging.getLogger(__name__)
+
+HISTORY_MAX_TOKENS = 6000
+HISTORY_PIN_FIRST = 2
+HISTORY_PIN_LAST = 6
+HISTORY_SUMMARIZE = False
+HISTORY_SUMMARY_MAX_TOKENS = 300
+HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "gpt-3.5-turbo")
+HISTORY_SUMMARY_CACHE_SIZE = int(os.getenv("HISTORY_SUMMARY_CACHE_SIZE", "1024"))
+
+_SUMMARY_PROMPT = (
+    "Summarize the conversation below between a user and an assistant in at "
+    "most {words} words. Keep names, facts, decisions and any instructions or "
+    "claims the user made. Reply with the summary only."
+)
+_SUMMARY_LABEL = "Summary of earlier messages: "
+
+
+def _flag(value: str) -> bool:
+    return value.lower() in ("1", "true", "yes")
+
+
+def _group_start(messages: List[Dict[str, Any]], index: int) -> int:
+    """Move a cut point back so tool results stay with their tool call."""
+    while 0 < index < len(messages) and messages[index].get("role") == "tool":
+        index -= 1
+    return index
+
+
+def _group_end(messages: List[Dict[str, Any]], index: int) -> int:
+    """Move a cut point forward past tool results of the preceding message."""
+    while index < len(messages) and messages[index].get("role") == "tool":
+        index += 1
+    return index
+
+
+def _transcript(messages: List[Dict[str, Any]]) -> str:
+    return "\n".join(
+        f"{message.get('role', 'user')}: {message_text(message)}"
+        for message in messages
+    )
+
+
+def _digest(messages: List[Dict[str, Any]]) -> str:
+    encoded = json.dumps(messages, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class HistoryCompaction:
+    """
+    A conversation cut down to its budget, before the summary is added.
+
+    `summary_tokens` is the most the summary can add to the prompt (0 when
+    there is nothing to summarize); it goes in at `summary_at`.
+    """
+
+    messages: List[Dict[str, Any]]
+    dropped: List[Dict[str, Any]] = field(default_factory=list)
+    summary_at: int = 0
+    summary_tokens: int = 0
+
+
+class HistoryCompactor:
+    """
+    Cut conversations down to a token budget, optionally summarizing what
+    was dropped.
+
+    Summaries are kept per conversation (lab, API key and first messages) in
+    an LRU of at most `max_summaries` entries.
+    """
+
+    def __init__(self, max_summaries: int = HISTORY_SUMMARY_CACHE_SIZE):
+        self.max_summaries = max_summaries
+        self.compacted = 0
+        self.messages_dropped = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.summaries_created = 0
+        self.summaries_extended = 0
+        self.summary_hits = 0
+        self.summary_failures = 0
+        # conversation -> (messages summarized, their digest, summary)
+        self._summaries: "OrderedDict[str, Tuple[int, str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _split(
+        self, messages: List[Dict[str, Any]], model: str, lab: str
+    ) -> Optional[Tuple[int, int, int]]:
+        """
+        Where to cut the history: returns (head end, kept start, tail start),
+        with messages[head end:kept start] dropped, or None if it fits.
+        """
+        budget = lab_setting("HISTORY_MAX_TOKENS", lab, HISTORY_MAX_TOKENS)
+        sizes = [message_tokens(message, model) for message in messages]
+        if not budget or sum(sizes) <= budget:
+            return None
+        pin_first = lab_setting("HISTORY_PIN_FIRST", lab, HISTORY_PIN_FIRST)
+        pin_last = lab_setting("HISTORY_PIN_LAST", lab, HISTORY_PIN_LAST)
+        head_end = _group_end(messages, min(pin_first, len(messages)))
+        tail_start = _group_start(messages, max(len(messages) - pin_last, head_end))
+        tail_start = max(tail_start, head_end)
+
+        # Most recent unpinned messages that still fit
+        remaining = budget - sum(sizes[:head_end]) - sum(sizes[tail_start:])
+        if lab_setting("HISTORY_SUMMARIZE", lab, HISTORY_SUMMARIZE, _flag):
+            remaining -= lab_setting(
+                "HISTORY_SUMMARY_MAX_TOKENS", lab, HISTORY_SUMMARY_MAX_TOKENS
+            )
+        kept_start = tail_start
+        while kept_start > head_end and sizes[kept_start - 1] <= remaining:
+            remaining -= sizes[kept_start - 1]
+            kept_start -= 1
+        kept_start = _group_end(messages, kept_start)
+        if kept_start == head_end:
+            return None
+        return head_end, kept_start, tail_start
+
+    def compact(
+        self, messages: List[Dict[str, Any]], model: str, lab: str
+    ) -> HistoryCompaction:
+        """The conversation cut down to the lab's history budget, unsummarized."""
+        split = self._split(messages, model, lab)
+        if split is None:
+            return HistoryCompaction(messages)
+        head_end, kept_start, _ = split
+        dropped = messages[head_end:kept_start]
+        compacted = messages[:head_end] + messages[kept_start:]
+
+        summary_tokens = 0
+        if lab_setting("HISTORY_SUMMARIZE", lab, HISTORY_SUMMARIZE, _flag):
+            label = {"role": "system", "content": _SUMMARY_LABEL}
+            summary_tokens = message_tokens(label, model) + lab_setting(
+                "HISTORY_SUMMARY_MAX_TOKENS", lab, HISTORY_SUMMARY_MAX_TOKENS
+            )
+
+        before = sum(message_tokens(message, model) for message in messages)
+        after = sum(message_tokens(message, model) for message in compacted)
+        with self._lock:
+            self.compacted += 1
+            self.messages_dropped += len(dropped)
+            self.tokens_before += before
+            self.tokens_after += after
+        return HistoryCompaction(compacted, dropped, head_end, summary_tokens)
+
+    async def summarize(
+        self,
+        compaction: HistoryCompaction,
+        model: str,
+        lab: str,
+        api_key: Optional[str],
+    ) -> List[Dict[str, Any]]:
+        """The compacted conversation with the summary of its dropped messages."""
+        if not compaction.summary_tokens:
+            return compaction.messages
+        head = compaction.messages[: compaction.summary_at]
+        conversation = _digest([{"lab": lab, "api_key": api_key or ""}] + head)
+        summary = await self._summary(conversation, compaction.dropped, lab, api_key)
+        if not summary:
+            return compaction.messages
+        message = {"role": "system", "content": f"{_SUMMARY_LABEL}{summary}"}
+        with self._lock:
+            self.tokens_after += message_tokens(message, model)
+        return head + [message] + compaction.messages[compaction.summary_at :]
+
+    async def _summary(
+        self,
+        conversation: str,
+        dropped: List[Dict[str, Any]],
+        lab: str,
+        api_key: Optional[str],
+    ) -> Optional[str]:
+        """Summary of `dropped`, extending the conversation's cached summary."""
+        with self._lock:
+            cached = self._summaries.get(conversation)
+            if cached is not None:
+                self._summaries.move_to_end(conversation)
+        previous = None
+        new = dropped
+        if cached is not None:
+            count, digest, summary = cached
+            if count <= len(dropped) and _digest(dropped[:count]) == digest:
+                if count == len(dropped):
+                    with self._lock:
+                        self.summary_hits += 1
+                    return summary
+                previous, new = summary, dropped[count:]
+
+        max_tokens = lab_setting(
+            "HISTORY_SUMMARY_MAX_TOKENS", lab, HISTORY_SUMMARY_MAX_TOKENS
+        )
+        transcript = _transcript(new)
+        if previous:
+            transcript = f"Summary so far: {previous}\n\n{transcript}"
+        # Summarizing must not itself need an oversized prompt
+        transcript = truncate_to_tokens(
+            transcript,
+            lab_setting("HISTORY_MAX_TOKENS", lab, HISTORY_MAX_TOKENS),
+            HISTORY_SUMMARY_MODEL,
+        )
+        try:
+            client = get_openai_client(api_key)
+            with stage("history_summary"):
+                async with upstream_slot():
+                    response = await client.chat.completions.create(
+                        model=HISTORY_SUMMARY_MODEL,
+                        messages=[
+                            {
+                                "role": "system",
+                                "content": _SUMMARY_PROMPT.format(
+                                    words=max_tokens * 3 // 4
+                                ),
+                            },
+                            {"role": "user", "content": transcript},
+                        ],
+                        max_tokens=max_tokens,
+                        temperature=0,
+                    )
+        except Exception as e:
+            # Without a summary the dropped messages are simply left out
+            logger.warning(f"History summary failed: {e}")
+            with self._lock:
+                self.summary_failures += 1
+            return previous
+        record_usage(response.usage, HISTORY_SUMMARY_MODEL)
+        if response.usage:
+            get_token_budget().record(
+                lab, api_key, {"total_tokens": response.usage.total_tokens}
+            )
+        summary = response.choices[0].message.content or ""
+
+        with self._lock:
+            if previous:
+                self.summaries_extended += 1
+            else:
+                self.summaries_created += 1
+            self._summaries[conversation] = (len(dropped), _digest(dropped), summary)
+            self._summaries.move_to_end(conversation)
+            while len(self._summaries) > self.max_summaries:
+                self._summaries.popitem(last=False)
+        return summary
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "compacted": self.compacted,
+                "messages_dropped": self.messages_dropped,
+                "tokens_before": self.tokens_before,
+                "tokens_after": self.tokens_after,
+                "tokens_saved": self.tokens_before - self.tokens_after,
+                "summaries_created": self.summaries_created,
+                "summaries_extended": self.summaries_extended,
+                "summary_hits": self.summary_hits,
+                "summary_failures": self.summary_failures,
+                "cached_summaries": len(self._summaries),
+            }
+
+
+_compactor = HistoryCompactor()
+
+
+def compact_history(
+    messages: List[Dict[str, Any]], model: str, lab: str
+) -> HistoryCompaction:
+    """Cut a conversation down to its budget with the process-wide compactor."""
+    return _compactor.compact(messages, model, lab)
+
+
+async def summarize_history(
+    compaction: HistoryCompaction, model: str, lab: str, api_key: Optional[str]
+) -> List[Dict[str, Any]]:
+    """Add the summary of the dropped messages to a compacted conversation."""
+    return await _compactor.summarize(compaction, model, lab, api_key)
+
+
+def get_history_stats() -> Dict[str, Any]:
+    """Get compaction counts, tokens saved and summary cache statistics."""
+    return _compactor.stats()
@@ -0,0 +1,28 @@
+"""
+Settings that can be overridden per lab through the environment.
+
+`lab_setting("MAX_PROMPT_TOKENS", "llm10", 12000)` reads
+MAX_PROMPT_TOKENS_LLM10, then MAX_PROMPT_TOKENS, then falls back to the
+default. `has_lab_override("MAX_PROMPT_TOKENS", "llm10")` tells whether the
+lab has a value of its own.
+"""
+
+import os
+from functools import lru_cache
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+
+@lru_cache(maxsize=None)
+def lab_setting(name: str, lab: str, default: T, cast: Callable[[str], T] = int) -> T:
+    for variable in (f"{name}_{lab.upper()}", name):
+        value = os.getenv(variable)
+        if value not in (None, ""):
+            return cast(value)
+    return default
+
+
+@lru_cache(maxsize=None)
+def has_lab_override(name: str, lab: str) -> bool:
+    return os.getenv(f"{name}_{lab.upper()}") not in (None, "")
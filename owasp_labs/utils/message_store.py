@@ -0,0 +1,245 @@
+"""
+Bounded store of recent user messages for the LLM04 poisoning lab.
+
+Backends:
+    memory  ring buffer in this process
+    file    ring buffer in this process, written behind to a text file
+    sqlite  shared SQLite table, so every server worker sees the same history
+
+Readers take a snapshot of the buffer instead of holding a lock while they
+build a prompt and call the model, so concurrent requests never wait on
+each other's upstream round-trips.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_STORE_BACKEND = os.getenv("LLM04_STORE", "memory")
+MESSAGE_HISTORY_SIZE = int(os.getenv("LLM04_HISTORY_SIZE", "10"))
+MESSAGE_STORE_PATH = os.getenv("LLM04_STORE_PATH")
+# How often the file backend writes pending messages to disk
+MESSAGE_FLUSH_SECONDS = float(os.getenv("LLM04_FLUSH_SECONDS", "1.0"))
+
+_DEFAULT_PATHS = {
+    "file": "request_messages.txt",
+    "sqlite": "llm04_messages.sqlite3",
+}
+
+
+class RingBufferStore:
+    """
+    Keep the last `capacity` messages in memory.
+
+    Args:
+        capacity (int): Number of messages kept; older ones are dropped
+    """
+
+    # Whether calls may block on I/O and belong off the event loop
+    blocking = False
+
+    def __init__(self, capacity: int = MESSAGE_HISTORY_SIZE):
+        self.capacity = capacity
+        self.appends = 0
+        self._messages: deque = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def append(self, message: str) -> None:
+        with self._lock:
+            self._messages.append(message)
+            self.appends += 1
+
+    def snapshot(self) -> List[str]:
+        """Copy of the stored messages, oldest first."""
+        with self._lock:
+            return list(self._messages)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "size": len(self._messages),
+                "capacity": self.capacity,
+                "appends": self.appends,
+            }
+
+    def close(self) -> None:
+        pass
+
+
+class FileBackedStore(RingBufferStore):
+    """
+    Ring buffer whose contents are written behind to a text file.
+
+    Appends only touch memory. A background thread rewrites the file with the
+    current buffer at most every `flush_seconds`, and the buffer is reloaded
+    from the file on start-up.
+
+    Args:
+        path (str): Text file holding one message per line
+        capacity (int): Number of messages kept
+        flush_seconds (float): Delay between writes of pending messages
+    """
+
+    def __init__(
+        self,
+        path: str,
+        capacity: int = MESSAGE_HISTORY_SIZE,
+        flush_seconds: float = MESSAGE_FLUSH_SECONDS,
+    ):
+        super().__init__(capacity)
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.flushes = 0
+        self._dirty = False
+        self._stop = threading.Event()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._messages.extend(line.strip() for line in f if line.strip())
+        self._thread = threading.Thread(
+            target=self._flush_loop, name="llm04-flush", daemon=True
+        )
+        self._thread.start()
+
+    def append(self, message: str) -> None:
+        with self._lock:
+            self._messages.append(message)
+            self.appends += 1
+            self._dirty = True
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_seconds):
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the buffer to disk if it changed since the last write."""
+        with self._lock:
+            if not self._dirty:
+                return
+            messages = list(self._messages)
+            self._dirty = False
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(message + "\n" for message in messages)
+            os.replace(tmp_path, self.path)
+            self.flushes += 1
+        except OSError as e:
+            logger.error(f"Error writing {self.path}: {e}")
+            with self._lock:
+                self._dirty = True
+
+    def stats(self) -> Dict[str, object]:
+        stats = super().stats()
+        stats.update({"backend": "file", "path": self.path, "flushes": self.flushes})
+        return stats
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+
+class SQLiteMessageStore:
+    """
+    Ring buffer kept in a SQLite table shared by every worker process.
+
+    Args:
+        path (str): SQLite database file
+        capacity (int): Number of messages kept
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, capacity: int = MESSAGE_HISTORY_SIZE):
+        self.path = path
+        self.capacity = capacity
+        self.appends = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages "
+            "(id INTEGER PRIMARY KEY AUTOINCREMENT, message TEXT NOT NULL)"
+        )
+        self._db.commit()
+
+    def append(self, message: str) -> None:
+        with self._lock:
+            with self._db:
+                cursor = self._db.execute(
+                    "INSERT INTO messages (message) VALUES (?)", (message,)
+                )
+                self._db.execute(
+                    "DELETE FROM messages WHERE id <= ?",
+                    (cursor.lastrowid - self.capacity,),
+                )
+            self.appends += 1
+
+    def snapshot(self) -> List[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT message FROM messages ORDER BY id DESC LIMIT ?",
+                (self.capacity,),
+            ).fetchall()
+        return [row[0] for row in reversed(rows)]
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            (size,) = self._db.execute("SELECT COUNT(*) FROM messages").fetchone()
+            return {
+                "backend": "sqlite",
+                "path": self.path,
+                "size": size,
+                "capacity": self.capacity,
+                "appends": self.appends,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def make_message_store(
+    backend: str = MESSAGE_STORE_BACKEND, path: Optional[str] = MESSAGE_STORE_PATH
+):
+    """Create a message store for the given backend name."""
+    if backend == "memory":
+        return RingBufferStore()
+    if backend not in _DEFAULT_PATHS:
+        raise ValueError(f"Unknown message store backend: {backend}")
+    path = path or _DEFAULT_PATHS[backend]
+    if backend == "file":
+        return FileBackedStore(path)
+    return SQLiteMessageStore(path)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_message_store():
+    """Get the process-wide LLM04 message store, creating it on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = make_message_store()
+        return _store
+
+
+def get_message_store_stats() -> Dict[str, object]:
+    return get_message_store().stats()
+
+
+def close_message_store() -> None:
+    """Flush and close the message store (used on server shutdown)."""
+    global _store
+    with _store_lock:
+        store, _store = _store, None
+    if store is not None:
+        store.close()
@@ -0,0 +1,368 @@
+"""
+Prometheus-style metrics for the lab server.
+
+A small in-process implementation of counters, gauges and histograms that
+renders the Prometheus text exposition format for GET /metrics. Recording a
+value costs a dictionary lookup and an uncontended lock, so timers can sit on
+the request hot path.
+
+Requests are attributed to a lab by `instrument_lab` on each endpoint; the lab
+is kept in a context variable so shared code such as `openai_chat` can label
+its stages without being passed the lab explicitly.
+
+With several server workers every process keeps its own metrics, and each
+scrape reads the worker that happened to answer it.
+
+Model names come from upstream responses and are not a closed set (any
+OpenAI-compatible upstream may accept arbitrary names), so only the first
+METRICS_MAX_MODELS distinct models get a label of their own; the rest are
+counted as "other".
+"""
+
+import bisect
+import functools
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+METRICS_MAX_MODELS = int(os.getenv("METRICS_MAX_MODELS", "32"))
+
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, labels: Tuple[str, ...] = ()) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        lines = self._header()
+        for labels, value in items:
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, labels)} {value:g}"
+            )
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: Tuple[str, ...] = (), amount: float = 1.0) -> None:
+        self.inc(labels, -amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labels: Tuple[str, ...] = ()) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, labels: Tuple[str, ...] = ()) -> int:
+        entry = self._values.get(labels)
+        return entry[2] if entry else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [
+                (labels, list(counts), total, count)
+                for labels, (counts, total, count) in self._values.items()
+            ]
+        bounds = [f'le="{bound:g}"' for bound in self.buckets] + ['le="+Inf"']
+        lines = self._header()
+        for labels, counts, total, count in items:
+            prefix = "{" + "".join(
+                f'{name}="{_escape(value)}",'
+                for name, value in zip(self.labelnames, labels)
+            )
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{prefix}{bound}}} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {total:g}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+_REGISTRY: List[_Metric] = []
+
+REQUESTS = Counter(
+    "lab_requests_total", "Lab chat requests by response status", ("lab", "status")
+)
+REQUEST_SECONDS = Histogram(
+    "lab_request_duration_seconds",
+    "Lab chat request time until the response is complete",
+    ("lab",),
+)
+IN_FLIGHT = Gauge(
+    "lab_requests_in_flight", "Lab chat requests currently being handled", ("lab",)
+)
+STAGE_SECONDS = Histogram(
+    "lab_stage_duration_seconds", "Time spent in each request stage", ("lab", "stage")
+)
+TOOL_SECONDS = Histogram(
+    "lab_tool_duration_seconds",
+    "Tool executions by tool and outcome",
+    ("lab", "tool", "outcome"),
+)
+TOKENS = Counter("lab_tokens_total", "Upstream token usage", ("lab", "model", "type"))
+REJECTED = Counter(
+    "lab_requests_rejected_total",
+    "Lab chat requests turned away by admission control or overload",
+    ("lab", "reason"),
+)
+
+
+class _RequestContext:
+    __slots__ = ("lab", "start", "handler_end")
+
+    def __init__(self, start: float, lab: Optional[str] = None):
+        self.lab = lab
+        self.start = start
+        self.handler_end: Optional[float] = None
+
+
+_current: ContextVar[Optional[_RequestContext]] = ContextVar(
+    "lab_request", default=None
+)
+
+
+def current_lab() -> str:
+    """Lab handling the current request, or "unknown" outside a lab endpoint."""
+    context = _current.get()
+    return context.lab if context is not None and context.lab else "unknown"
+
+
+def observe_stage(stage: str, seconds: float, lab: Optional[str] = None) -> None:
+    STAGE_SECONDS.observe(seconds, (lab or current_lab(), stage))
+
+
+class stage:
+    """
+    Time a block as one request stage.
+
+    Usage:
+        with stage("prompt_build"):
+            ...
+    """
+
+    __slots__ = ("name", "lab", "_start")
+
+    def __init__(self, name: str, lab: Optional[str] = None):
+        self.name = name
+        self.lab = lab
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe_stage(self.name, time.perf_counter() - self._start, self.lab)
+
+
+def observe_tool(
+    name: str, seconds: float, outcome: str, lab: Optional[str] = None
+) -> None:
+    TOOL_SECONDS.observe(seconds, (lab or current_lab(), name, outcome))
+
+
+def count_rejection(reason: str, lab: Optional[str] = None) -> None:
+    REJECTED.inc((lab or current_lab(), reason))
+
+
+_models: Set[str] = set()
+_models_lock = threading.Lock()
+
+
+def _model_label(model: str) -> str:
+    if model in _models:
+        return model
+    with _models_lock:
+        if len(_models) < METRICS_MAX_MODELS:
+            _models.add(model)
+            return model
+    return "other"
+
+
+def record_usage(usage, model: str, lab: Optional[str] = None) -> None:
+    """
+    Count prompt, completion and cached prompt tokens of a completion or
+    embedding call.
+
+    `usage` is a usage dictionary or the `usage` object of an OpenAI response.
+    """
+    if not usage:
+        return
+    lab = lab or current_lab()
+    model = _model_label(model)
+    for kind in ("prompt", "completion"):
+        if isinstance(usage, dict):
+            tokens = usage.get(f"{kind}_tokens")
+        else:
+            tokens = getattr(usage, f"{kind}_tokens", None)
+        if tokens:
+            TOKENS.inc((lab, model, kind), tokens)
+    # Prompt tokens the provider served from its prompt cache
+    if isinstance(usage, dict):
+        cached = usage.get("cached_tokens")
+    else:
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None)
+    if cached:
+        TOKENS.inc((lab, model, "cached"), cached)
+
+
+def instrument_lab(lab: str):
+    """
+    Attribute an endpoint's requests to a lab.
+
+    Records the time from the start of the request until the endpoint runs
+    (routing, body parsing and validation) as the `request_parse` stage.
+    """
+
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            now = time.perf_counter()
+            context = _current.get()
+            token = None
+            if context is None:
+                # Not behind MetricsMiddleware; still label the stages
+                context = _RequestContext(now)
+                token = _current.set(context)
+            else:
+                observe_stage("request_parse", now - context.start, lab)
+            context.lab = lab
+            IN_FLIGHT.inc((lab,))
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                IN_FLIGHT.dec((lab,))
+                context.handler_end = time.perf_counter()
+                if token is not None:
+                    _current.reset(token)
+
+        return wrapper
+
+    return decorator
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing whole requests and response serialization.
+
+    `response_serialization` is the time from the endpoint returning until
+    the response headers are sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        context = _RequestContext(time.perf_counter())
+        token = _current.set(context)
+        status = 500
+
+        async def send_with_metrics(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if context.lab and context.handler_end is not None:
+                    observe_stage(
+                        "response_serialization",
+                        time.perf_counter() - context.handler_end,
+                        context.lab,
+                    )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            _current.reset(token)
+            if context.lab:
+                REQUEST_SECONDS.observe(
+                    time.perf_counter() - context.start, (context.lab,)
+                )
+                REQUESTS.inc((context.lab, str(status)))
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
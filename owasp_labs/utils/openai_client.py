@@ -1,14 +1,284 @@
+import asyncio
+import hashlib
 import os
-from typing import Optional
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
 
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 
+from .lab_settings import lab_setting
+from .metrics import count_rejection, current_lab, observe_stage
 
-def get_openai_client(api_key: Optional[str] = None):
-    """Get OpenAI client with API key from parameter or environment."""
+# Registry sizing, overridable through the environment
+CLIENT_CACHE_SIZE = int(os.getenv("OPENAI_CLIENT_CACHE_SIZE", "256"))
+CLIENT_TTL_SECONDS = float(os.getenv("OPENAI_CLIENT_TTL_SECONDS", "1800"))
+MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "1000"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "100"))
+KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY_SECONDS", "30"))
+# Upstream calls (completions and embeddings) in flight at once per process;
+# further calls wait for a slot. 0 removes the limit.
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "64"))
+# Calls that may wait for a slot; once full, further calls fail fast instead
+# of queueing (0 = unbounded). Waits longer than the timeout (per lab, see
+# utils.lab_settings) fail too, so queueing delay stays bounded.
+UPSTREAM_QUEUE_SIZE = int(os.getenv("UPSTREAM_QUEUE_SIZE", "256"))
+UPSTREAM_QUEUE_TIMEOUT_SECONDS = 30.0
+
+
+class OpenAIClientRegistry:
+    """
+    Bounded cache of AsyncOpenAI clients keyed by a hash of the API key.
+
+    All clients share one HTTP connection pool so that repeat users reuse warm
+    keep-alive connections. Entries are evicted least-recently-used once the
+    registry is full, or when they have been idle for longer than the TTL.
+    """
+
+    def __init__(
+        self,
+        max_size: int = CLIENT_CACHE_SIZE,
+        ttl_seconds: float = CLIENT_TTL_SECONDS,
+        limits: Optional[httpx.Limits] = None,
+    ):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.limits = limits or httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+        )
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._clients: "OrderedDict[str, tuple[AsyncOpenAI, float]]" = OrderedDict()
+        self._http_client: Optional[DefaultAsyncHttpxClient] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(api_key: str) -> str:
+        # Never keep raw API keys around as dictionary keys
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+    def _get_http_client(self) -> DefaultAsyncHttpxClient:
+        """Get the shared async HTTP client, recreating it if it was closed."""
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = DefaultAsyncHttpxClient(limits=self.limits)
+            # Clients bound to a closed pool are unusable
+            self._clients.clear()
+        return self._http_client
+
+    def _evict_expired(self, now: float) -> None:
+        while self._clients:
+            key, (_, last_used) = next(iter(self._clients.items()))
+            if now - last_used <= self.ttl_seconds:
+                break
+            del self._clients[key]
+            self.evictions += 1
+
+    def get(self, api_key: str) -> AsyncOpenAI:
+        """Get a cached client for the API key, creating one on a miss."""
+        key = self._key(api_key)
+        now = time.monotonic()
+        with self._lock:
+            http_client = self._get_http_client()
+            self._evict_expired(now)
+
+            entry = self._clients.get(key)
+            if entry is not None:
+                self.hits += 1
+                client = entry[0]
+                self._clients[key] = (client, now)
+                self._clients.move_to_end(key)
+                return client
+
+            self.misses += 1
+            client = AsyncOpenAI(api_key=api_key, http_client=http_client)
+            self._clients[key] = (client, now)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+                self.evictions += 1
+            return client
+
+    def stats(self) -> dict:
+        """Get hit/miss/eviction counters for sizing the registry."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._clients),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    async def aclose(self) -> None:
+        """Drop all cached clients and close the shared connection pool."""
+        with self._lock:
+            self._clients.clear()
+            http_client, self._http_client = self._http_client, None
+        if http_client is not None:
+            await http_client.aclose()
+
+
+class UpstreamOverloaded(Exception):
+    """No upstream slot could be had: the wait queue is full or timed out."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UpstreamLimiter:
+    """
+    Cap on concurrent upstream API calls, so that a burst of requests queues
+    here instead of running into the provider's rate limit.
+
+    The queue is bounded in length and in waiting time; calls beyond either
+    raise UpstreamOverloaded with an estimate of when to retry.
+    """
+
+    def __init__(
+        self, limit: int = UPSTREAM_CONCURRENCY, max_queue: int = UPSTREAM_QUEUE_SIZE
+    ):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.calls = 0
+        self.waited = 0
+        self.shed = 0
+        self.timed_out = 0
+        # Moving average of how long a call holds its slot
+        self.mean_hold_seconds = 1.0
+        self._semaphore = asyncio.Semaphore(limit) if limit > 0 else None
+
+    def saturated(self) -> bool:
+        """Whether a new call would be turned away because the queue is full."""
+        return (
+            self._semaphore is not None
+            and self.max_queue > 0
+            and self.waiting >= self.max_queue
+        )
+
+    def retry_after(self) -> float:
+        """Seconds until the current queue has likely drained."""
+        if not self.limit:
+            return 1.0
+        return max(1.0, (self.waiting + 1) / self.limit * self.mean_hold_seconds)
+
+    async def _acquire(self) -> None:
+        lab = current_lab()
+        if self.saturated():
+            self.shed += 1
+            count_rejection("upstream_queue_full", lab)
+            raise UpstreamOverloaded(
+                "Server is overloaded, too many requests are waiting",
+                self.retry_after(),
+            )
+        timeout = lab_setting(
+            "UPSTREAM_QUEUE_TIMEOUT_SECONDS", lab, UPSTREAM_QUEUE_TIMEOUT_SECONDS, float
+        )
+        self.waited += 1
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            # Not wait_for, which before Python 3.12 can time out after the
+            # acquire succeeded and so lose the permit
+            async with asyncio.timeout(timeout or None):
+                await self._semaphore.acquire()
+        except TimeoutError:
+            self.timed_out += 1
+            count_rejection("upstream_queue_timeout", lab)
+            raise UpstreamOverloaded(
+                f"Server is overloaded, no upstream slot within {timeout:g} seconds",
+                self.retry_after(),
+            )
+        finally:
+            self.waiting -= 1
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold one upstream slot, timing the wait as the `upstream_wait` stage."""
+        start = time.perf_counter()
+        if self._semaphore is not None:
+            if not self._semaphore.locked():
+                await self._semaphore.acquire()
+            else:
+                await self._acquire()
+        acquired = time.perf_counter()
+        observe_stage("upstream_wait", acquired - start)
+        self.in_flight += 1
+        self.calls += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            held = time.perf_counter() - acquired
+            self.mean_hold_seconds += 0.05 * (held - self.mean_hold_seconds)
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "calls": self.calls,
+            "waited": self.waited,
+            "max_queue": self.max_queue,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+            "mean_hold_seconds": round(self.mean_hold_seconds, 4),
+        }
+
+
+_registry = OpenAIClientRegistry()
+_limiter = UpstreamLimiter()
+
+
+def get_openai_client(api_key: Optional[str] = None) -> AsyncOpenAI:
+    """Get async OpenAI client with API key from parameter or environment."""
     # Use provided API key if available, otherwise fall back to environment variable
-    
+
     if not api_key:
         raise ValueError("OpenAI API key is required. Please provide it in the request")
-    return OpenAI(api_key=api_key)
-    
+    return _registry.get(api_key)
+
+
+def get_client_registry_stats() -> dict:
+    """Get statistics for the shared OpenAI client registry."""
+    return _registry.stats()
+
+
+def upstream_slot():
+    """
+    Hold a slot of the process-wide upstream concurrency limit.
+
+    Usage:
+        async with upstream_slot():
+            response = await client.chat.completions.create(...)
+    """
+    return _limiter.slot()
+
+
+def get_upstream_limiter() -> UpstreamLimiter:
+    """Get the process-wide upstream concurrency limit."""
+    return _limiter
+
+
+def get_upstream_stats() -> dict:
+    """Get in-flight and queued counts for the upstream concurrency limit."""
+    return _limiter.stats()
+
+
+async def close_openai_clients() -> None:
+    """Close the shared OpenAI connection pool (used on server shutdown)."""
+    await _registry.aclose()
@@ -0,0 +1,111 @@
+"""
+Lab system prompts laid out for upstream prompt caching.
+
+Providers cache prompts by prefix: a request whose first tokens are identical
+to a recent request's reuses that work and reports the reused part as
+`usage.prompt_tokens_details.cached_tokens`. A system prompt with the user's
+text formatted into it differs on every request, and so does everything
+after it, including the whole conversation history.
+
+A PromptTemplate therefore splits a lab's system prompt into a static
+`prefix`, sent byte-identical as the first message of every request, and a
+dynamic `tail`. openai_chat sends the rendered tail as a separate system
+message just before the newest user message, so the prefix and the history
+of earlier turns stay identical too. The user text still reaches the model
+as system instructions, as the labs intend.
+
+Providers only cache prompts of at least 1024 tokens, so short single-turn
+prompts are never cached; /stats reports each lab's prefix size next to the
+cached tokens seen.
+"""
+
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from .token_budget import count_tokens
+
+
+@dataclass(frozen=True)
+class SystemPrompt:
+    """A rendered system prompt: the static prefix and the dynamic tail."""
+
+    prefix: str
+    tail: str = ""
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """
+    A lab system prompt with a static prefix and a str.format tail.
+
+    Usage:
+        TEMPLATE = PromptTemplate(prefix="You are ...", tail="User query: {query}")
+        await openai_chat(request, TEMPLATE.render(query=request.message))
+    """
+
+    prefix: str
+    tail: str = ""
+
+    def render(self, **fields: Any) -> SystemPrompt:
+        return SystemPrompt(self.prefix, self.tail.format(**fields))
+
+
+class PromptCacheStats:
+    """Prompt and cached tokens per lab, as reported by the upstream."""
+
+    def __init__(self):
+        self._labs: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        lab: str,
+        prompt: SystemPrompt,
+        usage: Optional[Dict[str, int]],
+        model: str,
+    ) -> None:
+        if not usage:
+            return
+        with self._lock:
+            entry = self._labs.get(lab)
+            if entry is None:
+                entry = self._labs[lab] = {
+                    "requests": 0,
+                    "prompt_tokens": 0,
+                    "cached_tokens": 0,
+                    "prefix_tokens": 0,
+                }
+            entry["requests"] += 1
+            entry["prompt_tokens"] += usage.get("prompt_tokens", 0)
+            entry["cached_tokens"] += usage.get("cached_tokens", 0)
+            entry["prefix_tokens"] = count_tokens(prompt.prefix, model)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                lab: {
+                    **entry,
+                    "cached_ratio": (
+                        entry["cached_tokens"] / entry["prompt_tokens"]
+                        if entry["prompt_tokens"]
+                        else 0.0
+                    ),
+                }
+                for lab, entry in self._labs.items()
+            }
+
+
+_stats = PromptCacheStats()
+
+
+def record_prompt_cache(
+    lab: str, prompt: SystemPrompt, usage: Optional[Dict[str, int]], model: str
+) -> None:
+    """Add one request's prompt and cached tokens to its lab's totals."""
+    _stats.record(lab, prompt, usage, model)
+
+
+def get_prompt_cache_stats() -> Dict[str, Any]:
+    """Get prompt, cached and prefix token counts per lab."""
+    return _stats.stats()
@@ -0,0 +1,402 @@
+"""
+Token accounting for upstream requests.
+
+Prompts are measured in tokens before they are sent: the system prompt,
+conversation history, tool results and tool schemas are counted with the
+model's tokenizer (tiktoken, when installed) or, without it, estimated at
+four characters per token. Counts are cached by text, so the repeated system
+prompts and schemas of a lab cost a dictionary lookup.
+
+Limits, each overridable per lab (see utils.lab_settings):
+
+- MAX_PROMPT_TOKENS: largest prompt sent upstream; larger requests are
+  rejected with 413 and oversized tool results are truncated to fit
+- MAX_COMPLETION_TOKENS: upper bound for the request's max_tokens
+- TOKEN_BUDGET_PER_KEY / TOKEN_BUDGET_PER_LAB: tokens an API key, or all
+  users of a lab, may spend per TOKEN_BUDGET_WINDOW_SECONDS (0 = unlimited);
+  exhausted budgets are rejected with 429 until the window resets; a key
+  with a lab-specific budget (e.g. TOKEN_BUDGET_PER_KEY_LLM01) is counted
+  separately for that lab
+
+A request's worst case (prompt plus max_tokens) is reserved when it is
+admitted and settled to the actual usage when it finishes, so concurrent
+requests cannot all pass against the same remaining budget.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from tools import get_tool_schemas
+
+from .lab_settings import has_lab_override, lab_setting
+from .metrics import count_rejection
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional, counts are estimated instead
+    tiktoken = None
+
+MAX_PROMPT_TOKENS = 12000
+MAX_COMPLETION_TOKENS = 4096
+TOKEN_BUDGET_WINDOW_SECONDS = float(os.getenv("TOKEN_BUDGET_WINDOW_SECONDS", "3600"))
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "4096"))
+
+# Longer texts (scraped pages, tool results) are rarely repeated and are
+# counted without keeping them in the cache
+_CACHED_TEXT_MAX_CHARS = 16384
+
+# Per-message framing tokens of the chat format, and the reply primer
+_TOKENS_PER_MESSAGE = 3
+_TOKENS_PER_REPLY = 3
+
+_TRUNCATED = " [truncated]"
+
+
+# Model names come from clients, so caches keyed by them are bounded
+_MODEL_CACHE_SIZE = 64
+
+
+@lru_cache(maxsize=_MODEL_CACHE_SIZE)
+def _encoding(model: str):
+    """tiktoken encoding for a model, or None when counts are estimated."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # The encoding files could not be loaded (e.g. offline)
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """Tokens in `text` for `model`."""
+    if not text:
+        return 0
+    if len(text) > _CACHED_TEXT_MAX_CHARS:
+        return _count_tokens(text, model)
+    return _count_tokens_cached(text, model)
+
+
+def _count_tokens(text: str, model: str) -> int:
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+_count_tokens_cached = lru_cache(maxsize=TOKEN_COUNT_CACHE_SIZE)(_count_tokens)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = "gpt-3.5-turbo") -> str:
+    """Cut `text` down to at most `max_tokens` tokens."""
+    if max_tokens <= 0:
+        return ""
+    encoding = _encoding(model)
+    if encoding is None:
+        return text[: max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def message_text(message: Dict[str, Any]) -> str:
+    """Text of a chat message; multi-part content is reduced to its text parts."""
+    content = message.get("content")
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    return "".join(
+        part.get("text", "") if isinstance(part, dict) else str(part)
+        for part in content
+    )
+
+
+def message_tokens(message: Dict[str, Any], model: str) -> int:
+    """Tokens one message adds to a prompt, including its framing."""
+    total = _TOKENS_PER_MESSAGE + count_tokens(message_text(message), model)
+    if message.get("name"):
+        total += count_tokens(message["name"], model)
+    for tool_call in message.get("tool_calls") or []:
+        function = tool_call.get("function", {})
+        total += count_tokens(function.get("name", ""), model)
+        total += count_tokens(function.get("arguments", ""), model)
+    return total
+
+
+@lru_cache(maxsize=_MODEL_CACHE_SIZE)
+def _tool_schema_tokens(tool_type: str, model: str) -> int:
+    schemas = get_tool_schemas(tool_type)
+    return count_tokens(json.dumps(schemas, sort_keys=True), model) if schemas else 0
+
+
+def estimate_prompt_tokens(
+    messages: List[Dict[str, Any]], model: str, tool_type: Optional[str] = None
+) -> int:
+    """
+    Prompt tokens of a chat completion request with these messages, offering
+    the tools of `tool_type` (see tools.get_tool_schemas).
+    """
+    total = _TOKENS_PER_REPLY
+    for message in messages:
+        total += message_tokens(message, model)
+    if tool_type:
+        total += _tool_schema_tokens(tool_type, model)
+    return total
+
+
+def max_prompt_tokens(lab: str) -> int:
+    return lab_setting("MAX_PROMPT_TOKENS", lab, MAX_PROMPT_TOKENS)
+
+
+def max_completion_tokens(lab: str) -> int:
+    return lab_setting("MAX_COMPLETION_TOKENS", lab, MAX_COMPLETION_TOKENS)
+
+
+class TokenBudgetExceeded(Exception):
+    """A request would exceed a token limit or budget."""
+
+    def __init__(self, message: str, status_code: int, retry_after: float = 0.0):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+@dataclass
+class TokenReservation:
+    """
+    Tokens held in the budget windows of an admitted request until its
+    actual usage is known.
+    """
+
+    prompt_tokens: int
+    tokens: int = 0
+    windows: List[List[float]] = field(default_factory=list)
+    settled: bool = False
+
+
+class TokenBudget:
+    """
+    Tokens spent per key in fixed time windows.
+
+    Keys are API key hashes ("key:..." or, for labs with a budget of their
+    own, "key:<lab>:...") and lab names ("lab:..."); the least recently used
+    keys are forgotten once more than `max_keys` are tracked.
+    """
+
+    def __init__(
+        self, window_seconds: float = TOKEN_BUDGET_WINDOW_SECONDS, max_keys: int = 10000
+    ):
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self.checked = 0
+        self.rejected_prompt = 0
+        self.rejected_budget = 0
+        self.truncated_tool_results = 0
+        self.estimated_prompt_tokens = 0
+        self.actual_prompt_tokens = 0
+        self.spent_tokens = 0
+        self._windows: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _window(self, key: str, now: float) -> List[float]:
+        """[window start, tokens spent] for a key, starting a new window if due."""
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.window_seconds:
+            window = [now, 0]
+            self._windows[key] = window
+            while len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+        self._windows.move_to_end(key)
+        return window
+
+    def check(
+        self, lab: str, api_key: Optional[str], prompt_tokens: int, max_tokens: int
+    ) -> TokenReservation:
+        """
+        Admit a request or raise TokenBudgetExceeded.
+
+        The request is admitted while its key and lab have budget left; the
+        worst case (prompt plus max_tokens) must fit the remaining budget and
+        is reserved until record() or release() settles it. A worst case
+        larger than a whole budget is rejected with 413 rather than 429.
+        """
+        reservation = TokenReservation(prompt_tokens)
+        with self._lock:
+            self.checked += 1
+            limit = max_prompt_tokens(lab)
+            if prompt_tokens > limit:
+                self.rejected_prompt += 1
+                count_rejection("prompt_too_large", lab)
+                raise TokenBudgetExceeded(
+                    f"Prompt of {prompt_tokens} tokens exceeds the limit of "
+                    f"{limit} tokens for this lab",
+                    status_code=413,
+                )
+            now = time.monotonic()
+            needed = prompt_tokens + max_tokens
+            for name, key in (
+                ("TOKEN_BUDGET_PER_KEY", _budget_key(api_key, lab)),
+                ("TOKEN_BUDGET_PER_LAB", f"lab:{lab}"),
+            ):
+                budget = lab_setting(name, lab, 0)
+                if not budget:
+                    continue
+                scope = "API key" if key.startswith("key:") else "lab"
+                if needed > budget:
+                    # No window would ever have room, so retrying cannot help
+                    self.rejected_budget += 1
+                    count_rejection("request_too_large", lab)
+                    raise TokenBudgetExceeded(
+                        f"Request of up to {needed} tokens exceeds the token "
+                        f"budget of {budget} for this {scope}",
+                        status_code=413,
+                    )
+                window = self._window(key, now)
+                if window[1] + needed > budget:
+                    self.rejected_budget += 1
+                    count_rejection("token_budget", lab)
+                    raise TokenBudgetExceeded(
+                        f"Token budget of {budget} per "
+                        f"{self.window_seconds:g} seconds for this {scope} is used up",
+                        status_code=429,
+                        retry_after=window[0] + self.window_seconds - now,
+                    )
+                reservation.windows.append(window)
+            # Only reserved once every budget has room
+            reservation.tokens = needed
+            for window in reservation.windows:
+                window[1] += needed
+        return reservation
+
+    def fit_tool_results(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        tool_type: Optional[str],
+        lab: str,
+    ) -> None:
+        """Truncate tool results in place, largest first, until the prompt fits."""
+        size = estimate_prompt_tokens(messages, model, tool_type)
+        excess = size - max_prompt_tokens(lab)
+        if excess <= 0:
+            return
+        results = sorted(
+            (message for message in messages if message["role"] == "tool"),
+            key=lambda message: count_tokens(message["content"], model),
+            reverse=True,
+        )
+        for message in results:
+            if excess <= 0:
+                break
+            size = count_tokens(message["content"], model)
+            keep = max(size - excess - count_tokens(_TRUNCATED, model), 0)
+            message["content"] = (
+                truncate_to_tokens(message["content"], keep, model) + _TRUNCATED
+            )
+            excess -= size - count_tokens(message["content"], model)
+            with self._lock:
+                self.truncated_tool_results += 1
+
+    def record(
+        self,
+        lab: str,
+        api_key: Optional[str],
+        usage: Optional[Dict[str, int]],
+        estimated_prompt_tokens: int = 0,
+        reservation: Optional[TokenReservation] = None,
+    ) -> None:
+        """
+        Charge the actual usage of a finished request to its key and lab.
+
+        With the request's `reservation` the reserved tokens are replaced by
+        the usage; without one (e.g. for a history summary) the usage is
+        added to the current windows.
+        """
+        spent = usage.get("total_tokens", 0) if usage else 0
+        now = time.monotonic()
+        with self._lock:
+            self.spent_tokens += spent
+            if usage and estimated_prompt_tokens:
+                self.estimated_prompt_tokens += estimated_prompt_tokens
+                self.actual_prompt_tokens += usage.get("prompt_tokens", 0)
+            if reservation is not None:
+                self._settle(reservation, spent)
+            elif spent:
+                for name, key in (
+                    ("TOKEN_BUDGET_PER_KEY", _budget_key(api_key, lab)),
+                    ("TOKEN_BUDGET_PER_LAB", f"lab:{lab}"),
+                ):
+                    if lab_setting(name, lab, 0):
+                        self._window(key, now)[1] += spent
+
+    def release(
+        self, reservation: TokenReservation, usage: Optional[Dict[str, int]] = None
+    ) -> None:
+        """
+        Settle the reservation of a request that failed, charging the `usage`
+        of any completions it made. Does nothing once the request is recorded.
+        """
+        spent = usage.get("total_tokens", 0) if usage else 0
+        with self._lock:
+            if not reservation.settled:
+                self.spent_tokens += spent
+                self._settle(reservation, spent)
+
+    def _settle(self, reservation: TokenReservation, spent: int) -> None:
+        if reservation.settled:
+            return
+        reservation.settled = True
+        # Windows that have been reset since are no longer counted against
+        for window in reservation.windows:
+            window[1] += spent - reservation.tokens
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "tokenizer": "tiktoken" if _encoding("gpt-3.5-turbo") else "estimate",
+                "checked": self.checked,
+                "rejected_prompt_too_large": self.rejected_prompt,
+                "rejected_budget": self.rejected_budget,
+                "truncated_tool_results": self.truncated_tool_results,
+                "spent_tokens": self.spent_tokens,
+                # Actual over estimated prompt tokens, for calibrating the estimate
+                "prompt_estimate_ratio": (
+                    self.actual_prompt_tokens / self.estimated_prompt_tokens
+                    if self.estimated_prompt_tokens
+                    else None
+                ),
+                "tracked_keys": len(self._windows),
+                "count_cache": _count_tokens_cached.cache_info()._asdict(),
+            }
+
+
+def _budget_key(api_key: Optional[str], lab: str) -> str:
+    # Never keep raw API keys around as dictionary keys
+    digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+    if has_lab_override("TOKEN_BUDGET_PER_KEY", lab):
+        return f"key:{lab}:{digest}"
+    return f"key:{digest}"
+
+
+_budget = TokenBudget()
+
+
+def get_token_budget() -> TokenBudget:
+    """Get the process-wide token budget."""
+    return _budget
+
+
+def get_token_budget_stats() -> Dict[str, Any]:
+    """Get rejection counts, spent tokens and tokenizer cache statistics."""
+    return _budget.stats()
@@ -0,0 +1,313 @@
+"""
+Similarity search indexes over a VectorStore.
+
+Backends:
+    exact  brute-force cosine similarity over the memory-mapped store
+    ivf    faiss inverted-file index (approximate, trained on the corpus)
+    hnsw   faiss HNSW graph (approximate, no training)
+    auto   exact until the store reaches LLM08_INDEX_ANN_THRESHOLD rows, then hnsw
+
+The faiss backends are optional and fall back to exact search when faiss-cpu
+is not installed. Approximate indexes are updated incrementally as rows are
+appended, rebuilt when the store is compacted, and saved next to the store.
+"""
+
+import abc
+import json
+import logging
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+
+from .vector_store import VectorStore
+
+try:
+    import faiss
+except ImportError:  # faiss-cpu is optional
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+INDEX_BACKEND = os.getenv("LLM08_INDEX", "auto")
+AUTO_ANN_THRESHOLD = int(os.getenv("LLM08_INDEX_ANN_THRESHOLD", "20000"))
+IVF_NPROBE = int(os.getenv("LLM08_IVF_NPROBE", "16"))
+IVF_MIN_TRAIN = int(os.getenv("LLM08_IVF_MIN_TRAIN", "1000"))
+HNSW_M = int(os.getenv("LLM08_HNSW_M", "32"))
+HNSW_EF_SEARCH = int(os.getenv("LLM08_HNSW_EF_SEARCH", "64"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("LLM08_HNSW_EF_CONSTRUCTION", "80"))
+# Persist an approximate index after this many incremental additions
+INDEX_SAVE_EVERY = int(os.getenv("LLM08_INDEX_SAVE_EVERY", "1000"))
+
+
+def top_k_similar(
+    matrix: np.ndarray, norms: np.ndarray, query: np.ndarray, top_k: int
+) -> np.ndarray:
+    """
+    Indices of the top_k rows of `matrix` by cosine similarity to `query`.
+
+    `norms` holds the precomputed L2 norm of every row so a search costs one
+    matrix-vector product plus an O(N) partial selection.
+    """
+    query_norm = np.linalg.norm(query)
+    if not len(matrix) or query_norm == 0:
+        return np.empty(0, dtype=np.int64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        similarities = (matrix @ query) / (norms * query_norm)
+    # Rows without a usable embedding never match
+    similarities = np.nan_to_num(similarities, nan=-np.inf, posinf=-np.inf)
+
+    top_k = min(top_k, len(similarities))
+    candidates = np.argpartition(-similarities, top_k - 1)[:top_k]
+    candidates = candidates[np.isfinite(similarities[candidates])]
+    return candidates[np.argsort(-similarities[candidates], kind="stable")]
+
+
+class VectorIndex:
+    """Exact (brute-force) search; also the interface for the other backends."""
+
+    kind = "exact"
+
+    def __init__(self, store: VectorStore):
+        self.store = store
+
+    def search(self, query: np.ndarray, top_k: int) -> np.ndarray:
+        """Row ids of the top_k live rows most similar to query."""
+        with self.store.lock:
+            return top_k_similar(self.store.matrix, self.store.norms, query, top_k)
+
+    def save(self) -> None:
+        """Persist the index next to the store (no-op for exact search)."""
+
+
+class _FaissIndex(VectorIndex, abc.ABC):
+    """
+    Shared logic for faiss indexes over normalized vectors (cosine = IP).
+
+    Backends implement _create; one that does not cannot be instantiated.
+    """
+
+    def __init__(self, store: VectorStore):
+        super().__init__(store)
+        self.index = None
+        self.generation = -1
+        self.count = 0
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.store.path, f"index-{self.kind}.faiss")
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.store.path, f"index-{self.kind}.json")
+
+    @abc.abstractmethod
+    def _create(self, vectors: np.ndarray):
+        """Build an empty, ready-to-add faiss index sized for `vectors`."""
+
+    def _configure(self) -> None:
+        """Apply search-time parameters to self.index."""
+
+    def _vectors(self, start: int, end: int):
+        """Normalized vectors and row ids for rows [start, end) that can match."""
+        matrix = np.asarray(self.store.matrix[start:end], dtype=np.float32)
+        norms = np.asarray(self.store.norms[start:end])
+        keep = norms > 0
+        ids = np.arange(start, end, dtype=np.int64)[keep]
+        vectors = matrix[keep] / norms[keep, np.newaxis]
+        return np.ascontiguousarray(vectors, dtype=np.float32), ids
+
+    def _rebuild(self) -> None:
+        vectors, ids = self._vectors(0, len(self.store))
+        self.index = self._create(vectors)
+        if self.index is not None and len(ids):
+            self.index.add_with_ids(vectors, ids)
+        self.generation = self.store.generation
+        self.count = len(self.store)
+        self._configure()
+        logger.info(f"Built {self.kind} index over {len(ids)} vectors")
+        self.save()
+
+    def sync(self) -> None:
+        """Bring the index up to date with the store."""
+        with self.store.lock:
+            if self.generation != self.store.generation or self.index is None:
+                self._rebuild()
+            elif len(self.store) > self.count:
+                start, end = self.count, len(self.store)
+                vectors, ids = self._vectors(start, end)
+                if len(ids):
+                    self.index.add_with_ids(vectors, ids)
+                self.count = end
+                self._unsaved += end - start
+                if self._unsaved >= INDEX_SAVE_EVERY:
+                    self.save()
+
+    def search(self, query: np.ndarray, top_k: int) -> np.ndarray:
+        with self._lock, self.store.lock:
+            self.sync()
+            if self.index is None:
+                # Not enough data to build this index yet
+                return super().search(query, top_k)
+
+            query_norm = np.linalg.norm(query)
+            if query_norm == 0 or not self.index.ntotal:
+                return np.empty(0, dtype=np.int64)
+            query = np.asarray(query / query_norm, dtype=np.float32)[np.newaxis, :]
+
+            # Deleted rows stay in the index until compaction, so over-fetch
+            fetch = min(top_k + self.store.deleted_count, self.index.ntotal)
+            _, ids = self.index.search(query, fetch)
+            ids = [int(i) for i in ids[0] if i >= 0 and not self.store.is_deleted(i)]
+            return np.asarray(ids[:top_k], dtype=np.int64)
+
+    def save(self) -> None:
+        with self.store.lock:
+            self._save()
+
+    def _save(self) -> None:
+        if self.index is None:
+            return
+        try:
+            # Write then rename so other workers never load a partial index
+            faiss.write_index(self.index, f"{self._index_path}.tmp")
+            os.replace(f"{self._index_path}.tmp", self._index_path)
+            with open(f"{self._meta_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump({"generation": self.generation, "count": self.count}, f)
+            os.replace(f"{self._meta_path}.tmp", self._meta_path)
+            self._unsaved = 0
+        except Exception as e:
+            logger.error(f"Error saving {self.kind} index: {e}")
+
+    def _load(self) -> None:
+        """Load a saved index if it matches the store's current generation."""
+        # Saves happen under the store lock, so the index and its meta match
+        with self.store.lock:
+            self._load_saved()
+
+    def _load_saved(self) -> None:
+        if not (os.path.exists(self._index_path) and os.path.exists(self._meta_path)):
+            return
+        try:
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["generation"] != self.store.generation or meta["count"] > len(
+                self.store
+            ):
+                return
+            self.index = faiss.read_index(self._index_path)
+            self.generation = meta["generation"]
+            self.count = meta["count"]
+            self._configure()
+            logger.info(f"Loaded {self.kind} index with {self.index.ntotal} vectors")
+        except Exception as e:
+            logger.error(f"Error loading {self.kind} index: {e}")
+            self.index = None
+
+
+class IVFIndex(_FaissIndex):
+    """Inverted-file index; searches the LLM08_IVF_NPROBE closest clusters."""
+
+    kind = "ivf"
+
+    def _create(self, vectors: np.ndarray):
+        if len(vectors) < IVF_MIN_TRAIN:
+            return None
+        # Roughly sqrt(N) clusters, with enough points per cluster to train
+        nlist = max(1, min(int(np.sqrt(len(vectors))), len(vectors) // 39))
+        quantizer = faiss.IndexFlatIP(vectors.shape[1])
+        index = faiss.IndexIVFFlat(
+            quantizer, vectors.shape[1], nlist, faiss.METRIC_INNER_PRODUCT
+        )
+        index.train(vectors)
+        return index
+
+    def sync(self) -> None:
+        # Keep using exact search until there is enough data to train
+        if self.index is None and len(self.store) < IVF_MIN_TRAIN:
+            return
+        super().sync()
+
+    def _configure(self) -> None:
+        if self.index is not None:
+            faiss.extract_index_ivf(self.index).nprobe = IVF_NPROBE
+
+
+class HNSWIndex(_FaissIndex):
+    """Hierarchical navigable small-world graph index."""
+
+    kind = "hnsw"
+
+    def _create(self, vectors: np.ndarray):
+        hnsw = faiss.IndexHNSWFlat(self.store.dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        # HNSW has no native ids; map faiss positions back to store rows
+        return faiss.IndexIDMap(hnsw)
+
+    def _configure(self) -> None:
+        if self.index is not None:
+            faiss.downcast_index(self.index.index).hnsw.efSearch = HNSW_EF_SEARCH
+
+
+class AutoIndex(VectorIndex):
+    """Exact search for small stores, switching to HNSW once the store is large."""
+
+    kind = "auto"
+
+    def __init__(self, store: VectorStore):
+        super().__init__(store)
+        self._ann: Optional[HNSWIndex] = None
+
+    def search(self, query: np.ndarray, top_k: int) -> np.ndarray:
+        if self._ann is None and len(self.store) >= AUTO_ANN_THRESHOLD:
+            self._ann = HNSWIndex(self.store)
+        if self._ann is not None:
+            return self._ann.search(query, top_k)
+        return super().search(query, top_k)
+
+    def save(self) -> None:
+        if self._ann is not None:
+            self._ann.save()
+
+
+_BACKENDS = {
+    "exact": VectorIndex,
+    "ivf": IVFIndex,
+    "hnsw": HNSWIndex,
+    "auto": AutoIndex,
+}
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def make_vector_index(store: VectorStore, backend: str = INDEX_BACKEND) -> VectorIndex:
+    """Create an index of the requested backend over a store."""
+    if backend not in _BACKENDS:
+        raise ValueError(f"Unknown vector index backend: {backend}")
+    if faiss is None and backend != "exact":
+        if backend != "auto":
+            logger.warning(
+                f"faiss is not installed, using exact search instead of {backend}"
+            )
+        backend = "exact"
+    return _BACKENDS[backend](store)
+
+
+def get_vector_index(store: VectorStore, backend: str = INDEX_BACKEND) -> VectorIndex:
+    """Get the shared index for a store, creating it on first use."""
+    with _indexes_lock:
+        index = _indexes.get(store.path)
+        if index is None or index.store is not store:
+            index = _indexes[store.path] = make_vector_index(store, backend)
+        return index
+
+
+def remove_vector_index(path: str) -> None:
+    """Forget the shared index for a store directory (its files live in the store)."""
+    with _indexes_lock:
+        _indexes.pop(os.path.abspath(path), None)
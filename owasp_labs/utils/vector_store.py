@@ -0,0 +1,507 @@
+"""
+Append-only, memory-mapped document and embedding store.
+
+Layout of a store directory:
+
+    CURRENT           name of the live generation directory
+    gen-<n>/
+        meta.json     {"dim": <embedding dimension>}
+        embeddings.f32  float32 rows of `dim` values, one per document
+        norms.f32       float32 L2 norm of each embedding row
+        offsets.u64     (start, length) uint64 pairs into documents.log
+        documents.log   UTF-8 document bodies, back to back
+        deleted.u64     uint64 ids of deleted rows
+
+Inserts append one record to each file, so they cost O(1) I/O regardless of
+the store size. Opening a store maps the embedding and norm files instead of
+parsing them. Deleted rows are only masked; `compact` rewrites the live rows
+into a new generation and switches CURRENT atomically to reclaim the space.
+
+Several server workers can share a store directory: `lock` also takes an
+flock on the LOCK file and, when first acquired, picks up rows, deletions and
+compactions written by other processes.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Iterator, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; stores are then per-process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Compact once this fraction of rows (and at least COMPACT_MIN_DELETED) is deleted
+COMPACT_RATIO = float(os.getenv("VECTOR_STORE_COMPACT_RATIO", "0.25"))
+COMPACT_MIN_DELETED = int(os.getenv("VECTOR_STORE_COMPACT_MIN_DELETED", "16"))
+
+_EMBEDDINGS = "embeddings.f32"
+_NORMS = "norms.f32"
+_OFFSETS = "offsets.u64"
+_DOCUMENTS = "documents.log"
+_DELETED = "deleted.u64"
+_META = "meta.json"
+
+
+def _write_atomic(path: str, data: str) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _file_size(path: str) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+class _StoreLock:
+    """
+    Reentrant lock shared by this process's threads and, via flock, by other
+    processes using the same store. `on_acquire` runs on every outermost
+    acquire so the holder sees what other processes wrote.
+    """
+
+    def __init__(self, path: str, on_acquire):
+        self._path = path
+        self._on_acquire = on_acquire
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd: Optional[int] = None
+
+    def acquire(self) -> None:
+        self._rlock.acquire()
+        self._depth += 1
+        if self._depth > 1:
+            return
+        try:
+            if fcntl is not None:
+                if self._fd is None:
+                    self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            self._on_acquire()
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self) -> None:
+        self._depth -= 1
+        if not self._depth and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._rlock.release()
+
+    def close(self) -> None:
+        with self._rlock:
+            if self._fd is not None and not self._depth:
+                os.close(self._fd)
+                self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class VectorStore:
+    """
+    Append-only store of documents with one float32 embedding each.
+
+    Row ids are stable until the next compaction; `generation` changes on
+    every compaction so callers holding row ids can tell when to refresh them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dim: Optional[int] = None
+        self.generation = 0
+        self._count = 0
+        self._deleted = np.zeros(0, dtype=bool)
+        self._deleted_count = 0
+        self._deleted_entries = 0
+        self._matrix: Optional[np.ndarray] = None
+        self._norms: Optional[np.ndarray] = None
+        self._offsets: Optional[np.ndarray] = None
+        self._files = {}
+        self._reader = None
+        # Size of the live generation, kept up to date by every write
+        self._bytes = 0
+        os.makedirs(path, exist_ok=True)
+        self._lock = _StoreLock(os.path.join(path, "LOCK"), self._sync_with_disk)
+        with self._lock:
+            self._open()
+
+    def _generation_dir(self, generation: int) -> str:
+        return os.path.join(self.path, f"gen-{generation}")
+
+    def _read_generation(self) -> Optional[int]:
+        current = os.path.join(self.path, "CURRENT")
+        if not os.path.exists(current):
+            return None
+        with open(current, "r", encoding="utf-8") as f:
+            return int(f.read().strip().split("-")[-1])
+
+    def _open(self) -> None:
+        generation = self._read_generation()
+        if generation is not None:
+            self.generation = generation
+        else:
+            self.generation = 0
+            os.makedirs(self._generation_dir(0), exist_ok=True)
+            _write_atomic(os.path.join(self.path, "CURRENT"), "gen-0")
+
+        directory = self._generation_dir(self.generation)
+        self._load_state(directory)
+        for name in (_EMBEDDINGS, _NORMS, _OFFSETS, _DOCUMENTS, _DELETED):
+            self._files[name] = open(os.path.join(directory, name), "ab")
+        self._reader = open(os.path.join(directory, _DOCUMENTS), "rb")
+        self._measure()
+
+    def _load_state(self, directory: str) -> None:
+        """Read the dimension, row count and deletions of a generation."""
+        meta_path = os.path.join(directory, _META)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+
+        self._recover(directory)
+        deleted_path = os.path.join(directory, _DELETED)
+        deleted = np.zeros(0, dtype=np.uint64)
+        if os.path.exists(deleted_path):
+            deleted = np.fromfile(deleted_path, dtype=np.uint64)
+        self._deleted_entries = len(deleted)
+        self._deleted = np.zeros(self._count, dtype=bool)
+        self._deleted[deleted[deleted < self._count].astype(np.int64)] = True
+        self._deleted_count = int(self._deleted.sum())
+        self._invalidate()
+
+    def _sync_with_disk(self) -> None:
+        """Pick up changes other processes made while we did not hold the lock."""
+        if not self._files:
+            return
+        generation = self._read_generation()
+        if generation is not None and generation != self.generation:
+            # Another process compacted the store
+            self._close_files()
+            self._open()
+            return
+        directory = self._generation_dir(self.generation)
+        offsets_size = _file_size(os.path.join(directory, _OFFSETS))
+        deleted_size = _file_size(os.path.join(directory, _DELETED))
+        if offsets_size != self._count * 16 or deleted_size != self._deleted_entries * 8:
+            # Another process appended or deleted rows
+            self._load_state(directory)
+            self._measure()
+
+    def _recover(self, directory: str) -> None:
+        """Trim files to the last row that was completely written to all of them."""
+        if not self.dim:
+            self._count = 0
+            return
+        row_bytes = self.dim * 4
+        paths = {
+            name: os.path.join(directory, name)
+            for name in (_EMBEDDINGS, _NORMS, _OFFSETS, _DOCUMENTS)
+        }
+        count = min(
+            _file_size(paths[_EMBEDDINGS]) // row_bytes,
+            _file_size(paths[_NORMS]) // 4,
+            _file_size(paths[_OFFSETS]) // 16,
+        )
+        log_size = _file_size(paths[_DOCUMENTS])
+        offsets = np.zeros((0, 2), dtype=np.uint64)
+        if count:
+            offsets = np.fromfile(paths[_OFFSETS], dtype=np.uint64, count=count * 2)
+            offsets = offsets.reshape(-1, 2)
+        # The last offset must point inside the document log
+        while count and int(offsets[count - 1].sum()) > log_size:
+            count -= 1
+
+        expected = {
+            _EMBEDDINGS: count * row_bytes,
+            _NORMS: count * 4,
+            _OFFSETS: count * 16,
+            _DOCUMENTS: int(offsets[count - 1].sum()) if count else 0,
+        }
+        for name, size in expected.items():
+            if _file_size(paths[name]) > size:
+                logger.warning(f"Truncating partial write in {paths[name]}")
+                with open(paths[name], "r+b") as f:
+                    f.truncate(size)
+        self._count = count
+
+    def _measure(self) -> None:
+        directory = self._generation_dir(self.generation)
+        self._bytes = sum(
+            _file_size(os.path.join(directory, name)) for name in os.listdir(directory)
+        )
+
+    def _invalidate(self) -> None:
+        """Drop cached maps so the next read sees appended rows."""
+        self._matrix = None
+        self._norms = None
+        self._offsets = None
+
+    def _map(self, name: str, dtype, shape) -> np.ndarray:
+        if not shape[0]:
+            return np.zeros(shape, dtype=dtype)
+        path = os.path.join(self._generation_dir(self.generation), name)
+        return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+    def __len__(self) -> int:
+        """Number of rows, including deleted ones (the valid row-id range)."""
+        return self._count
+
+    @property
+    def live_count(self) -> int:
+        """Number of rows that have not been deleted."""
+        return self._count - self._deleted_count
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Embeddings as a read-only (rows, dim) float32 memory map."""
+        with self._lock:
+            if self._matrix is None:
+                self._flush()
+                self._matrix = self._map(
+                    _EMBEDDINGS, np.float32, (self._count, self.dim or 0)
+                )
+            return self._matrix
+
+    @property
+    def norms(self) -> np.ndarray:
+        """Row norms; deleted rows report 0 so similarity search skips them."""
+        with self._lock:
+            if self._norms is None:
+                self._flush()
+                norms = self._map(_NORMS, np.float32, (self._count,))
+                if self._deleted_count:
+                    norms = np.where(self._deleted, np.float32(0), norms)
+                self._norms = norms
+            return self._norms
+
+    @property
+    def deleted_count(self) -> int:
+        """Number of deleted rows not yet reclaimed by compaction."""
+        return self._deleted_count
+
+    @property
+    def lock(self) -> _StoreLock:
+        """Lock serializing writers across threads and worker processes."""
+        return self._lock
+
+    def is_deleted(self, row: int) -> bool:
+        return bool(self._deleted[row])
+
+    def document(self, row: int) -> str:
+        """Read one document body by row id."""
+        with self._lock:
+            if self._offsets is None:
+                self._flush()
+                self._offsets = self._map(_OFFSETS, np.uint64, (self._count, 2))
+            start, length = (int(v) for v in self._offsets[row])
+            self._reader.seek(start)
+            return self._reader.read(length).decode("utf-8")
+
+    def documents(self, rows: Sequence[int]) -> List[str]:
+        with self._lock:
+            return [self.document(int(row)) for row in rows]
+
+    def live_rows(self) -> np.ndarray:
+        """Row ids that have not been deleted, oldest first."""
+        return np.flatnonzero(~self._deleted)
+
+    def iter_documents(self) -> Iterator[str]:
+        for row in self.live_rows():
+            yield self.document(int(row))
+
+    def _flush(self) -> None:
+        for f in self._files.values():
+            f.flush()
+
+    def append(self, document: str, embedding) -> int:
+        """
+        Append one document and its embedding.
+
+        Returns:
+            int: Row id of the new document
+        """
+        return self.extend(
+            [document], np.asarray(embedding, dtype=np.float32)[np.newaxis, :]
+        )[0]
+
+    def extend(self, documents: Sequence[str], embeddings) -> List[int]:
+        """Append many documents with their embeddings in one write per file."""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or len(embeddings) != len(documents):
+            raise ValueError("Expected one embedding row per document")
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(embeddings.shape[1])
+                meta = json.dumps({"dim": self.dim})
+                _write_atomic(
+                    os.path.join(self._generation_dir(self.generation), _META), meta
+                )
+                self._bytes += len(meta)
+            elif embeddings.shape[1] != self.dim:
+                raise ValueError(
+                    f"Embedding dimension {embeddings.shape[1]} does not match store dimension {self.dim}"
+                )
+
+            bodies = [document.encode("utf-8") for document in documents]
+            # Other processes may have appended since this handle last wrote
+            self._files[_DOCUMENTS].seek(0, os.SEEK_END)
+            start = self._files[_DOCUMENTS].tell()
+            offsets = np.empty((len(bodies), 2), dtype=np.uint64)
+            for i, body in enumerate(bodies):
+                offsets[i] = (start, len(body))
+                start += len(body)
+
+            # Documents first: a row only becomes visible once its offsets,
+            # norms and embedding are all written (see _recover)
+            self._files[_DOCUMENTS].write(b"".join(bodies))
+            self._files[_OFFSETS].write(offsets.tobytes())
+            self._files[_NORMS].write(
+                np.linalg.norm(embeddings, axis=1).astype(np.float32).tobytes()
+            )
+            self._files[_EMBEDDINGS].write(embeddings.tobytes())
+            self._flush()
+            self._bytes += (
+                sum(len(body) for body in bodies)
+                + offsets.nbytes
+                + 4 * len(bodies)
+                + embeddings.nbytes
+            )
+
+            first = self._count
+            self._count += len(bodies)
+            self._deleted = np.concatenate(
+                [self._deleted, np.zeros(len(bodies), dtype=bool)]
+            )
+            self._invalidate()
+            return list(range(first, self._count))
+
+    def delete(self, rows: Sequence[int]) -> None:
+        """Mark rows as deleted, compacting once enough space can be reclaimed."""
+        with self._lock:
+            rows = [int(row) for row in rows if not self._deleted[int(row)]]
+            if not rows:
+                return
+            self._files[_DELETED].write(np.asarray(rows, dtype=np.uint64).tobytes())
+            self._files[_DELETED].flush()
+            self._bytes += 8 * len(rows)
+            self._deleted_entries += len(rows)
+            self._deleted[rows] = True
+            self._deleted_count += len(rows)
+            self._norms = None
+            if (
+                self._deleted_count >= COMPACT_MIN_DELETED
+                and self._deleted_count >= COMPACT_RATIO * self._count
+            ):
+                self.compact()
+
+    def compact(self) -> None:
+        """Rewrite live rows into a new generation and reclaim deleted space."""
+        with self._lock:
+            self._flush()
+            live = self.live_rows()
+            documents = self.documents(live)
+            embeddings = np.array(self.matrix[live]) if len(live) else None
+
+            old_generation = self.generation
+            new_generation = old_generation + 1
+            new_dir = self._generation_dir(new_generation)
+            shutil.rmtree(new_dir, ignore_errors=True)
+            os.makedirs(new_dir)
+
+            bodies = [document.encode("utf-8") for document in documents]
+            offsets = np.zeros((len(bodies), 2), dtype=np.uint64)
+            position = 0
+            for i, body in enumerate(bodies):
+                offsets[i] = (position, len(body))
+                position += len(body)
+            with open(os.path.join(new_dir, _DOCUMENTS), "wb") as f:
+                f.write(b"".join(bodies))
+            with open(os.path.join(new_dir, _OFFSETS), "wb") as f:
+                f.write(offsets.tobytes())
+            with open(os.path.join(new_dir, _EMBEDDINGS), "wb") as f:
+                if embeddings is not None:
+                    f.write(embeddings.tobytes())
+            with open(os.path.join(new_dir, _NORMS), "wb") as f:
+                if embeddings is not None:
+                    f.write(
+                        np.linalg.norm(embeddings, axis=1).astype(np.float32).tobytes()
+                    )
+            open(os.path.join(new_dir, _DELETED), "wb").close()
+            if self.dim is not None:
+                _write_atomic(
+                    os.path.join(new_dir, _META), json.dumps({"dim": self.dim})
+                )
+
+            # Switch generations atomically, then reopen on the new files
+            self._close_files()
+            _write_atomic(os.path.join(self.path, "CURRENT"), f"gen-{new_generation}")
+            shutil.rmtree(self._generation_dir(old_generation), ignore_errors=True)
+            self._open()
+            logger.info(
+                f"Compacted {self.path}: {len(live)} live rows in generation {new_generation}"
+            )
+
+    def _close_files(self) -> None:
+        self._invalidate()
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_files()
+        self._lock.close()
+
+    def disk_bytes(self) -> int:
+        """Bytes used on disk by the live generation, without touching the disk."""
+        return self._bytes
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_vector_store(path: str) -> VectorStore:
+    """Get the shared VectorStore for a directory so appends go through one writer."""
+    path = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = VectorStore(path)
+        return store
+
+
+def remove_vector_store(path: str) -> None:
+    """Close the shared store for a directory and delete its files."""
+    path = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.pop(path, None)
+        if store is not None:
+            store.close()
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def close_vector_store(path: str) -> None:
+    """Close the shared store for a directory, keeping its files."""
+    path = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.pop(path, None)
+    if store is not None:
+        store.close()